@@ -1,15 +1,14 @@
 from datetime import datetime, timedelta
-import pandas as pd
-from airflow import DAG
-import requests
-import psycopg2
-from psycopg2 import pool
-from config import DB_CONFIG  # Import the configuration from the config.py file
 import logging
+from airflow import DAG
 from airflow.operators.python_operator import PythonOperator
 from airflow.operators.python_operator import BranchPythonOperator
-from airflow.hooks.postgres_hook import PostgresHook
 from airflow.exceptions import AirflowException
+from config import BACKFILL_MEMORY_CEILING, DB_CONFIG, INTERVALS, KLINE_CACHE_DIR, KLINE_CACHE_MAX_BYTES, METRICS_TEXTFILE_DIR, STATSD_ADDRESS, UNIVERSE_QUOTES, UNIVERSE_SIZE, UNIVERSE_TTL_SECONDS  # Import the configuration from the config.py file
+
+# The scheduler re-parses this file every few seconds, so it only imports Airflow primitives at the top.
+# pandas, psycopg2, requests and the binance_etl modules are imported inside the task callables, which
+# only run on the workers (see benchmarks/dag_parse.py for the parse-time budget).
 
 # Define default arguments for the DAG
 default_args = {
@@ -22,6 +21,19 @@ default_args = {
     'retry_delay': timedelta(minutes=1),
 }
 
+# Preferred shard size in pages of 1000 bars, and the cap on shards per run (Airflow's max_map_length is 1024)
+SHARD_PAGES = 50
+MAX_SHARDS = 1000
+
+# Shards loaded at the same time across all workers
+SHARD_CONCURRENCY = 16
+
+# Shards holding fewer of their expected bars than this fail validate_coverage
+MIN_SHARD_COVERAGE = 0.9
+
+# Start of the history of every series
+HISTORY_START = datetime(2017, 1, 1)
+
 # Instantiate a DAG
 dag = DAG(
     'binance_data_dag',
@@ -38,16 +50,19 @@ def check_database_connection(postgres_conn_id='Crypto_connection'):
     - postgres_conn_id (str): The Airflow connection ID for PostgreSQL.
 
     Returns:
-    - bool: True if the connection is successful, False otherwise.
+    - bool: True if the connection is successful; otherwise the error is raised to fail the task.
     """
+    from airflow.hooks.postgres_hook import PostgresHook
+
     try:
         hook = PostgresHook(postgres_conn_id=postgres_conn_id)
         connection = hook.get_conn()
+        connection.close()
         logging.info("Successfully connected to the database.")
         return True
-    except AirflowException as e:
+    except Exception as e:
         logging.error(f"Error checking database connection: {e}")
-        return False
+        raise
 
 # Task to check database connection
 check_database_task = PythonOperator(
@@ -60,19 +75,21 @@ def test_binance_connectivity():
     """
     Task: Test the connectivity to the Binance API.
 
-    Prints the result of the connectivity test.
+    Prints the result of the connectivity test and fails the task if the API is not reachable.
     """
+    import requests
+    from binance_etl.fetcher import BASE_URL, PING_ENDPOINT
+
     try:
-        base_url = 'https://api.binance.com'
-        endpoint = '/api/v3/ping'
-        url = f'{base_url}{endpoint}'
+        url = f'{BASE_URL}{PING_ENDPOINT}'
         response = requests.get(url)
-        if response.status_code == 200:
-            logging.info("Connectivity test successful. Binance API is reachable.")
-        else:
-            logging.warning(f"Connectivity test failed. Status code: {response.status_code} - {response.text}")
     except Exception as e:
         logging.error(f"An error occurred during the connectivity test: {e}")
+        raise
+    if response.status_code == 200:
+        logging.info("Connectivity test successful. Binance API is reachable.")
+    else:
+        raise AirflowException(f"Connectivity test failed. Status code: {response.status_code} - {response.text}")
 
 # Task to test Binance API connectivity
 test_connectivity_task = PythonOperator(
@@ -91,19 +108,26 @@ def check_if_database_empty(**kwargs):
     Returns:
     - str: Task ID of the next task to execute based on the database status.
     """
+    import psycopg2.errors
+    from airflow.hooks.postgres_hook import PostgresHook
+
+    connection = None
     try:
         hook = PostgresHook(postgres_conn_id='Crypto_connection')
         connection = hook.get_conn()
         with connection.cursor() as cursor:
-            cursor.execute("SELECT COUNT(*) FROM combined_table;")
-            row_count = cursor.fetchone()[0]
-            if row_count > 0:
-                return "extract_latest_timestamp"
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM combined_table);")
+            has_rows = cursor.fetchone()[0]
+            if has_rows:
+                return "extract_watermarks"
             else:
                 return "populate_database_task"
+    except psycopg2.errors.UndefinedTable:
+        # A brand new database: the table is created by populate_database_task
+        return "populate_database_task"
     except Exception as e:
         logging.error(f"Error checking if the database is empty: {e}")
-        return "populate_database_task"  # In case of an error, proceed to populate_database_task
+        raise
     finally:
         if connection:
             connection.close()
@@ -116,9 +140,9 @@ check_database_empty_task = BranchPythonOperator(
     dag=dag,
 )
 
-def fetch_latest_open_time(**kwargs):
+def fetch_watermarks(**kwargs):
     """
-    Task: Fetch the latest open_time registered in the postgres database and share it on xComs.
+    Task: Fetch the per-series ingest watermarks (latest stored open_time of every symbol, currency and interval) and share them on xComs.
 
     Parameters:
     - **kwargs: Context passed by Airflow.
@@ -126,145 +150,66 @@ def fetch_latest_open_time(**kwargs):
     Returns:
     - None
     """
+    import psycopg2
+    from binance_etl.schema import ensure_schema
+    from binance_etl.watermarks import read_watermarks
+
+    connection = None
     try:
         connection = psycopg2.connect(**DB_CONFIG)
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT MAX(open_time) FROM combined_table;")
-            latest_open_time = cursor.fetchone()[0]
-            if latest_open_time:
-                kwargs['ti'].xcom_push(key='latest_open_time', value=latest_open_time)
-                logging.info("Successfully fetched the latest open time.")
-            else:
-                logging.warning("No data in the combined_table.")
+        # Creates the watermark table (seeded from combined_table) on databases that predate it
+        ensure_schema(connection)
+        watermarks = read_watermarks(connection)
+        kwargs['ti'].xcom_push(key='watermarks', value={f'{symbol}:{currency}:{interval}': open_time for (symbol, currency, interval), open_time in watermarks.items()})
+        logging.info(f"Successfully fetched the watermarks of {len(watermarks)} series.")
     except Exception as e:
-        logging.error(f"Error fetching latest open time: {e}")
+        logging.error(f"Error fetching watermarks: {e}")
+        raise
     finally:
         if connection:
             connection.close()
 
-# Task to fetch the latest open_time
-extract_timestamp_task = PythonOperator(
-    task_id='extract_latest_timestamp',
-    python_callable=fetch_latest_open_time,
+# Task to fetch the per-series watermarks
+extract_watermarks_task = PythonOperator(
+    task_id='extract_watermarks',
+    python_callable=fetch_watermarks,
     provide_context=True,
     dag=dag,
 )
 
 def populate_database(**kwargs):
     """
-    Task: Populate the PostgreSQL database with initial data.
+    Task: Plan the initial population of the PostgreSQL database as independent shards.
+
+    Every series is trimmed to its first available bar and split into shards of whole pages,
+    which populate_database_shards then loads in parallel.
 
     Parameters:
     - **kwargs: Context passed by Airflow.
 
     Returns:
-    - None
+    - list: One dict of ingest_shard arguments per shard.
     """
+    from binance_etl.backfill import BackfillWindow, now_ms
+
     try:
-        # Set the base API endpoint
-        base_url = 'https://api.binance.com'
-        endpoint = '/api/v3/klines'
-
-        # Define top coins in USD and EUR
-        top_coins_usd = ['BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'XRPUSDT', 'ADAUSDT', 'DOTUSDT', 'UNIUSDT', 'LTCUSDT', 'LINKUSDT', 'BCHUSDT']
-        top_coins_eur = ['BTCEUR', 'ETHEUR', 'BNBEUR', 'XRPEUR', 'ADAEUR', 'DOTEUR', 'UNIEUR', 'LTCEUR', 'LINKEUR', 'BCHEUR']
-
-        # Define time interval and limit for API requests
-        interval = '1d'
-        limit = 1500
-        dfs = []
-
-        # Set up a connection pool
-        connection_pool = psycopg2.pool.SimpleConnectionPool(1, 10, **DB_CONFIG)
-
-        # Loop through years
-        for year in range(2017, datetime.now().year + 1):
-            start_time = int(datetime(year, 1, 1).timestamp()) * 1000
-            end_time = int(datetime(year, 12, 31).timestamp()) * 1000
-
-            # Loop through symbols (coins) for each year
-            for symbol in top_coins_usd + top_coins_eur:
-                currency = 'USD' if symbol in top_coins_usd else 'EUR'
-                url = f'{base_url}{endpoint}?symbol={symbol}&interval={interval}&limit={limit}&startTime={start_time}&endTime={end_time}'
-                response = requests.get(url)
-
-                # Check if API request was successful (status code 200)
-                if response.status_code == 200:
-                    data = response.json()
-                    columns = ["Symbol", "Currency", "Open Time", "Open Price", "High Price", "Low Price", "Close Price", "Volume", "Close Time", "Trade Count"]
-                    df = pd.DataFrame(columns=columns)
-                    rows = []
-
-                    # Process kline data and populate rows
-                    for kline in data:
-                        open_time = datetime.utcfromtimestamp(kline[0] / 1000.0).strftime('%Y-%m-%d %H:%M:%S')
-                        close_time = datetime.utcfromtimestamp(kline[6] / 1000.0).strftime('%Y-%m-%d %H:%M:%S')
-                        row = [symbol, currency, open_time, kline[1], kline[2], kline[3], kline[4], kline[5], close_time, kline[8]]
-                        rows.append(row)
-
-                    # Create a DataFrame from processed data
-                    df = pd.concat([df, pd.DataFrame(rows, columns=columns)], ignore_index=True)
-
-                    # Check for Missing Rows
-                    expected_rows = (int((end_time - start_time) / 1000) // int(interval[:-1])) + 1
-                    if len(df) != expected_rows:
-                        logging.warning(f"Missing data for {year} - {symbol}. Expected {expected_rows} rows, got {len(df)} rows.")
-
-                    # Check for Missing Dates
-                    expected_dates = pd.date_range(start=datetime.utcfromtimestamp(start_time / 1000.0), end=datetime.utcfromtimestamp(end_time / 1000.0), freq=interval)
-                    missing_dates = expected_dates[~expected_dates.isin(pd.to_datetime(df['Open Time']))]
-                    if not missing_dates.empty:
-                        logging.warning(f"Missing data for {year} - {symbol} on dates: {missing_dates}")
-
-                    # Attempt to connect to the database using a connection from the pool
-                    try:
-                        connection = connection_pool.getconn()
-                        with connection.cursor() as cur:
-                            # Create the combined_table if it doesn't exist
-                            cur.execute("""
-                                CREATE TABLE IF NOT EXISTS combined_table (
-                                    id SERIAL PRIMARY KEY,
-                                    symbol VARCHAR(20) NOT NULL,
-                                    currency VARCHAR(3) NOT NULL,
-                                    open_time TIMESTAMP NOT NULL,
-                                    open_price NUMERIC NOT NULL,
-                                    high_price NUMERIC NOT NULL,
-                                    low_price NUMERIC NOT NULL,
-                                    close_price NUMERIC NOT NULL,
-                                    volume NUMERIC NOT NULL,
-                                    close_time TIMESTAMP NOT NULL,
-                                    trade_count INTEGER NOT NULL,
-                                    CONSTRAINT symbol_open_time_currency_unique_constraint UNIQUE (symbol, open_time, currency)
-                                );
-                            """)
-                            # Create an index if it doesn't exist
-                            cur.execute("CREATE INDEX IF NOT EXISTS idx_symbol_open_time_currency ON combined_table (symbol, open_time, currency);")
-
-                            # Insert data into the combined_table, ignoring conflicts
-                            for _, row in df.iterrows():
-                                cur.execute("""
-                                    INSERT INTO combined_table (symbol, currency, open_time, open_price, high_price, low_price, close_price, volume, close_time, trade_count)
-                                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                                    ON CONFLICT (symbol, open_time, currency) DO NOTHING;
-                                """, tuple(row))
-                    except Exception as e:
-                        logging.error(f"Error connecting to the database or inserting data: {e}")
-                    finally:
-                        # Release the connection back to the pool
-                        connection_pool.putconn(connection)
-                else:
-                    logging.error(f'Error: {response.status_code} - {response.text}')
-
-        # Close all connections in the pool
-        connection_pool.closeall()
-
-        # Concatenate DataFrames and display the result
-        result_df = pd.concat(dfs, ignore_index=True)
-        logging.info("Database population task completed successfully.")
+        # The top pairs by quote volume (this also makes sure the tables exist before the shards write into them)
+        pairs = select_universe()
+
+        # Cover every tracked interval from the beginning of 2017 up to now
+        start_time = int(HISTORY_START.timestamp()) * 1000
+        end_time = now_ms()
+        windows = []
+        for interval in INTERVALS:
+            for symbol, currency in pairs:
+                windows.append(BackfillWindow(symbol, currency, interval, start_time, end_time))
+
+        return plan_shard_kwargs(windows, end_time, **kwargs)
     except Exception as e:
         logging.error(f"Error in populate_database task: {e}")
+        raise
 
-# Task to populate the database
+# Task to plan the population of the database
 populate_database_task = PythonOperator(
     task_id='populate_database_task',
     python_callable=populate_database,
@@ -274,86 +219,42 @@ populate_database_task = PythonOperator(
 
 def add_the_latest_data(**kwargs):
     """
-    Task: Add the latest data to the PostgreSQL database.
+    Task: Plan the addition of the latest data to the PostgreSQL database as independent shards.
 
     Parameters:
     - **kwargs: Context passed by Airflow.
 
     Returns:
-    - None
+    - list: One dict of ingest_shard arguments per shard.
     """
+    from binance_etl.backfill import BackfillWindow, now_ms
+    from binance_etl.decoder import INTERVAL_MS
+
     try:
-        # Use the xCom value as the start time for API call
-        latest_open_time = kwargs['ti'].xcom_pull(task_ids='extract_latest_timestamp', key='latest_open_time')
-
-        # Convert Unix timestamp to milliseconds
-        start_time = int(latest_open_time.timestamp()) * 1000
-
-        # Set the base API endpoint
-        base_url = 'https://api.binance.com'
-        endpoint = '/api/v3/klines'
-
-        # Define top coins in USD and EUR
-        top_coins_usd = ['BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'XRPUSDT', 'ADAUSDT', 'DOTUSDT', 'UNIUSDT', 'LTCUSDT', 'LINKUSDT', 'BCHUSDT']
-        top_coins_eur = ['BTCEUR', 'ETHEUR', 'BNBEUR', 'XRPEUR', 'ADAEUR', 'DOTEUR', 'UNIEUR', 'LTCEUR', 'LINKEUR', 'BCHEUR']
-
-        # Define time interval and limit for API requests
-        interval = '1d'
-        limit = 1500
-
-        # Set up a connection pool
-        connection_pool = psycopg2.pool.SimpleConnectionPool(1, 10, **DB_CONFIG)
-
-        # Loop through symbols (coins)
-        for symbol in top_coins_usd + top_coins_eur:
-            currency = 'USD' if symbol in top_coins_usd else 'EUR'
-            url = f'{base_url}{endpoint}?symbol={symbol}&interval={interval}&limit={limit}&startTime={start_time}'
-            response = requests.get(url)
-
-            # Check if API request was successful (status code 200)
-            if response.status_code == 200:
-                data = response.json()
-                columns = ["Symbol", "Currency", "Open Time", "Open Price", "High Price", "Low Price", "Close Price", "Volume", "Close Time", "Trade Count"]
-                df = pd.DataFrame(columns=columns)
-                rows = []
-
-                # Process kline data and populate rows
-                for kline in data:
-                    open_time = datetime.utcfromtimestamp(kline[0] / 1000.0).strftime('%Y-%m-%d %H:%M:%S')
-                    close_time = datetime.utcfromtimestamp(kline[6] / 1000.0).strftime('%Y-%m-%d %H:%M:%S')
-                    row = [symbol, currency, open_time, kline[1], kline[2], kline[3], kline[4], kline[5], close_time, kline[8]]
-                    rows.append(row)
-
-                # Create a DataFrame from processed data
-                df = pd.concat([df, pd.DataFrame(rows, columns=columns)], ignore_index=True)
-
-                # Attempt to connect to the database using a connection from the pool
-                try:
-                    connection = connection_pool.getconn()
-                    with connection.cursor() as cur:
-                        # Insert data into the combined_table, ignoring conflicts
-                        for _, row in df.iterrows():
-                            cur.execute("""
-                                INSERT INTO combined_table (symbol, currency, open_time, open_price, high_price, low_price, close_price, volume, close_time, trade_count)
-                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                                ON CONFLICT (symbol, open_time, currency) DO NOTHING;
-                            """, tuple(row))
-                except Exception as e:
-                    logging.error(f"Error connecting to the database or inserting data: {e}")
-                finally:
-                    # Release the connection back to the pool
-                    connection_pool.putconn(connection)
-            else:
-                logging.error(f'Error: {response.status_code} - {response.text}')
+        # Use the xCom watermarks to resume every series right after its latest stored bar
+        watermarks = kwargs['ti'].xcom_pull(task_ids='extract_watermarks', key='watermarks') or {}
+
+        # Series without a watermark (e.g. newly listed pairs or newly tracked intervals) start from the beginning of the history
+        history_start = int(HISTORY_START.timestamp()) * 1000
+
+        # The top pairs by quote volume; newly listed pairs have no watermark yet, delisted ones are left out
+        pairs = select_universe()
 
-        # Close all connections in the pool
-        connection_pool.closeall()
-        logging.info("Latest data addition task completed successfully.")
+        # Build one window per series, covering exactly the bars it is missing
+        end_time = now_ms()
+        windows = []
+        for interval in INTERVALS:
+            for symbol, currency in pairs:
+                watermark = watermarks.get(f'{symbol}:{currency}:{interval}')
+                start_time = watermark + INTERVAL_MS[interval] if watermark is not None else history_start
+                windows.append(BackfillWindow(symbol, currency, interval, start_time, end_time))
 
+        return plan_shard_kwargs(windows, end_time, **kwargs)
     except Exception as e:
         logging.error(f"Error in add_the_latest_data task: {e}")
+        raise
 
-# Task to add the latest data to the database
+# Task to plan the addition of the latest data
 add_the_latest_data_task = PythonOperator(
     task_id='add_the_latest_data_task',
     python_callable=add_the_latest_data,
@@ -361,10 +262,323 @@ add_the_latest_data_task = PythonOperator(
     dag=dag,
 )
 
+def select_universe():
+    """
+    Refresh the symbol universe (at most once per UNIVERSE_TTL_SECONDS) and return the pairs to ingest.
+
+    Returns:
+    - list: (symbol, currency) tuples.
+    """
+    import psycopg2
+    from binance_etl.fetcher import BASE_URL, KlineFetcher
+    from binance_etl.schema import ensure_schema
+    from binance_etl.universe import refresh_universe
+
+    connection = psycopg2.connect(**DB_CONFIG)
+    fetcher = KlineFetcher(BASE_URL)
+    try:
+        ensure_schema(connection)
+        pairs = refresh_universe(connection, fetcher, UNIVERSE_QUOTES, UNIVERSE_SIZE, UNIVERSE_TTL_SECONDS)
+    finally:
+        fetcher.close()
+        connection.close()
+    logging.info(f"Tracking {len(pairs)} pairs.")
+    return pairs
+
+def plan_shard_kwargs(windows, planned_at, **kwargs):
+    """
+    Trim windows to the first available bar and split them into shards for dynamic task mapping.
+
+    Parameters:
+    - windows (list): BackfillWindow objects to load.
+    - planned_at (int): Planning time in epoch milliseconds, shared on xComs for validate_coverage.
+    - **kwargs: Context passed by Airflow.
+
+    Returns:
+    - list: One dict of ingest_shard arguments per shard.
+    """
+    from binance_etl.backfill import plan_shards, trim_to_first_bar
+    from binance_etl.fetcher import BASE_URL, KlineFetcher
+
+    fetcher = KlineFetcher(BASE_URL)
+    try:
+        windows = trim_to_first_bar(fetcher, windows)
+    finally:
+        fetcher.close()
+    shards = plan_shards(windows, pages_per_shard=SHARD_PAGES, max_shards=MAX_SHARDS)
+    kwargs['ti'].xcom_push(key='planned_at', value=planned_at)
+    logging.info(f"Planned {len(shards)} shards for {len(windows)} series.")
+    return [shard._asdict() for shard in shards]
+
+def ingest_shard(symbol, currency, interval, start_time, end_time, **kwargs):
+    """
+    Task: Load one shard (a time range of one series) into the PostgreSQL database.
+
+    Writes are idempotent, so a retried shard only fills in what is still missing.
+
+    Parameters:
+    - symbol (str): Trading pair, e.g. 'BTCUSDT'.
+    - currency (str): Quote currency label, e.g. 'USD'.
+    - interval (str): Binance interval, e.g. '1d'.
+    - start_time (int): First open time of the shard in epoch milliseconds.
+    - end_time (int): Last open time of the shard in epoch milliseconds.
+    - **kwargs: Context passed by Airflow.
+
+    Returns:
+    - dict: The stage metrics summary of the shard, plus the number of inserted rows.
+    """
+    import psycopg2
+    from binance_etl.backfill import BackfillWindow, backfill
+    from binance_etl.cache import KlineCache
+    from binance_etl.fetcher import BASE_URL, KlineFetcher
+    from binance_etl.metrics import IngestMetrics
+
+    try:
+        connection = psycopg2.connect(**DB_CONFIG)
+
+        # Fetch the shard's pages concurrently within the rate budget (kept in sync with the other shards
+        # through Binance's used-weight header); closed pages downloaded before are read from the local cache
+        metrics = IngestMetrics()
+        fetcher = KlineFetcher(BASE_URL, metrics=metrics)
+        cache = KlineCache(KLINE_CACHE_DIR, KLINE_CACHE_MAX_BYTES)
+        try:
+            window = BackfillWindow(symbol, currency, interval, start_time, end_time)
+            inserted = backfill(connection, fetcher, [window], cache=cache, metrics=metrics, memory_ceiling=BACKFILL_MEMORY_CEILING)
+        finally:
+            fetcher.close()
+            connection.close()
+        logging.info(f"Shard {symbol} {interval} {start_time}-{end_time} completed successfully ({inserted} rows inserted).")
+        return dict(metrics.summary(), inserted=inserted)
+    except Exception as e:
+        logging.error(f"Error in ingest_shard task for {symbol} {interval} from {start_time}: {e}")
+        raise
+
+# Mapped tasks loading the shards in parallel, one task instance (with its own retries) per shard
+populate_database_shards = PythonOperator.partial(
+    task_id='populate_database_shards',
+    python_callable=ingest_shard,
+    max_active_tis_per_dag=SHARD_CONCURRENCY,
+    execution_timeout=timedelta(hours=1),
+    dag=dag,
+).expand(op_kwargs=populate_database_task.output)
+
+add_the_latest_data_shards = PythonOperator.partial(
+    task_id='add_the_latest_data_shards',
+    python_callable=ingest_shard,
+    max_active_tis_per_dag=SHARD_CONCURRENCY,
+    execution_timeout=timedelta(hours=1),
+    dag=dag,
+).expand(op_kwargs=add_the_latest_data_task.output)
+
+def validate_coverage(**kwargs):
+    """
+    Task: Check that the shards of the load branch that ran left no bars behind, and report their metrics.
+
+    Parameters:
+    - **kwargs: Context passed by Airflow.
+
+    Returns:
+    - None
+    """
+    import psycopg2
+    from binance_etl.backfill import BackfillWindow
+    from binance_etl.gaps import window_coverage
+    from binance_etl.metrics import IngestMetrics, publish
+
+    ti = kwargs['ti']
+    try:
+        # Only the branch that was taken has a plan and shard results
+        for planner, shards_task, job in (
+            ('populate_database_task', 'populate_database_shards', 'populate_database'),
+            ('add_the_latest_data_task', 'add_the_latest_data_shards', 'add_the_latest_data'),
+        ):
+            shards = ti.xcom_pull(task_ids=planner)
+            if shards is None:
+                continue
+            planned_at = ti.xcom_pull(task_ids=planner, key='planned_at')
+
+            # Combine the stage metrics of all shards into one report
+            metrics = IngestMetrics()
+            inserted = 0
+            for summary in ti.xcom_pull(task_ids=shards_task) or []:
+                metrics.merge_summary(summary)
+                inserted += summary['inserted']
+            ti.xcom_push(key='ingest_metrics', value=publish(metrics, job, METRICS_TEXTFILE_DIR, STATSD_ADDRESS))
+
+            connection = psycopg2.connect(**DB_CONFIG)
+            coverage = window_coverage(connection, [BackfillWindow(**shard) for shard in shards], planned_at)
+            connection.close()
+
+            expected = sum(e for _, e, _ in coverage)
+            stored = sum(s for _, _, s in coverage)
+            incomplete = [(w, e, s) for w, e, s in coverage if s < e]
+            for window, e, s in incomplete:
+                logging.warning(f"Shard {window.symbol} {window.interval} {window.start_time}-{window.end_time} holds {s} of {e} bars.")
+            logging.info(f"{job}: {len(shards)} shards inserted {inserted} rows, {stored} of {expected} bars stored.")
+
+            # A few missing bars are normal (exchange outages, left to the gap repair); a mostly empty shard is not
+            failed = [(w, e, s) for w, e, s in incomplete if s < e * MIN_SHARD_COVERAGE]
+            if failed:
+                raise AirflowException(f"{len(failed)} of {len(shards)} shards are below {MIN_SHARD_COVERAGE:.0%} coverage.")
+    except Exception as e:
+        logging.error(f"Error in validate_coverage task: {e}")
+        raise
+
+# Task reducing the shards of whichever load branch was taken
+validate_coverage_task = PythonOperator(
+    task_id='validate_coverage_task',
+    python_callable=validate_coverage,
+    provide_context=True,  # Provide the context to the function
+    trigger_rule='none_failed_min_one_success',
+    dag=dag,
+)
+
+def repair_missing_bars(**kwargs):
+    """
+    Task: Find the bars missing inside the stored history of every tracked series and refetch only those.
+
+    Parameters:
+    - **kwargs: Context passed by Airflow.
+
+    Returns:
+    - None
+    """
+    import psycopg2
+    from binance_etl.cache import KlineCache
+    from binance_etl.fetcher import BASE_URL, KlineFetcher
+    from binance_etl.gaps import repair_gaps
+    from binance_etl.metrics import IngestMetrics, publish
+
+    try:
+        # Open a single connection for the gap scan and all repair batches
+        connection = psycopg2.connect(**DB_CONFIG)
+
+        # Scan the tracked series in one query and refetch the merged gap windows within the rate budget. Watermarks
+        # move past failed shards, so the head of a series (a failed first shard) is checked from its first bar on
+        # Binance (probed once per series, not before HISTORY_START); delisted symbols are skipped.
+        metrics = IngestMetrics()
+        fetcher = KlineFetcher(BASE_URL, metrics=metrics)
+        try:
+            inserted = repair_gaps(connection, fetcher, history_start=int(HISTORY_START.timestamp()) * 1000,
+                                   cache=KlineCache(KLINE_CACHE_DIR, KLINE_CACHE_MAX_BYTES), metrics=metrics)
+        finally:
+            # Close the HTTP session and the database connection, and report the stage timings even if some pages failed
+            fetcher.close()
+            connection.close()
+            kwargs['ti'].xcom_push(key='ingest_metrics', value=publish(metrics, 'repair_missing_bars', METRICS_TEXTFILE_DIR, STATSD_ADDRESS))
+        logging.info(f"Gap repair task completed successfully ({inserted} rows inserted).")
+
+    except Exception as e:
+        logging.error(f"Error in repair_missing_bars task: {e}")
+        raise
+
+# Task to repair gaps, run once the load is validated
+repair_missing_bars_task = PythonOperator(
+    task_id='repair_missing_bars_task',
+    python_callable=repair_missing_bars,
+    provide_context=True,  # Provide the context to the function
+    dag=dag,
+)
+
+def refresh_rollup_tables(**kwargs):
+    """
+    Task: Refresh the weekly and monthly rollup tables used by the dashboards.
+
+    Parameters:
+    - **kwargs: Context passed by Airflow.
+
+    Returns:
+    - None
+    """
+    import psycopg2
+    from binance_etl.rollups import refresh_rollups
+
+    try:
+        # Only the buckets touched by the bars written in this run are recomputed
+        connection = psycopg2.connect(**DB_CONFIG)
+        refreshed = refresh_rollups(connection)
+        connection.close()
+        logging.info(f"Rollup refresh task completed successfully ({refreshed} series refreshed).")
+
+    except Exception as e:
+        logging.error(f"Error in refresh_rollup_tables task: {e}")
+        raise
+
+# Task to refresh the rollups once all bars of the run are written
+refresh_rollups_task = PythonOperator(
+    task_id='refresh_rollups_task',
+    python_callable=refresh_rollup_tables,
+    provide_context=True,  # Provide the context to the function
+    dag=dag,
+)
+
+def compute_features(**kwargs):
+    """
+    Task: Compute the technical features of the bars added or repaired since the last run.
+
+    Parameters:
+    - **kwargs: Context passed by Airflow.
+
+    Returns:
+    - None
+    """
+    from binance_etl.features import update_features
+
+    try:
+        # Every series resumes after its last computed bar, or from the first bar repaired into its history, with a short warm-up lookback
+        updated = update_features(DB_CONFIG, INTERVALS)
+        logging.info(f"Feature computation task completed successfully ({updated} bars updated).")
+
+    except Exception as e:
+        logging.error(f"Error in compute_features task: {e}")
+        raise
+
+# Task to compute the features once the history is complete
+compute_features_task = PythonOperator(
+    task_id='compute_features_task',
+    python_callable=compute_features,
+    provide_context=True,  # Provide the context to the function
+    dag=dag,
+)
+
+def train_forecasting_models(**kwargs):
+    """
+    Task: Retrain the forecasting models of the series that got new bars and store their forecasts.
+
+    Parameters:
+    - **kwargs: Context passed by Airflow.
+
+    Returns:
+    - None
+    """
+    from binance_etl.modeling import train_models
+
+    try:
+        # Models whose training data did not change since the last run are kept as they are
+        for interval in INTERVALS:
+            metrics = train_models(DB_CONFIG, interval)
+            logging.info(f"Model training completed for {interval} ({len(metrics)} models retrained).")
+
+    except Exception as e:
+        logging.error(f"Error in train_forecasting_models task: {e}")
+        raise
+
+# Task to train the models on the freshly computed features
+train_models_task = PythonOperator(
+    task_id='train_models_task',
+    python_callable=train_forecasting_models,
+    provide_context=True,  # Provide the context to the function
+    dag=dag,
+)
+
 # Define the DAG structure
 check_database_task >> test_connectivity_task >> check_database_empty_task
 check_database_empty_task >> [
-    extract_timestamp_task,
+    extract_watermarks_task,
     populate_database_task,
 ]
-extract_timestamp_task >> add_the_latest_data_task
+extract_watermarks_task >> add_the_latest_data_task
+[populate_database_shards, add_the_latest_data_shards] >> validate_coverage_task >> repair_missing_bars_task
+repair_missing_bars_task >> refresh_rollups_task
+repair_missing_bars_task >> compute_features_task
+compute_features_task >> train_models_task
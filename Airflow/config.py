@@ -6,3 +6,23 @@ DB_CONFIG = {
     'host': 'your_host',
     'port': '5432',
 }
+
+# Binance kline intervals to ingest, e.g. ['1d', '4h', '1h', '1m']
+INTERVALS = ['1d']
+
+# Symbol universe: quote assets to track with the currency label stored for their pairs, how many pairs
+# per quote asset (ranked by 24h quote volume) and how long the exchange metadata is reused in seconds
+UNIVERSE_QUOTES = {'USDT': 'USD', 'EUR': 'EUR'}
+UNIVERSE_SIZE = 10
+UNIVERSE_TTL_SECONDS = 3600
+
+# Local Parquet cache of closed kline pages and its size limit in bytes
+KLINE_CACHE_DIR = '/opt/airflow/kline_cache'
+KLINE_CACHE_MAX_BYTES = 5 * 1024 ** 3
+
+# Memory the buffers of a backfill may use in bytes; peak memory stays flat however long the history is
+BACKFILL_MEMORY_CEILING = 128 * 1024 ** 2
+
+# Per-stage ingest metrics: node_exporter textfile directory and StatsD (host, port); None disables a sink
+METRICS_TEXTFILE_DIR = '/opt/airflow/metrics'
+STATSD_ADDRESS = None
@@ -1,108 +1,86 @@
 from datetime import datetime
-import pandas as pd
+import argparse
+import logging
 from tqdm import tqdm
 import psycopg2
-from psycopg2 import pool
-from config import DB_CONFIG  # Import the configuration from the config.py file
-import requests
+from config import BACKFILL_MEMORY_CEILING, DB_CONFIG, INTERVALS, KLINE_CACHE_DIR, KLINE_CACHE_MAX_BYTES, METRICS_TEXTFILE_DIR, STATSD_ADDRESS, UNIVERSE_QUOTES, UNIVERSE_SIZE, UNIVERSE_TTL_SECONDS  # Import the configuration from the config.py file
+from binance_etl.backfill import BackfillWindow, backfill, now_ms, replay
+from binance_etl.cache import KlineCache
+from binance_etl.features import update_features
+from binance_etl.fetcher import BASE_URL, KlineFetcher
+from binance_etl.gaps import repair_gaps
+from binance_etl.metrics import IngestMetrics, publish
+from binance_etl.rollups import refresh_rollups
+from binance_etl.schema import ensure_schema
+from binance_etl.universe import refresh_universe
 
-# Set the base API endpoint
-base_url = 'https://api.binance.com'
-endpoint = '/api/v3/klines'
-
-# Define top coins in USD and EUR
-top_coins_usd = ['BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'XRPUSDT', 'ADAUSDT', 'DOTUSDT', 'UNIUSDT', 'LTCUSDT', 'LINKUSDT', 'BCHUSDT']
-top_coins_eur = ['BTCEUR', 'ETHEUR', 'BNBEUR', 'XRPEUR', 'ADAEUR', 'DOTEUR', 'UNIEUR', 'LTCEUR', 'LINKEUR', 'BCHEUR']
-
-# Define time interval and limit for API requests
-interval = '1d'
-limit = 1500
-dfs = []
+# Report missing data and errors raised while backfilling
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
 
-# Set up a connection pool
-connection_pool = psycopg2.pool.SimpleConnectionPool(1, 10, **DB_CONFIG)
+parser = argparse.ArgumentParser(description='Populate the database with Binance klines.')
+parser.add_argument('--replay', action='store_true', help='Rebuild the database only from the local kline cache, without network access.')
+parser.add_argument('--repair', action='store_true', help='Only refetch the bars missing inside the already stored history.')
+parser.add_argument('--base-url', default=BASE_URL, help='Binance API base URL (e.g. a local stand-in for benchmarks).')
+parser.add_argument('--dsn', help='libpq connection string to use instead of DB_CONFIG from config.py.')
+parser.add_argument('--start', default='2017-01-01', help='First day of the history to populate (YYYY-MM-DD).')
+parser.add_argument('--intervals', nargs='+', default=INTERVALS, help='Binance intervals to populate, INTERVALS from config.py by default.')
+parser.add_argument('--cache-dir', default=KLINE_CACHE_DIR, help='Directory of the local kline cache.')
+args = parser.parse_args()
 
-# Loop through years
-for year in range(2017, datetime.now().year + 1):
-    start_time = int(datetime(year, 1, 1).timestamp()) * 1000
-    end_time = int(datetime(year, 12, 31).timestamp()) * 1000
+# Closed pages are served from (and stored into) the local cache
+cache = KlineCache(args.cache_dir, KLINE_CACHE_MAX_BYTES)
 
-    # Loop through symbols (coins) for each year
-    for symbol in tqdm(top_coins_usd + top_coins_eur, desc=f"Processing coins for {year}"):
-        currency = 'USD' if symbol in top_coins_usd else 'EUR'
-        url = f'{base_url}{endpoint}?symbol={symbol}&interval={interval}&limit={limit}&startTime={start_time}&endTime={end_time}'
-        response = requests.get(url)
+# Set the base API endpoint
+base_url = args.base_url
 
-        # Check if API request was successful (status code 200)
-        if response.status_code == 200:
-            data = response.json()
-            columns = ["Symbol", "Currency", "Open Time", "Open Price", "High Price", "Low Price", "Close Price", "Volume", "Close Time", "Trade Count"]
-            df = pd.DataFrame(columns=columns)
-            rows = []
+# Connection parameters, shared with the feature worker processes
+db_config = {'dsn': args.dsn} if args.dsn else DB_CONFIG
 
-            # Process kline data and populate rows
-            for kline in data:
-                open_time = datetime.utcfromtimestamp(kline[0] / 1000.0).strftime('%Y-%m-%d %H:%M:%S')
-                close_time = datetime.utcfromtimestamp(kline[6] / 1000.0).strftime('%Y-%m-%d %H:%M:%S')
-                row = [symbol, currency, open_time, kline[1], kline[2], kline[3], kline[4], kline[5], close_time, kline[8]]
-                rows.append(row)
+# Start of the history (2017 by default)
+start_time = int(datetime.strptime(args.start, '%Y-%m-%d').timestamp()) * 1000
 
-            # Create a DataFrame from processed data
-            df = pd.concat([df, pd.DataFrame(rows, columns=columns)], ignore_index=True)
+# Open a single connection and make sure the table exists before the first batch
+connection = psycopg2.connect(**db_config)
+ensure_schema(connection)
 
-            # Check for Missing Rows
-            expected_rows = (int((end_time - start_time) / 1000) // int(interval[:-1])) + 1
-            if len(df) != expected_rows:
-                print(f"Missing data for {year} - {symbol}. Expected {expected_rows} rows, got {len(df)} rows.")
+if args.replay:
+    # Rebuild the database from the cached pages only
+    inserted = replay(connection, cache, progress=tqdm)
+else:
+    # Time every stage (HTTP, JSON, cache, decode, validate, write) per symbol and interval
+    metrics = IngestMetrics()
+    fetcher = KlineFetcher(base_url, metrics=metrics)
+    try:
+        if args.repair:
+            # Refetch only the gaps found inside the stored series
+            inserted = repair_gaps(connection, fetcher, history_start=start_time, cache=cache, metrics=metrics)
+        else:
+            # Track the top pairs by 24h quote volume of every quote asset (two batched metadata requests, reused for UNIVERSE_TTL_SECONDS)
+            pairs = refresh_universe(connection, fetcher, UNIVERSE_QUOTES, UNIVERSE_SIZE, UNIVERSE_TTL_SECONDS)
 
-            # Check for Missing Dates
-            expected_dates = pd.date_range(start=datetime.utcfromtimestamp(start_time / 1000.0), end=datetime.utcfromtimestamp(end_time / 1000.0), freq=interval)
-            missing_dates = expected_dates[~expected_dates.isin(pd.to_datetime(df['Open Time']))]
-            if not missing_dates.empty:
-                print(f"Missing data for {year} - {symbol} on dates: {missing_dates}")
+            # Cover every tracked interval from the start of the history up to now
+            end_time = now_ms()
+            windows = []
+            for interval in args.intervals:
+                for symbol, currency in pairs:
+                    windows.append(BackfillWindow(symbol, currency, interval, start_time, end_time))
 
-            # Attempt to connect to the database using a connection from the pool
-            try:
-                connection = connection_pool.getconn()
-                with connection.cursor() as cur:
-                    # Create the combined_table if it doesn't exist
-                    cur.execute("""
-                        CREATE TABLE IF NOT EXISTS combined_table (
-                            id SERIAL PRIMARY KEY,
-                            symbol VARCHAR(20) NOT NULL,
-                            currency VARCHAR(3) NOT NULL,
-                            open_time TIMESTAMP NOT NULL,
-                            open_price NUMERIC NOT NULL,
-                            high_price NUMERIC NOT NULL,
-                            low_price NUMERIC NOT NULL,
-                            close_price NUMERIC NOT NULL,
-                            volume NUMERIC NOT NULL,
-                            close_time TIMESTAMP NOT NULL,
-                            trade_count INTEGER NOT NULL,
-                            CONSTRAINT symbol_open_time_currency_unique_constraint UNIQUE (symbol, open_time, currency)
-                        );
-                    """)
-                    # Create an index if it doesn't exist
-                    cur.execute("CREATE INDEX IF NOT EXISTS idx_symbol_open_time_currency ON combined_table (symbol, open_time, currency);")
+            # Fetch the pages concurrently within the rate budget and write each one as soon as it arrives, within the memory ceiling
+            inserted = backfill(connection, fetcher, windows, progress=tqdm, cache=cache, metrics=metrics,
+                                memory_ceiling=BACKFILL_MEMORY_CEILING)
+    finally:
+        fetcher.close()
+        summary = publish(metrics, 'populate_script', METRICS_TEXTFILE_DIR, STATSD_ADDRESS)
+        for stage, stats in summary['stages'].items():
+            print(f"{stage}: {stats['seconds']:.2f}s, {stats['calls']} calls, {stats['rows']} rows, {stats['bytes']} bytes, "
+                  f"{stats['weight']} weight, {stats['retries']} retries, {stats['errors']} errors")
+print(f"Inserted {inserted} rows.")
 
-                    # Insert data into the combined_table, ignoring conflicts
-                    for _, row in df.iterrows():
-                        cur.execute("""
-                            INSERT INTO combined_table (symbol, currency, open_time, open_price, high_price, low_price, close_price, volume, close_time, trade_count)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (symbol, open_time, currency) DO NOTHING;
-                        """, tuple(row))
-            except Exception as e:
-                print(f"Error connecting to the database or inserting data: {e}")
-            finally:
-                # Release the connection back to the pool
-                connection_pool.putconn(connection)
-        else:
-            print(f'Error: {response.status_code} - {response.text}')
+# Bring the weekly and monthly rollups up to date with the new bars
+refresh_rollups(connection)
 
-# Close all connections in the pool
-connection_pool.closeall()
+# Compute the technical features of the new bars, one process per series
+update_features(db_config, args.intervals)
 
-# Concatenate DataFrames and display the result
-result_df = pd.concat(dfs, ignore_index=True)
-result_df
+# Close the database connection
+connection.close()
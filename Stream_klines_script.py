@@ -0,0 +1,51 @@
+from datetime import datetime
+import argparse
+import logging
+import signal
+import psycopg2
+from config import DB_CONFIG, INTERVALS, KLINE_CACHE_DIR, KLINE_CACHE_MAX_BYTES, METRICS_TEXTFILE_DIR, STATSD_ADDRESS, UNIVERSE_QUOTES, UNIVERSE_SIZE, UNIVERSE_TTL_SECONDS  # Import the configuration from the config.py file
+from binance_etl.cache import KlineCache
+from binance_etl.fetcher import BASE_URL, KlineFetcher
+from binance_etl.metrics import IngestMetrics, publish
+from binance_etl.schema import ensure_schema
+from binance_etl.streaming import STREAM_URL, KlineStreamIngestor
+from binance_etl.universe import refresh_universe
+
+# Report reconnects, catch-ups and errors
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+parser = argparse.ArgumentParser(description='Stream closed Binance klines into the database as they close.')
+parser.add_argument('--base-url', default=BASE_URL, help='Binance API base URL used to catch up after disconnects.')
+parser.add_argument('--stream-url', default=STREAM_URL, help='Binance WebSocket base URL (e.g. a local stand-in).')
+parser.add_argument('--dsn', help='libpq connection string to use instead of DB_CONFIG from config.py.')
+parser.add_argument('--start', default='2017-01-01', help='Where series without any stored bars are caught up from (YYYY-MM-DD).')
+parser.add_argument('--intervals', nargs='+', default=INTERVALS, help='Binance intervals to stream, INTERVALS from config.py by default.')
+parser.add_argument('--cache-dir', default=KLINE_CACHE_DIR, help='Directory of the local kline cache.')
+args = parser.parse_args()
+
+# Open a single connection and make sure the table exists before the first batch
+connection = psycopg2.connect(**({'dsn': args.dsn} if args.dsn else DB_CONFIG))
+ensure_schema(connection)
+
+metrics = IngestMetrics()
+fetcher = KlineFetcher(args.base_url, metrics=metrics)
+
+# Stream the top pairs by 24h quote volume of every quote asset, as selected when the script starts
+pairs = refresh_universe(connection, fetcher, UNIVERSE_QUOTES, UNIVERSE_SIZE, UNIVERSE_TTL_SECONDS)
+series = [(symbol, currency, interval) for interval in args.intervals for symbol, currency in pairs]
+cache = KlineCache(args.cache_dir, KLINE_CACHE_MAX_BYTES)
+history_start = int(datetime.strptime(args.start, '%Y-%m-%d').timestamp()) * 1000
+ingestor = KlineStreamIngestor(connection, fetcher, series, args.stream_url, history_start, cache=cache, metrics=metrics)
+
+# Stop cleanly (writing the buffered bars) on Ctrl+C or `docker stop`
+for signum in (signal.SIGINT, signal.SIGTERM):
+    signal.signal(signum, lambda signum, frame: ingestor.stop())
+try:
+    inserted = ingestor.run()
+finally:
+    fetcher.close()
+    publish(metrics, 'stream_script', METRICS_TEXTFILE_DIR, STATSD_ADDRESS)
+print(f"Inserted {inserted} rows.")
+
+# Close the database connection
+connection.close()
@@ -0,0 +1 @@
+"""End-to-end ingestion benchmarks against a local Binance stand-in and a throwaway Postgres."""
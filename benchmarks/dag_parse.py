@@ -0,0 +1,86 @@
+"""
+DAG parse-time benchmark.
+
+Imports Airflow/DAG_Final.py the way the scheduler does, in a fresh process per run, and
+fails (exit status 1) if the median import time exceeds --budget or if the import loads any
+of the heavy modules that belong inside the task callables. Airflow itself is imported
+before the clock starts, since the scheduler has it loaded already. Run it from the
+repository root, in an environment with Airflow installed:
+
+    python -m benchmarks.dag_parse --budget 0.2
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Import time of the DAG file in seconds that is still acceptable
+DEFAULT_BUDGET = 0.2
+
+# Top-level packages the DAG file must not load at parse time
+HEAVY_MODULES = ('binance_etl', 'numpy', 'pandas', 'psycopg2', 'pyarrow', 'requests', 'websocket')
+
+# Runs in the child process: sys.argv = [dag file, dags folder, repository root, heavy modules]
+PARSE_ONCE = """
+import json, runpy, sys, time
+dag_file, dags_folder, root, heavy = sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4].split(',')
+sys.path[:0] = [dags_folder, root]
+
+from airflow import DAG
+import airflow.exceptions
+import airflow.operators.python_operator
+
+before = set(sys.modules)
+started = time.perf_counter()
+namespace = runpy.run_path(dag_file)
+seconds = time.perf_counter() - started
+loaded = sorted({m.split('.')[0] for m in set(sys.modules) - before} & set(heavy))
+dags = sorted(v.dag_id for v in namespace.values() if isinstance(v, DAG))
+print(json.dumps({"seconds": seconds, "heavy_modules": loaded, "dags": dags}))
+"""
+
+
+def parse_once(dag_file, heavy_modules=HEAVY_MODULES):
+    """Import the DAG file in a fresh interpreter; returns the child's measurements."""
+    dags_folder = os.path.dirname(os.path.abspath(dag_file))
+    result = subprocess.run(
+        [sys.executable, '-c', PARSE_ONCE, dag_file, dags_folder, os.getcwd(), ','.join(heavy_modules)],
+        stdout=subprocess.PIPE, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dag-file', default=os.path.join('Airflow', 'DAG_Final.py'))
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help='Maximum median import time in seconds.')
+    parser.add_argument('--runs', type=int, default=5, help='Number of fresh-process imports to take the median of.')
+    args = parser.parse_args()
+
+    runs = [parse_once(args.dag_file) for _ in range(args.runs)]
+    median = statistics.median(run['seconds'] for run in runs)
+    heavy = sorted({module for run in runs for module in run['heavy_modules']})
+    print(json.dumps({
+        "dag_file": args.dag_file,
+        "dags": runs[0]['dags'],
+        "median_seconds": round(median, 4),
+        "max_seconds": round(max(run['seconds'] for run in runs), 4),
+        "budget_seconds": args.budget,
+        "heavy_modules": heavy,
+    }, indent=2))
+
+    failures = []
+    if median > args.budget:
+        failures.append(f"median import time {median:.3f}s exceeds the budget of {args.budget}s")
+    if heavy:
+        failures.append(f"heavy modules imported at parse time: {', '.join(heavy)}")
+    if not runs[0]['dags']:
+        failures.append("the file defines no DAG")
+    if failures:
+        sys.exit("DAG parse check failed: " + "; ".join(failures))
+
+
+if __name__ == '__main__':
+    main()
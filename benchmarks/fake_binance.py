@@ -0,0 +1,383 @@
+import base64
+import hashlib
+import json
+import select
+import socketserver
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from binance_etl.decoder import INTERVAL_MS
+from binance_etl.fetcher import KLINES_ENDPOINT, KLINES_WEIGHT, MAX_KLINES_LIMIT, PING_ENDPOINT
+from binance_etl.universe import EXCHANGE_INFO_ENDPOINT, EXCHANGE_INFO_WEIGHT, TICKER_24HR_ENDPOINT, TICKER_24HR_WEIGHT
+
+# Default listing time of every synthetic pair (2017-08-17, when Binance listed BTCUSDT)
+DEFAULT_LISTING_TIME = 1502928000000
+
+# Pairs listed on the stand-in as (base asset, quote asset, status), by descending 24h quote volume
+DEFAULT_MARKETS = [
+    ('USDC', 'USDT', 'TRADING'),
+    *[(base, 'USDT', 'TRADING') for base in ('BTC', 'ETH', 'BNB', 'XRP', 'ADA', 'DOT', 'UNI', 'LTC', 'LINK', 'BCH', 'SOL', 'DOGE')],
+    *[(base, 'EUR', 'TRADING') for base in ('BTC', 'ETH', 'BNB', 'XRP', 'ADA', 'DOT', 'UNI', 'LTC', 'LINK', 'BCH', 'SOL')],
+    ('LUNA', 'USDT', 'BREAK'),
+    ('ETH', 'BTC', 'TRADING'),
+]
+
+# Key suffix of the WebSocket opening handshake (RFC 6455)
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def synthetic_klines(symbol, interval, start_time, end_time, limit, listing_time=DEFAULT_LISTING_TIME, now=None):
+    """
+    Deterministic synthetic klines in the /api/v3/klines JSON layout.
+
+    Prices follow a smooth pseudo-random walk derived from the symbol and the open time, so
+    the same bar is returned identically by every request that covers it. Bars that have not opened yet (relative to
+    `now`) or that open before `listing_time` are not returned.
+
+    Parameters:
+    - symbol (str): Trading pair, e.g. 'BTCUSDT'.
+    - interval (str): Binance interval, e.g. '1h'.
+    - start_time (int): First open time in epoch milliseconds.
+    - end_time (int): Last open time in epoch milliseconds (inclusive).
+    - limit (int): Maximum number of bars.
+    - listing_time (int): First bar of every pair in epoch milliseconds.
+    - now (int): Current time in epoch milliseconds; defaults to the wall clock.
+
+    Returns:
+    - list: Raw kline arrays.
+    """
+    step = INTERVAL_MS[interval]
+    now = int(time.time() * 1000) if now is None else now
+    first = max(start_time, listing_time)
+    first = -(-first // step) * step
+    last = min(end_time, now)
+    count = max(0, min(limit, (last - first) // step + 1))
+    open_times = first + step * np.arange(count, dtype=np.int64)
+
+    seed = sum(symbol.encode()) % 97
+
+    def close_at(times):
+        phase = times / (step * 50.0) + seed
+        return 100.0 + seed + 10.0 * np.sin(phase) + 3.0 * np.sin(phase * 7.3)
+
+    # Every bar opens at the close of the bar before it, so a bar is the same whichever page returns it
+    close = close_at(open_times)
+    open_ = close_at(open_times - step)
+    high = np.maximum(open_, close) * 1.01
+    low = np.minimum(open_, close) * 0.99
+    volume = 10.0 + (open_times // step) % 17
+
+    return [
+        [int(t), f"{o:.8f}", f"{h:.8f}", f"{l:.8f}", f"{c:.8f}", f"{v:.8f}", int(t) + step - 1,
+         f"{v * c:.8f}", int(v) * 3, f"{v / 2:.8f}", f"{v * c / 2:.8f}", "0"]
+        for t, o, h, l, c, v in zip(open_times, open_, high, low, close, volume)
+    ]
+
+
+class FakeBinance:
+    """
+    Local stand-in for the Binance spot endpoints used by the pipeline (/api/v3/ping,
+    /api/v3/klines, /api/v3/exchangeInfo and /api/v3/ticker/24hr).
+
+    Runs a threaded HTTP server on localhost that answers kline requests with
+    synthetic_klines, sleeps `latency` seconds per request, reports the used weight of the
+    current minute in the X-MBX-USED-WEIGHT-1M header and answers 429 with Retry-After once
+    the weight limit is exceeded. With `error_every` set, every n-th kline request is
+    answered with an injected 429 as well. The exchange metadata lists `markets`, which can
+    be edited while the server runs to simulate listings and delistings; kline requests for
+    a symbol that is not listed are answered with 400 (-1121 Invalid symbol), like Binance.
+    """
+
+    def __init__(self, latency=0.0, error_every=0, weight_limit=6000, retry_after=1, listing_time=DEFAULT_LISTING_TIME, port=0,
+                 markets=DEFAULT_MARKETS):
+        self.latency = latency
+        self.error_every = error_every
+        self.weight_limit = weight_limit
+        self.retry_after = retry_after
+        self.listing_time = listing_time
+        self.markets = list(markets)
+
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self._weight = 0
+        self._minute = None
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """Base URL to hand to KlineFetcher instead of BASE_URL."""
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.request_count = 0
+            self.rate_limited_count = 0
+
+    def _account(self, weight):
+        """Count a request against the current minute; returns (used weight, rate limited)."""
+        with self._lock:
+            self.request_count += 1
+            minute = int(time.time() // 60)
+            if minute != self._minute:
+                self._minute, self._weight = minute, 0
+            self._weight += weight
+            injected = self.error_every and self.request_count % self.error_every == 0
+            limited = injected or self._weight > self.weight_limit
+            if limited:
+                self.rate_limited_count += 1
+            return self._weight, limited
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, used_weight, headers=()):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.send_header('X-MBX-USED-WEIGHT-1M', str(used_weight))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                if url.path == PING_ENDPOINT:
+                    used, _ = fake._account(1)
+                    self._send(200, {}, used)
+                elif url.path == KLINES_ENDPOINT:
+                    used, limited = fake._account(KLINES_WEIGHT)
+                    if limited:
+                        self._send(429, {"code": -1003, "msg": "Too many requests."}, used, [('Retry-After', str(fake.retry_after))])
+                        return
+                    interval = query.get('interval')
+                    if interval not in INTERVAL_MS or 'symbol' not in query:
+                        self._send(400, {"code": -1120, "msg": "Invalid interval."}, used)
+                        return
+                    if query['symbol'] not in {base + quote for base, quote, _ in fake.markets}:
+                        self._send(400, {"code": -1121, "msg": "Invalid symbol."}, used)
+                        return
+                    data = synthetic_klines(
+                        query['symbol'], interval,
+                        int(query.get('startTime', fake.listing_time)),
+                        int(query.get('endTime', 2 ** 62)),
+                        min(int(query.get('limit', 500)), MAX_KLINES_LIMIT),
+                        fake.listing_time,
+                    )
+                    self._send(200, data, used)
+                elif url.path == EXCHANGE_INFO_ENDPOINT:
+                    used, _ = fake._account(EXCHANGE_INFO_WEIGHT)
+                    symbols = [
+                        {"symbol": base + quote, "status": status, "baseAsset": base, "quoteAsset": quote, "isSpotTradingAllowed": True}
+                        for base, quote, status in fake.markets
+                    ]
+                    self._send(200, {"timezone": "UTC", "symbols": symbols}, used)
+                elif url.path == TICKER_24HR_ENDPOINT:
+                    used, _ = fake._account(TICKER_24HR_WEIGHT)
+                    count = len(fake.markets)
+                    tickers = [
+                        {"symbol": base + quote, "quoteVolume": f"{1e6 * (count - i) if status == 'TRADING' else 0.0:.8f}"}
+                        for i, (base, quote, status) in enumerate(fake.markets)
+                    ]
+                    self._send(200, tickers, used)
+                else:
+                    self._send(404, {"code": -1, "msg": "Not found."}, 0)
+
+        return Handler
+
+
+def kline_event(symbol, interval, kline, event_time, closed):
+    """A combined-stream kline event (<symbol>@kline_<interval>) built from a raw REST kline array."""
+    open_time, open_, high, low, close, volume, close_time, quote_volume, trades, taker_base, taker_quote, _ = kline
+    return {
+        "stream": f"{symbol.lower()}@kline_{interval}",
+        "data": {
+            "e": "kline", "E": event_time, "s": symbol,
+            "k": {
+                "t": open_time, "T": close_time, "s": symbol, "i": interval, "f": 0, "L": trades - 1,
+                "o": open_, "c": close, "h": high, "l": low, "v": volume, "n": trades, "x": closed,
+                "q": quote_volume, "V": taker_base, "Q": taker_quote, "B": "0",
+            },
+        },
+    }
+
+
+class FakeBinanceStream:
+    """
+    Local stand-in for Binance's combined kline streams (/stream?streams=<symbol>@kline_<interval>/...).
+
+    A minimal WebSocket server (RFC 6455, text frames only) on localhost. Every `tick` seconds
+    it sends an update of the open bar of every subscribed stream, and the final (x=true)
+    event of a bar right after it closes, with the same synthetic_klines values the REST
+    stand-in serves. Use the '1s' interval to see bars close in real time. With `drop_after`
+    set, every connection is cut without a close frame after that many seconds, like a
+    network failure, so the client has to reconnect and catch up over REST.
+    """
+
+    def __init__(self, tick=0.2, drop_after=None, listing_time=DEFAULT_LISTING_TIME, port=0):
+        self.tick = tick
+        self.drop_after = drop_after
+        self.listing_time = listing_time
+
+        self.connection_count = 0
+        self.closed_bar_count = 0
+        self._lock = threading.Lock()
+
+        self._server = socketserver.ThreadingTCPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """Base URL to hand to KlineStreamIngestor instead of STREAM_URL."""
+        host, port = self._server.server_address
+        return f"ws://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _bar(self, symbol, interval, open_time, now):
+        """The synthetic bar opened at open_time, as returned by the REST stand-in."""
+        bars = synthetic_klines(symbol, interval, open_time, open_time, 1, self.listing_time, now)
+        return bars[0] if bars and bars[0][0] == open_time else None
+
+    def _handler(self):
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            # Unbuffered, so select() sees every pending client frame
+            rbufsize = 0
+
+            def _read(self, size):
+                data = b''
+                while len(data) < size:
+                    chunk = self.rfile.read(size - len(data))
+                    if not chunk:
+                        raise ConnectionError("Client went away.")
+                    data += chunk
+                return data
+
+            def _send(self, opcode, payload):
+                header = bytes([0x80 | opcode])
+                if len(payload) < 126:
+                    header += bytes([len(payload)])
+                elif len(payload) < 2 ** 16:
+                    header += bytes([126]) + struct.pack('!H', len(payload))
+                else:
+                    header += bytes([127]) + struct.pack('!Q', len(payload))
+                self.wfile.write(header + payload)
+
+            def _receive(self):
+                """Read one (masked) client frame; returns (opcode, payload)."""
+                first, second = self._read(2)
+                length = second & 0x7F
+                if length == 126:
+                    length, = struct.unpack('!H', self._read(2))
+                elif length == 127:
+                    length, = struct.unpack('!Q', self._read(8))
+                mask = self._read(4) if second & 0x80 else bytes(4)
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self._read(length)))
+                return first & 0x0F, payload
+
+            def _handshake(self):
+                request_line = self.rfile.readline().decode()
+                headers = {}
+                for line in iter(self.rfile.readline, b'\r\n'):
+                    if not line:
+                        return None
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + WEBSOCKET_GUID).encode()).digest())
+                self.wfile.write(
+                    b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                    b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n"
+                )
+                url = urlparse(request_line.split()[1])
+                streams = parse_qs(url.query).get('streams', [''])[0].split('/')
+                subscribed = []
+                for stream in filter(None, streams):
+                    symbol, _, interval = stream.partition('@kline_')
+                    subscribed.append((symbol.upper(), interval))
+                return subscribed
+
+            def handle(self):
+                subscribed = self._handshake()
+                if subscribed is None:
+                    return
+                with fake._lock:
+                    fake.connection_count += 1
+                try:
+                    self._stream(subscribed)
+                except (ConnectionError, OSError):
+                    pass
+
+            def _stream(self, subscribed):
+                connected = time.time()
+                # Open time of the bar each stream is currently in; its final event is sent once it closes
+                current = {}
+                while True:
+                    now = int(time.time() * 1000)
+                    if fake.drop_after is not None and time.time() - connected >= fake.drop_after:
+                        return
+                    for symbol, interval in subscribed:
+                        step = INTERVAL_MS[interval]
+                        open_time = now // step * step
+                        previous = current.get((symbol, interval))
+                        if previous is not None and previous < open_time:
+                            bar = fake._bar(symbol, interval, previous, now)
+                            if bar is not None:
+                                self._send(0x1, json.dumps(kline_event(symbol, interval, bar, now, True)).encode())
+                                with fake._lock:
+                                    fake.closed_bar_count += 1
+                        current[(symbol, interval)] = open_time
+                        bar = fake._bar(symbol, interval, open_time, now)
+                        if bar is not None:
+                            self._send(0x1, json.dumps(kline_event(symbol, interval, bar, now, False)).encode())
+
+                    # Answer pings and close frames until the next tick
+                    readable, _, _ = select.select([self.request], [], [], fake.tick)
+                    if readable:
+                        opcode, payload = self._receive()
+                        if opcode == 0x8:
+                            self._send(0x8, payload[:2])
+                            return
+                        if opcode == 0x9:
+                            self._send(0xA, payload)
+
+        return Handler
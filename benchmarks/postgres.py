@@ -0,0 +1,76 @@
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+
+import psycopg2
+
+# Tables created by the pipeline, dropped between scenarios
+PIPELINE_TABLES = ['combined_table', 'ingest_watermarks', 'rollup_pending', 'ohlcv_weekly', 'ohlcv_monthly', 'features', 'feature_pending', 'model_runs', 'forecasts', 'symbol_universe']
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ThrowawayPostgres:
+    """
+    A Postgres cluster that only lives for the duration of a benchmark.
+
+    Without a DSN, a new cluster is created with initdb in a temporary directory and started
+    with pg_ctl on a free port (the Postgres binaries must be on PATH or in `bin_dir`, and
+    initdb refuses to run as root). With a DSN, that existing database is used instead and
+    the pipeline tables in it are dropped on every reset, so only point it at a scratch
+    database.
+    """
+
+    def __init__(self, dsn=None, bin_dir=None):
+        self.dsn = dsn
+        self.bin_dir = bin_dir
+        self._data_dir = None
+
+    def _binary(self, name):
+        if self.bin_dir:
+            return os.path.join(self.bin_dir, name)
+        path = shutil.which(name)
+        if path is None:
+            raise RuntimeError(f"{name} not found on PATH; pass --pg-bin or --dsn.")
+        return path
+
+    def __enter__(self):
+        if self.dsn is None:
+            self._data_dir = tempfile.mkdtemp(prefix='binance_etl_bench_')
+            port = _free_port()
+            subprocess.run([self._binary('initdb'), '-D', self._data_dir, '-U', 'postgres', '-A', 'trust'],
+                           check=True, stdout=subprocess.DEVNULL)
+            subprocess.run([self._binary('pg_ctl'), '-D', self._data_dir, '-w', '-l', os.path.join(self._data_dir, 'server.log'),
+                            '-o', f"-p {port} -k {self._data_dir} -c listen_addresses=127.0.0.1 -c fsync=off", 'start'],
+                           check=True, stdout=subprocess.DEVNULL)
+            self.dsn = f"host=127.0.0.1 port={port} user=postgres dbname=postgres"
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._data_dir is not None:
+            subprocess.run([self._binary('pg_ctl'), '-D', self._data_dir, '-m', 'fast', 'stop'], stdout=subprocess.DEVNULL)
+            shutil.rmtree(self._data_dir, ignore_errors=True)
+
+    def reset(self):
+        """Drop every pipeline table, so the next scenario starts from an empty database."""
+        connection = psycopg2.connect(self.dsn)
+        with connection.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {', '.join(PIPELINE_TABLES)} CASCADE;")
+        connection.commit()
+        connection.close()
+
+    def transaction_count(self):
+        """Committed plus rolled back transactions of the database so far."""
+        connection = psycopg2.connect(self.dsn)
+        with connection.cursor() as cur:
+            cur.execute("SELECT pg_stat_clear_snapshot();")
+            cur.execute("SELECT xact_commit + xact_rollback FROM pg_stat_database WHERE datname = current_database();")
+            count = cur.fetchone()[0]
+        connection.close()
+        return count
@@ -0,0 +1,112 @@
+"""
+Read-side query benchmark.
+
+Backfills --symbols pairs of --days of bars from the local Binance stand-in into a throwaway
+Postgres (benchmarks.postgres), then runs the same research query (one series over its whole
+history) --repeat times in three ways: an ad-hoc psycopg2 query turned into a DataFrame, the
+OhlcvCache library, and the HTTP service (Arrow IPC). It reports the median latency of each
+and the database statements sent per repeated query. Run it from the repository root:
+
+    python -m benchmarks.query --interval 1m --days 30
+"""
+import argparse
+import json
+import logging
+import statistics
+import threading
+import time
+
+import pandas as pd
+import psycopg2
+
+from benchmarks.fake_binance import FakeBinance
+from benchmarks.postgres import ThrowawayPostgres
+from benchmarks.scenario import SYMBOLS, CountingCursor
+from binance_etl.backfill import BackfillWindow, backfill, now_ms
+from binance_etl.decoder import DAY_MS
+from binance_etl.fetcher import KlineFetcher
+from binance_etl.query import OhlcvCache, fetch_ohlcv, make_server
+from binance_etl.schema import ensure_schema
+
+
+def median_seconds(function, repeat):
+    """Median wall time of `repeat` calls of function, and its last result."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--interval', default='1m', help='Binance interval of the queried series.')
+    parser.add_argument('--days', type=int, default=30, help='Days of history per pair.')
+    parser.add_argument('--symbols', type=int, default=4, help='Number of pairs to load and query in turn.')
+    parser.add_argument('--repeat', type=int, default=20, help='Queries per method.')
+    parser.add_argument('--dsn', help='Use this scratch database instead of a throwaway cluster (its pipeline tables are dropped).')
+    parser.add_argument('--pg-bin', help='Directory of initdb and pg_ctl, if they are not on PATH.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+    server = FakeBinance().start()
+    try:
+        with ThrowawayPostgres(args.dsn, args.pg_bin) as database:
+            database.reset()
+            connection = psycopg2.connect(database.dsn, cursor_factory=CountingCursor)
+            ensure_schema(connection)
+            end_time = now_ms() // DAY_MS * DAY_MS - 1
+            pairs = SYMBOLS[:args.symbols]
+            windows = [BackfillWindow(symbol, currency, args.interval, end_time + 1 - args.days * DAY_MS, end_time)
+                       for symbol, currency in pairs]
+            fetcher = KlineFetcher(server.url)
+            backfill(connection, fetcher, windows)
+            fetcher.close()
+
+            def ad_hoc(symbol, currency):
+                with connection.cursor() as cur:
+                    cur.execute("""
+                        SELECT open_time, open_price, high_price, low_price, close_price, volume, close_time, trade_count
+                        FROM combined_table WHERE symbol = %s AND currency = %s AND interval = %s ORDER BY open_time;
+                    """, (symbol, currency, args.interval))
+                    return pd.DataFrame(cur.fetchall(), columns=[c.name for c in cur.description])
+
+            cache_connection = psycopg2.connect(database.dsn, cursor_factory=CountingCursor)
+            service_connection = psycopg2.connect(database.dsn, cursor_factory=CountingCursor)
+            cache = OhlcvCache(cache_connection)
+            service = make_server(OhlcvCache(service_connection), port=0)
+            threading.Thread(target=service.serve_forever, daemon=True).start()
+            url = f"http://127.0.0.1:{service.server_address[1]}"
+
+            results = {}
+            for name, query in (
+                ('ad_hoc_sql', lambda symbol, currency: ad_hoc(symbol, currency)),
+                ('library', lambda symbol, currency: cache.query(symbol, currency, args.interval)),
+                ('http_arrow', lambda symbol, currency: fetch_ohlcv(url, symbol, currency, args.interval)),
+            ):
+                # The first query of every pair loads it (a cold cache), the rest are answered from memory
+                cold = [median_seconds(lambda: query(symbol, currency), 1)[0] for symbol, currency in pairs]
+                CountingCursor.statements = 0
+                warm, rows = median_seconds(lambda: query(*pairs[-1]), args.repeat)
+                results[name] = {
+                    "cold_ms": round(statistics.median(cold) * 1000, 2),
+                    "warm_ms": round(warm * 1000, 2),
+                    "rows": len(rows),
+                    "statements_per_warm_query": round(CountingCursor.statements / args.repeat, 2),
+                }
+            results['library']['cache'] = cache.stats()
+
+            service.shutdown()
+            service.server_close()
+            service_connection.close()
+            cache_connection.close()
+            connection.close()
+    finally:
+        server.stop()
+
+    print(json.dumps({"interval": args.interval, "days": args.days, "pairs": len(pairs), "repeat": args.repeat, **results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+End-to-end ingestion benchmark.
+
+Starts a local Binance stand-in (benchmarks.fake_binance) and a throwaway Postgres
+(benchmarks.postgres), then for every interval measures:
+
+- populate: the populate_database task path, a full backfill into an empty database
+- latest: the add_the_latest_data task path, after rewinding the database by --lag-days
+- script: Populate_database_script.py end to end into an empty database
+
+and reports rows/s, requests/s, database round-trips and transactions, peak RSS and wall
+time per scenario. Run it from the repository root:
+
+    python -m benchmarks.run --intervals 1d 1h 1m --latency 0.02 --error-every 50
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+
+import psycopg2
+
+from benchmarks.fake_binance import DEFAULT_LISTING_TIME, FakeBinance
+from benchmarks.postgres import ThrowawayPostgres
+from benchmarks.scenario import SYMBOLS
+from binance_etl.backfill import now_ms
+from binance_etl.decoder import DAY_MS
+
+# Days of history per interval (None: everything since the listing time), about 3k-200k bars per series
+DEFAULT_HISTORY_DAYS = {'1d': None, '1h': 365, '1m': 7}
+
+REPORT_COLUMNS = ['scenario', 'interval', 'rows', 'wall_time', 'rows_per_s', 'requests', 'requests_per_s',
+                  'rate_limited', 'db_statements', 'db_transactions', 'peak_rss_mb']
+
+
+def rewind(dsn, interval, lag_days):
+    """Delete the last `lag_days` of bars of an interval and move its watermarks back accordingly."""
+    connection = psycopg2.connect(dsn)
+    with connection.cursor() as cur:
+        cur.execute("""
+            DELETE FROM combined_table
+            WHERE interval = %s AND open_time > (now() AT TIME ZONE 'UTC') - %s * INTERVAL '1 day';
+        """, (interval, lag_days))
+        cur.execute("""
+            UPDATE ingest_watermarks w
+            SET last_open_time = (
+                SELECT MAX(open_time) FROM combined_table c
+                WHERE c.symbol = w.symbol AND c.currency = w.currency AND c.interval = w.interval
+            )
+            WHERE w.interval = %s;
+        """, (interval,))
+    connection.commit()
+    connection.close()
+
+
+def run_scenario(stage, interval, start, args, server, database, cache_dir):
+    """Run one stage in a fresh process and combine its measurements with the server and database counters."""
+    server.reset_counters()
+    transactions = database.transaction_count()
+    result = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.scenario', stage, '--interval', interval, '--start', str(start),
+         '--symbols', str(args.symbols), '--base-url', server.url, '--dsn', database.dsn, '--cache-dir', cache_dir],
+        stdout=subprocess.PIPE, text=True, check=True,
+    )
+    measured = json.loads(result.stdout.strip().splitlines()[-1])
+    wall_time = measured['wall_time']
+    return {
+        "scenario": stage,
+        "interval": interval,
+        "rows": measured['rows'],
+        "wall_time": round(wall_time, 2),
+        "rows_per_s": round(measured['rows'] / wall_time),
+        "requests": server.request_count,
+        "requests_per_s": round(server.request_count / wall_time, 1),
+        "rate_limited": server.rate_limited_count,
+        "db_statements": measured['db_statements'],
+        # The two counting transactions of this harness are not part of the scenario
+        "db_transactions": database.transaction_count() - transactions - 2,
+        "peak_rss_mb": round(measured['peak_rss_mb'], 1),
+    }
+
+
+def print_report(results):
+    widths = {c: max(len(c), *(len(str(r[c])) for r in results)) for c in REPORT_COLUMNS}
+    print("  ".join(c.rjust(widths[c]) for c in REPORT_COLUMNS))
+    for result in results:
+        print("  ".join(str(result[c]).rjust(widths[c]) for c in REPORT_COLUMNS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--intervals', nargs='+', default=list(DEFAULT_HISTORY_DAYS))
+    parser.add_argument('--history-days', type=int, help='Days of history for every interval (default: per interval, see DEFAULT_HISTORY_DAYS).')
+    parser.add_argument('--symbols', type=int, default=len(SYMBOLS), help='Number of pairs for the populate and latest scenarios.')
+    parser.add_argument('--lag-days', type=float, default=2, help='How far the database is rewound before the incremental scenario.')
+    parser.add_argument('--scenarios', nargs='+', default=['populate', 'latest', 'script'], choices=['populate', 'latest', 'script'])
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the fake API sleeps per request.')
+    parser.add_argument('--error-every', type=int, default=0, help='Answer every n-th kline request with an injected 429.')
+    parser.add_argument('--dsn', help='Use this scratch database instead of a throwaway cluster (its pipeline tables are dropped).')
+    parser.add_argument('--pg-bin', help='Directory of initdb and pg_ctl, if they are not on PATH.')
+    parser.add_argument('--json', help='Also write the results to this JSON file.')
+    args = parser.parse_args()
+
+    server = FakeBinance(latency=args.latency, error_every=args.error_every).start()
+    results = []
+    try:
+        with ThrowawayPostgres(args.dsn, args.pg_bin) as database, tempfile.TemporaryDirectory() as cache_root:
+            for interval in args.intervals:
+                days = args.history_days if args.history_days is not None else DEFAULT_HISTORY_DAYS.get(interval)
+                start = DEFAULT_LISTING_TIME if days is None else max(DEFAULT_LISTING_TIME, (now_ms() - days * DAY_MS) // DAY_MS * DAY_MS)
+                for stage in args.scenarios:
+                    if stage == 'latest':
+                        if 'populate' not in args.scenarios:
+                            database.reset()
+                            run_scenario('populate', interval, start, args, server, database, tempfile.mkdtemp(dir=cache_root))
+                        rewind(database.dsn, interval, args.lag_days)
+                    else:
+                        database.reset()
+                    # Every script run starts with an empty kline cache
+                    cache_dir = tempfile.mkdtemp(dir=cache_root)
+                    result = run_scenario(stage, interval, start, args, server, database, cache_dir)
+                    print(f"{stage} {interval}: {result['rows']} rows in {result['wall_time']}s", file=sys.stderr)
+                    results.append(result)
+    finally:
+        server.stop()
+
+    print()
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Run one benchmark stage in a fresh process and print its measurements as JSON.
+
+Started by benchmarks.run, so that the peak RSS of every stage is measured on its own.
+"""
+import argparse
+import json
+import re
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+import psycopg2.extensions
+
+from binance_etl.backfill import BackfillWindow, backfill, now_ms
+from binance_etl.decoder import INTERVAL_MS
+from binance_etl.fetcher import KlineFetcher
+from binance_etl.schema import ensure_schema
+from binance_etl.watermarks import read_watermarks
+
+# A fixed set of pairs the size of the default universe (UNIVERSE_SIZE pairs per quote asset), so runs stay comparable
+SYMBOLS = [
+    ('BTCUSDT', 'USD'), ('ETHUSDT', 'USD'), ('BNBUSDT', 'USD'), ('XRPUSDT', 'USD'), ('ADAUSDT', 'USD'),
+    ('DOTUSDT', 'USD'), ('UNIUSDT', 'USD'), ('LTCUSDT', 'USD'), ('LINKUSDT', 'USD'), ('BCHUSDT', 'USD'),
+    ('BTCEUR', 'EUR'), ('ETHEUR', 'EUR'), ('BNBEUR', 'EUR'), ('XRPEUR', 'EUR'), ('ADAEUR', 'EUR'),
+    ('DOTEUR', 'EUR'), ('UNIEUR', 'EUR'), ('LTCEUR', 'EUR'), ('LINKEUR', 'EUR'), ('BCHEUR', 'EUR'),
+]
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Cursor that counts the statements it sends, i.e. the database round-trips of a stage."""
+
+    statements = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.statements += 1
+        return super().execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        CountingCursor.statements += 1
+        return super().copy_expert(sql, file, size)
+
+
+def _peak_rss_mb(who):
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def run_populate(args, connection, fetcher):
+    """The populate_database task: every series from the start of the history up to now."""
+    ensure_schema(connection)
+    end_time = now_ms()
+    windows = [BackfillWindow(symbol, currency, args.interval, args.start, end_time) for symbol, currency in SYMBOLS[:args.symbols]]
+    return backfill(connection, fetcher, windows)
+
+
+def run_latest(args, connection, fetcher):
+    """The extract_watermarks and add_the_latest_data tasks: every series from its watermark up to now."""
+    ensure_schema(connection)
+    watermarks = read_watermarks(connection)
+    end_time = now_ms()
+    windows = []
+    for symbol, currency in SYMBOLS[:args.symbols]:
+        watermark = watermarks.get((symbol, currency, args.interval))
+        start_time = watermark + INTERVAL_MS[args.interval] if watermark is not None else args.start
+        windows.append(BackfillWindow(symbol, currency, args.interval, start_time, end_time))
+    return backfill(connection, fetcher, windows)
+
+
+def run_script(args):
+    """Populate_database_script.py end to end, as a child process."""
+    start = datetime.fromtimestamp(args.start / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+    result = subprocess.run(
+        [sys.executable, 'Populate_database_script.py', '--base-url', args.base_url, '--dsn', args.dsn,
+         '--start', start, '--intervals', args.interval, '--cache-dir', args.cache_dir],
+        capture_output=True, text=True,
+    )
+    if result.returncode:
+        # Only show the script's output (progress bars included) when it failed
+        sys.stderr.write(result.stderr)
+        result.check_returncode()
+    match = re.search(r"Inserted (\d+) rows", result.stdout)
+    return int(match.group(1)) if match else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('stage', choices=['populate', 'latest', 'script'])
+    parser.add_argument('--interval', required=True)
+    parser.add_argument('--start', type=int, required=True, help='History start in epoch milliseconds.')
+    parser.add_argument('--symbols', type=int, default=len(SYMBOLS))
+    parser.add_argument('--base-url', required=True)
+    parser.add_argument('--dsn', required=True)
+    parser.add_argument('--cache-dir', required=True, help='Kline cache directory of the script stage.')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.stage == 'script':
+        rows = run_script(args)
+        statements = None
+        peak_rss = _peak_rss_mb(resource.RUSAGE_CHILDREN)
+    else:
+        connection = psycopg2.connect(args.dsn, cursor_factory=CountingCursor)
+        fetcher = KlineFetcher(args.base_url)
+        function = run_populate if args.stage == 'populate' else run_latest
+        rows = function(args, connection, fetcher)
+        fetcher.close()
+        connection.close()
+        statements = CountingCursor.statements
+        peak_rss = _peak_rss_mb(resource.RUSAGE_SELF)
+
+    print(json.dumps({
+        "rows": rows,
+        "wall_time": time.perf_counter() - started,
+        "db_statements": statements,
+        "peak_rss_mb": peak_rss,
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Streaming ingestion benchmark.
+
+Starts the local REST and WebSocket stand-ins (benchmarks.fake_binance) and a throwaway
+Postgres (benchmarks.postgres), runs KlineStreamIngestor on '1s' bars for a while with the
+stream connection cut every --drop-after seconds, and reports how fast closed bars land in
+the database, how many REST requests the catch-ups cost and whether any bar is missing.
+Run it from the repository root:
+
+    python -m benchmarks.stream --seconds 30 --drop-after 10
+"""
+import argparse
+import json
+import logging
+
+import psycopg2
+
+from benchmarks.fake_binance import FakeBinance, FakeBinanceStream
+from benchmarks.postgres import ThrowawayPostgres
+from benchmarks.scenario import SYMBOLS
+from binance_etl.backfill import BackfillWindow, now_ms
+from binance_etl.decoder import INTERVAL_MS
+from binance_etl.fetcher import KlineFetcher
+from binance_etl.gaps import window_coverage
+from binance_etl.metrics import IngestMetrics
+from binance_etl.schema import ensure_schema
+from binance_etl.streaming import KlineStreamIngestor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=30, help='How long the ingestor runs.')
+    parser.add_argument('--interval', default='1s', help='Binance interval of the streamed bars.')
+    parser.add_argument('--symbols', type=int, default=len(SYMBOLS), help='Number of pairs to stream.')
+    parser.add_argument('--history-bars', type=int, default=600, help='Bars of history caught up over REST at the start.')
+    parser.add_argument('--drop-after', type=float, help='Cut every stream connection after this many seconds.')
+    parser.add_argument('--dsn', help='Use this scratch database instead of a throwaway cluster (its pipeline tables are dropped).')
+    parser.add_argument('--pg-bin', help='Directory of initdb and pg_ctl, if they are not on PATH.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+    server = FakeBinance().start()
+    stream = FakeBinanceStream(drop_after=args.drop_after).start()
+    try:
+        with ThrowawayPostgres(args.dsn, args.pg_bin) as database:
+            database.reset()
+            connection = psycopg2.connect(database.dsn)
+            ensure_schema(connection)
+
+            step = INTERVAL_MS[args.interval]
+            history_start = (now_ms() - args.history_bars * step) // step * step
+            series = [(symbol, currency, args.interval) for symbol, currency in SYMBOLS[:args.symbols]]
+            metrics = IngestMetrics()
+            fetcher = KlineFetcher(server.url, metrics=metrics)
+            ingestor = KlineStreamIngestor(connection, fetcher, series, stream.url, history_start, metrics=metrics)
+            started = now_ms()
+            rows = ingestor.run(args.seconds)
+            fetcher.close()
+
+            # Every bar that closed before the ingestor stopped (and had a tick to be sent) should be stored
+            end_time = started + int(args.seconds * 1000) - 2 * step
+            windows = [BackfillWindow(symbol, currency, interval, history_start, end_time) for symbol, currency, interval in series]
+            coverage = window_coverage(connection, windows, end_time + step)
+            connection.close()
+    finally:
+        stream.stop()
+        server.stop()
+
+    stages = metrics.summary()['stages']
+    land = stages.get('land', {'calls': 0, 'seconds': 0})
+    print(json.dumps({
+        "rows": rows,
+        "streamed_bars": stages.get('stream', {}).get('rows', 0),
+        "landed_bars": land['calls'],
+        "mean_landing_delay_s": round(land['seconds'] / land['calls'], 3) if land['calls'] else None,
+        "writes": stages.get('write', {}).get('calls', 0),
+        "connections": stream.connection_count,
+        "reconnects": ingestor.reconnect_count,
+        "rest_requests": server.request_count,
+        "expected_bars": sum(expected for _, expected, _ in coverage),
+        "missing_bars": sum(max(0, expected - stored) for _, expected, stored in coverage),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
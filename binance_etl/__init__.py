@@ -0,0 +1,4 @@
+"""
+Shared Binance kline ingestion code used by both the Airflow DAG and
+Populate_database_script.py.
+"""
@@ -0,0 +1,269 @@
+import logging
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+from binance_etl.decoder import INTERVAL_MS, decode_klines, missing_open_times
+from binance_etl.fetcher import MAX_KLINES_LIMIT, KlineRequest
+from binance_etl.metrics import measure
+from binance_etl.parallel import bounded_map
+from binance_etl.writer import QueuedWriter, write_klines
+
+# A time range of one series to bring into the database (epoch milliseconds, end inclusive)
+BackfillWindow = namedtuple('BackfillWindow', ['symbol', 'currency', 'interval', 'start_time', 'end_time'])
+
+# Memory the pipeline buffers of a backfill may use (pages being fetched plus decoded pages waiting for the writer)
+DEFAULT_MEMORY_CEILING = 128 * 1024 ** 2
+
+# Approximate memory of one kline while its page is fetched (parsed JSON, ~0.75 KB, plus the
+# response body) and once decoded into columns (~0.1 KB)
+IN_FLIGHT_KLINE_BYTES = 1024
+DECODED_KLINE_BYTES = 128
+
+
+class BackfillError(Exception):
+    """Raised after a backfill when some of its pages could not be fetched or written."""
+
+    def __init__(self, failures, inserted=0):
+        request, error = failures[0]
+        super().__init__(f"{len(failures)} pages failed, first: {request.symbol} {request.interval} from {request.start_time}: {error}")
+        self.failures = failures
+        self.inserted = inserted
+
+
+def now_ms():
+    """Current time in epoch milliseconds."""
+    return int(time.time() * 1000)
+
+
+def plan_pages(window, limit=MAX_KLINES_LIMIT):
+    """
+    Split a window into /api/v3/klines requests of at most `limit` bars each.
+
+    The startTime cursor is walked forward in steps of `limit` bars, so every page can be
+    fetched independently and in parallel.
+
+    Parameters:
+    - window (BackfillWindow): The series and time range to cover.
+    - limit (int): Maximum number of bars per request.
+
+    Returns:
+    - list: KlineRequest objects covering the window without overlap.
+    """
+    step = INTERVAL_MS[window.interval]
+    page_span = step * limit
+    cursor = -(-window.start_time // step) * step
+    pages = []
+    while cursor <= window.end_time:
+        page_end = min(cursor + page_span - 1, window.end_time)
+        pages.append(KlineRequest(window.symbol, window.currency, window.interval, cursor, page_end, limit))
+        cursor += page_span
+    return pages
+
+
+def plan_shards(windows, limit=MAX_KLINES_LIMIT, pages_per_shard=50, max_shards=1000):
+    """
+    Split windows into independent shards of whole pages, e.g. for one Airflow task each.
+
+    Shard boundaries fall on the page grid of plan_pages, so a sharded backfill requests (and
+    caches) exactly the same pages as an unsharded one. When the windows would produce more
+    than max_shards shards, the shards are made larger instead.
+
+    Parameters:
+    - windows (list): BackfillWindow objects.
+    - limit (int): Maximum number of bars per request.
+    - pages_per_shard (int): Preferred number of pages per shard.
+    - max_shards (int): Upper bound on the number of shards (Airflow caps mapped tasks).
+
+    Returns:
+    - list: BackfillWindow objects, each covering at most pages_per_shard pages of one series.
+    """
+    total_pages = sum(len(plan_pages(window, limit)) for window in windows)
+    pages_per_shard = max(pages_per_shard, -(-total_pages // max_shards))
+
+    shards = []
+    for window in windows:
+        step = INTERVAL_MS[window.interval]
+        shard_span = step * limit * pages_per_shard
+        cursor = -(-window.start_time // step) * step
+        while cursor <= window.end_time:
+            shards.append(window._replace(start_time=cursor, end_time=min(cursor + shard_span - 1, window.end_time)))
+            cursor += shard_span
+    return shards
+
+
+def trim_to_first_bar(fetcher, windows, limit=MAX_KLINES_LIMIT):
+    """
+    Move the start of long windows up to the first bar Binance actually has.
+
+    Pairs listed after the window start would otherwise cost one empty page per `limit` bars
+    before their listing date. Each long window is probed with a single limit=1 request (all
+    probes run in parallel); windows that fit into one page are left untouched.
+
+    Parameters:
+    - fetcher (KlineFetcher): Fetcher used for the probes.
+    - windows (list): BackfillWindow objects.
+    - limit (int): Page size used later for the window.
+
+    Returns:
+    - list: The windows with adjusted start times; windows without any data are dropped.
+    """
+    short_windows = [w for w in windows if (w.end_time - w.start_time) < INTERVAL_MS[w.interval] * limit]
+    long_windows = [w for w in windows if (w.end_time - w.start_time) >= INTERVAL_MS[w.interval] * limit]
+    probes = {KlineRequest(w.symbol, w.currency, w.interval, w.start_time, w.end_time, 1): w for w in long_windows}
+
+    trimmed = list(short_windows)
+    for request, data, error in fetcher.fetch_many(probes):
+        window = probes[request]
+        if error is not None:
+            logging.warning(f"Could not probe the first bar of {window.symbol} {window.interval}: {error}")
+            trimmed.append(window)
+        elif data:
+            trimmed.append(window._replace(start_time=max(window.start_time, int(data[0][0]))))
+        else:
+            logging.info(f"No {window.interval} data for {window.symbol} in the requested range.")
+    return trimmed
+
+
+def pipeline_limits(memory_ceiling, limit=MAX_KLINES_LIMIT, max_workers=1):
+    """
+    Split a memory ceiling between the fetch and write stages of a backfill.
+
+    Half of it bounds the pages being fetched and decoded, the other half the decoded pages
+    waiting for the writer.
+
+    Parameters:
+    - memory_ceiling (int): Bytes the pipeline buffers may use.
+    - limit (int): Maximum number of bars per page.
+    - max_workers (int): Fetcher threads; at least this many pages are always in flight.
+
+    Returns:
+    - tuple: (pages in flight, pages queued for the writer).
+    """
+    in_flight = max(max_workers, memory_ceiling // 2 // (limit * IN_FLIGHT_KLINE_BYTES))
+    queued = max(1, memory_ceiling // 2 // (limit * DECODED_KLINE_BYTES))
+    return in_flight, queued
+
+
+def _page_frames(fetcher, pages, cache, metrics=None, max_in_flight=None):
+    """
+    Yield (request, decoded frame, error) for every page as it becomes available.
+
+    Each page is read from the cache or fetched and decoded in one of the fetcher's worker
+    threads, and pages are pulled from `pages` lazily, at most max_in_flight at a time.
+    """
+    def load(request):
+        if cache is not None:
+            with measure(metrics, 'cache', request.symbol, request.interval) as counts:
+                df = cache.get(request)
+                counts['rows'] = 0 if df is None else len(df)
+            if df is not None:
+                return df
+
+        data = fetcher.fetch_klines(request)
+        # Decode the raw klines straight into typed columns
+        with measure(metrics, 'decode', request.symbol, request.interval, rows=len(data)):
+            df = decode_klines(data, request.symbol, request.currency, request.interval)
+        if cache is not None:
+            cache.put(request, df, now_ms())
+        return df
+
+    return bounded_map(load, pages, fetcher.max_workers, max_in_flight)
+
+
+def backfill(connection, fetcher, windows, limit=MAX_KLINES_LIMIT, progress=None, cache=None, metrics=None,
+             memory_ceiling=DEFAULT_MEMORY_CEILING):
+    """
+    Bring the given windows into combined_table, fetching their pages in parallel.
+
+    Each window is trimmed to the first available bar and split into pages of at most `limit`
+    bars, which flow through a pipeline of bounded stages: the fetcher's worker threads read
+    each page from the KlineCache (closed pages) or fetch it within the rate budget and
+    decode it, the calling thread checks it for missing bars, and a QueuedWriter writes it.
+    Pages are planned lazily and every stage only holds as many pages as memory_ceiling
+    allows (see pipeline_limits), so a slower stage holds back the ones before it and peak
+    memory does not depend on the length of the history.
+
+    A page that fails to fetch or write does not stop the others; once all pages have been
+    handled, a BackfillError listing the failed pages is raised. The watermark of a series
+    still moves to its latest written bar, so a failed page before it is not picked up by
+    resuming from the watermark; repair_gaps (with history_start, for a failed first page)
+    fills it in later, and since writes are idempotent, rerunning the same windows does too.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+    - fetcher (KlineFetcher): Fetcher used for all requests.
+    - windows (list): BackfillWindow objects.
+    - limit (int): Maximum number of bars per request.
+    - progress (callable): Optional tqdm-like wrapper applied to the page results.
+    - cache (KlineCache): Optional local page cache.
+    - metrics (IngestMetrics): Optional collector of the cache, decode, validate and write
+      stage timings (pass the same instance to the fetcher for the HTTP stages).
+    - memory_ceiling (int): Bytes the pipeline buffers may use.
+
+    Returns:
+    - int: Number of rows inserted.
+
+    Raises:
+    - BackfillError: If some pages failed (its `inserted` holds the rows written by the others).
+    """
+    windows = trim_to_first_bar(fetcher, windows, limit)
+    total_pages = sum(len(plan_pages(window, limit)) for window in windows)
+    pages = (page for window in windows for page in plan_pages(window, limit))
+    in_flight, queued = pipeline_limits(memory_ceiling, limit, fetcher.max_workers)
+    logging.info(f"Backfilling {len(windows)} series in {total_pages} pages ({in_flight} in flight, {queued} queued for writing).")
+
+    results = _page_frames(fetcher, pages, cache, metrics, in_flight)
+    if progress is not None:
+        results = progress(results, total=total_pages)
+
+    failures = []
+    writer = QueuedWriter(connection, queued, metrics)
+    try:
+        for request, df, error in results:
+            if error is not None:
+                logging.error(f"Error fetching {request.symbol} {request.interval} from {request.start_time}: {error}")
+                failures.append((request, error))
+                continue
+
+            # Check for missing bars inside the page (the still-open last bar may legitimately be absent)
+            with measure(metrics, 'validate', request.symbol, request.interval, rows=len(df)):
+                page_end = min(request.end_time, now_ms() - INTERVAL_MS[request.interval])
+                missing = missing_open_times(df['open_time'].to_numpy(), request.start_time, page_end, request.interval)
+            if len(missing):
+                first, last = pd.to_datetime([missing[0], missing[-1]], unit='ms')
+                logging.warning(f"Missing {len(missing)} {request.interval} bars for {request.symbol} between {first} and {last}.")
+
+            # Hand the page to the writer (one COPY + upsert, committed once), waiting while it is behind
+            writer.put(request, df)
+    finally:
+        inserted = writer.close()
+
+    failures.extend(writer.failures)
+    if failures:
+        raise BackfillError(failures, inserted)
+    return inserted
+
+
+def replay(connection, cache, progress=None):
+    """
+    Rebuild combined_table only from the local page cache, without any network access.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+    - cache (KlineCache): The page cache to replay.
+    - progress (callable): Optional tqdm-like wrapper applied to the cached pages.
+
+    Returns:
+    - int: Number of rows inserted.
+    """
+    frames = iter(cache)
+    if progress is not None:
+        frames = progress(frames, total=len(cache))
+
+    inserted = 0
+    for df in frames:
+        inserted += write_klines(connection, df)
+    logging.info(f"Replayed {inserted} rows from the kline cache.")
+    return inserted
@@ -0,0 +1,231 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from binance_etl.decoder import INTERVAL_MS
+
+# Default size limit of the on-disk cache (5 GiB)
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+
+# Share of max_bytes an eviction frees the cache down to, so it does not run again on the next page
+LOW_WATER_MARK = 0.9
+
+# LRU indexes of the cache directories used in this process, shared by their KlineCache instances
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class _LruIndex:
+    """
+    Size and recency of every page of one cache directory, kept in memory.
+
+    The directory is walked once, on first use; after that pages are added, touched and
+    evicted without any directory listing. Pages written by other processes are picked up
+    the next time a process builds its index.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.size = 0
+        self._pages = None
+
+    def _build(self):
+        # Called with the lock held
+        if self._pages is not None:
+            return
+        pages = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.parquet'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    pages.append((stat.st_mtime, path, stat.st_size))
+        self._pages = OrderedDict((path, size) for _, path, size in sorted(pages))
+        self.size = sum(self._pages.values())
+
+    def __len__(self):
+        with self.lock:
+            self._build()
+            return len(self._pages)
+
+    def touch(self, path):
+        with self.lock:
+            if self._pages is not None and path in self._pages:
+                self._pages.move_to_end(path)
+
+    def add(self, path, size):
+        with self.lock:
+            self._build()
+            self.size += size - self._pages.pop(path, 0)
+            self._pages[path] = size
+
+    def evict(self, max_bytes, low_water_bytes):
+        """Delete the least recently used pages down to low_water_bytes once the size exceeds max_bytes."""
+        with self.lock:
+            self._build()
+            if self.size <= max_bytes:
+                return 0
+            evicted = 0
+            while self._pages and self.size > low_water_bytes:
+                path, size = self._pages.popitem(last=False)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Already evicted by another process
+                    pass
+                self.size -= size
+                evicted += 1
+            return evicted
+
+
+def _index_for(directory):
+    key = os.path.realpath(directory)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = _LruIndex(directory)
+        return _indexes[key]
+
+
+class KlineCache:
+    """
+    Local on-disk cache of decoded kline pages, stored as Parquet files.
+
+    Pages are addressed by a hash of (symbol, interval, window start, window end), so the
+    same page of the same backfill grid always maps to the same file. Only closed windows
+    (whose last bar has already closed) are stored, because their content can no longer
+    change; the still-open trailing window always goes to the network. When the cache grows
+    past max_bytes, the least recently used files are evicted until it is back under
+    LOW_WATER_MARK of max_bytes. Sizes and recency are tracked in an in-memory index that is
+    built on the first write and shared by all caches of the same directory in the process.
+
+    Pages can be read and stored from several threads and processes at once: every page is
+    written to a temporary file of its own and then atomically renamed into place, and a
+    page evicted by another process is treated as a miss. Writing Parquet requires pyarrow.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._index = _index_for(directory)
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.parquet'):
+                    yield os.path.join(root, name)
+
+    def path_for(self, request):
+        """
+        File path of the page answering a KlineRequest.
+
+        Parameters:
+        - request (KlineRequest): The page request.
+
+        Returns:
+        - str: Path of the Parquet file (which may not exist yet).
+        """
+        key = f"{request.symbol}|{request.interval}|{request.start_time}|{request.end_time}"
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.parquet")
+
+    @staticmethod
+    def is_closed(request, now):
+        """
+        Tell whether every bar a request can return has already closed.
+
+        Parameters:
+        - request (KlineRequest): The page request.
+        - now (int): Current time in epoch milliseconds.
+
+        Returns:
+        - bool: True if the page content is final.
+        """
+        return request.end_time is not None and request.end_time + INTERVAL_MS[request.interval] <= now
+
+    def contains(self, request):
+        """Tell whether the page answering a request is cached."""
+        return os.path.exists(self.path_for(request))
+
+    def get(self, request):
+        """
+        Read a cached page.
+
+        Parameters:
+        - request (KlineRequest): The page request.
+
+        Returns:
+        - pd.DataFrame or None: The decoded klines, or None on a cache miss.
+        """
+        path = self.path_for(request)
+        try:
+            df = pd.read_parquet(path)
+        except (FileNotFoundError, OSError):
+            return None
+        try:
+            # Reading counts as a use for the LRU eviction (the mtime carries it over to the next process)
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process since it was read
+            return df
+        self._index.touch(path)
+        return df
+
+    def put(self, request, df, now):
+        """
+        Store a decoded page if its window is closed.
+
+        Parameters:
+        - request (KlineRequest): The page request.
+        - df (pd.DataFrame): Decoded klines as returned by decode_klines.
+        - now (int): Current time in epoch milliseconds.
+
+        Returns:
+        - bool: True if the page was stored.
+        """
+        if not self.is_closed(request, now):
+            return False
+
+        path = self.path_for(request)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Every writer (thread or shard process) gets its own temporary file, so a page fetched by several of them
+        # at once is published whole by whichever finishes last
+        fd, temporary = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                df.to_parquet(f, index=False)
+            size = os.path.getsize(temporary)
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.remove(temporary)
+            except FileNotFoundError:
+                pass
+            raise
+        self._index.add(path, size)
+        if self._index.size > self.max_bytes:
+            self.evict()
+        return True
+
+    def evict(self):
+        """Delete least recently used pages until the cache is back under LOW_WATER_MARK of max_bytes."""
+        evicted = self._index.evict(self.max_bytes, int(self.max_bytes * LOW_WATER_MARK))
+        if evicted:
+            logging.info(f"Kline cache evicted {evicted} pages, down to {self._index.size} bytes.")
+
+    def __iter__(self):
+        """Yield every cached page as a decoded DataFrame."""
+        for path in self._files():
+            yield pd.read_parquet(path)
+
+    def __len__(self):
+        return len(self._index)
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+SECOND_MS = 1000
+MINUTE_MS = 60 * SECOND_MS
+HOUR_MS = 60 * MINUTE_MS
+DAY_MS = 24 * HOUR_MS
+
+# Length of each supported Binance interval in milliseconds ('1M' is left out, months have no fixed length)
+INTERVAL_MS = {
+    '1s': SECOND_MS,
+    '1m': MINUTE_MS,
+    '3m': 3 * MINUTE_MS,
+    '5m': 5 * MINUTE_MS,
+    '15m': 15 * MINUTE_MS,
+    '30m': 30 * MINUTE_MS,
+    '1h': HOUR_MS,
+    '2h': 2 * HOUR_MS,
+    '4h': 4 * HOUR_MS,
+    '6h': 6 * HOUR_MS,
+    '8h': 8 * HOUR_MS,
+    '12h': 12 * HOUR_MS,
+    '1d': DAY_MS,
+    '3d': 3 * DAY_MS,
+    '1w': 7 * DAY_MS,
+}
+
+# Positions of the fields we keep inside a raw Binance kline array
+OPEN_TIME, OPEN, HIGH, LOW, CLOSE, VOLUME, CLOSE_TIME, TRADE_COUNT = 0, 1, 2, 3, 4, 5, 6, 8
+
+# Column order of the decoded kline frames (matches the combined_table columns)
+KLINE_COLUMNS = ["symbol", "currency", "interval", "open_time", "open_price", "high_price", "low_price", "close_price", "volume", "close_time", "trade_count"]
+
+
+def decode_klines(data, symbol, currency, interval):
+    """
+    Decode a raw /api/v3/klines JSON array into typed columns in one pass.
+
+    Times stay as int64 epoch milliseconds, prices and volume become float64 and trade counts
+    int32; no intermediate timestamp strings are built.
+
+    Parameters:
+    - data (list): Raw kline arrays as returned by Binance.
+    - symbol (str): Trading pair the klines belong to, e.g. 'BTCUSDT'.
+    - currency (str): Quote currency label stored alongside, e.g. 'USD'.
+    - interval (str): Binance interval of the klines, e.g. '1d'.
+
+    Returns:
+    - pd.DataFrame: One row per kline with the columns listed in KLINE_COLUMNS.
+    """
+    raw = np.array(data, dtype=object) if len(data) else np.empty((0, TRADE_COUNT + 1), dtype=object)
+    prices = raw[:, OPEN:VOLUME + 1].astype(np.float64)
+    return pd.DataFrame({
+        "symbol": symbol,
+        "currency": currency,
+        "interval": interval,
+        "open_time": raw[:, OPEN_TIME].astype(np.int64),
+        "open_price": prices[:, 0],
+        "high_price": prices[:, 1],
+        "low_price": prices[:, 2],
+        "close_price": prices[:, 3],
+        "volume": prices[:, 4],
+        "close_time": raw[:, CLOSE_TIME].astype(np.int64),
+        "trade_count": raw[:, TRADE_COUNT].astype(np.int32),
+    }, columns=KLINE_COLUMNS)
+
+
+def expected_open_times(start_time, end_time, interval):
+    """
+    All bar open times of an interval that fall inside [start_time, end_time].
+
+    Parameters:
+    - start_time (int): Window start in epoch milliseconds.
+    - end_time (int): Window end in epoch milliseconds (inclusive).
+    - interval (str): Binance interval, e.g. '1d'.
+
+    Returns:
+    - np.ndarray: Sorted int64 epoch-ms open times.
+    """
+    step = INTERVAL_MS[interval]
+    first = -(-start_time // step) * step
+    return np.arange(first, end_time + 1, step, dtype=np.int64)
+
+
+def missing_open_times(open_times, start_time, end_time, interval):
+    """
+    Find the bars of a window that are missing from a decoded batch.
+
+    Parameters:
+    - open_times (np.ndarray): int64 epoch-ms open times that were received.
+    - start_time (int): Window start in epoch milliseconds.
+    - end_time (int): Window end in epoch milliseconds (inclusive).
+    - interval (str): Binance interval, e.g. '1d'.
+
+    Returns:
+    - np.ndarray: Sorted int64 epoch-ms open times that were expected but not received.
+    """
+    return np.setdiff1d(expected_open_times(start_time, end_time, interval), open_times, assume_unique=True)
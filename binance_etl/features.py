@@ -0,0 +1,268 @@
+import io
+import logging
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from binance_etl.decoder import INTERVAL_MS
+from binance_etl.parallel import process_map
+from binance_etl.universe import tracked_series
+
+# Window lengths (in bars) of the rolling features
+SMA_WINDOWS = (20, 50)
+EMA_SPANS = (12, 26)
+RSI_PERIOD = 14
+ATR_PERIOD = 14
+VOLATILITY_WINDOW = 20
+CORRELATION_WINDOW = 30
+
+# Series every other series of the same quote currency is correlated with
+CORRELATION_REFERENCE = {'USD': 'BTCUSDT', 'EUR': 'BTCEUR'}
+
+# Recursive smoothers (EMA, RSI, ATR) are restarted on this many bars per unit of span, after
+# which the influence of the restart is below (1 - 2 / (span + 1)) ** (10 * span) ~ 1e-9
+SMOOTHER_WARMUP = 10
+
+# Bars of history read before the first bar to compute, so every feature is fully warmed up
+WARMUP_BARS = max(
+    max(SMA_WINDOWS),
+    VOLATILITY_WINDOW + 1,
+    CORRELATION_WINDOW + 1,
+    SMOOTHER_WARMUP * max(EMA_SPANS + (RSI_PERIOD, ATR_PERIOD)),
+)
+
+FEATURE_COLUMNS = (
+    ["log_return"]
+    + [f"sma_{window}" for window in SMA_WINDOWS]
+    + [f"ema_{span}" for span in EMA_SPANS]
+    + [f"rsi_{RSI_PERIOD}", f"atr_{ATR_PERIOD}", f"realized_vol_{VOLATILITY_WINDOW}", f"corr_{CORRELATION_WINDOW}"]
+)
+
+
+def create_features_table(cur):
+    """
+    Create the features table: one row per stored bar with the technical features of its series,
+    and the feature_pending queue of the first bar written into the stored history of a series
+    (maintained by the writer, e.g. for the bars filled in by a gap repair).
+
+    Parameters:
+    - cur: An open psycopg2 cursor.
+
+    Returns:
+    - None
+    """
+    columns = ",\n".join(f"{name} DOUBLE PRECISION" for name in FEATURE_COLUMNS)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS features (
+            symbol VARCHAR(20) NOT NULL,
+            currency VARCHAR(3) NOT NULL,
+            interval VARCHAR(8) NOT NULL,
+            open_time TIMESTAMP NOT NULL,
+            {columns},
+            PRIMARY KEY (symbol, currency, interval, open_time)
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS feature_pending (
+            symbol VARCHAR(20) NOT NULL,
+            currency VARCHAR(3) NOT NULL,
+            interval VARCHAR(8) NOT NULL,
+            first_open_time TIMESTAMP NOT NULL,
+            PRIMARY KEY (symbol, currency, interval)
+        );
+    """)
+
+
+def compute_features(bars, reference=None):
+    """
+    Compute the technical features of one series with vectorized window operations.
+
+    Parameters:
+    - bars (pd.DataFrame): Bars of the series sorted by open_time, with open_time (epoch ms),
+      high_price, low_price and close_price columns.
+    - reference (pd.DataFrame): Bars of the reference series (same columns) for the rolling
+      correlation, or None to leave it empty.
+
+    Returns:
+    - pd.DataFrame: open_time plus the FEATURE_COLUMNS, one row per input bar. Features without
+      enough history are NaN.
+    """
+    close = bars['close_price']
+    previous_close = close.shift(1)
+    log_return = np.log(close / previous_close)
+
+    features = pd.DataFrame({"open_time": bars['open_time'], "log_return": log_return})
+    for window in SMA_WINDOWS:
+        features[f"sma_{window}"] = close.rolling(window).mean()
+    for span in EMA_SPANS:
+        features[f"ema_{span}"] = close.ewm(span=span, adjust=False).mean()
+
+    # Wilder's smoothing is an EMA with alpha = 1 / period
+    change = close.diff()
+    average_gain = change.clip(lower=0).ewm(alpha=1 / RSI_PERIOD, adjust=False).mean()
+    average_loss = (-change.clip(upper=0)).ewm(alpha=1 / RSI_PERIOD, adjust=False).mean()
+    features[f"rsi_{RSI_PERIOD}"] = 100 - 100 / (1 + average_gain / average_loss)
+
+    true_range = pd.concat([
+        bars['high_price'] - bars['low_price'],
+        (bars['high_price'] - previous_close).abs(),
+        (bars['low_price'] - previous_close).abs(),
+    ], axis=1).max(axis=1)
+    features[f"atr_{ATR_PERIOD}"] = true_range.ewm(alpha=1 / ATR_PERIOD, adjust=False).mean()
+
+    features[f"realized_vol_{VOLATILITY_WINDOW}"] = np.sqrt((log_return ** 2).rolling(VOLATILITY_WINDOW).sum())
+
+    correlation = np.nan
+    if reference is not None and len(reference):
+        # Align the reference returns on the bars of this series
+        reference_close = reference.set_index('open_time')['close_price']
+        reference_return = np.log(reference_close / reference_close.shift(1)).reindex(bars['open_time']).to_numpy()
+        correlation = log_return.rolling(CORRELATION_WINDOW).corr(pd.Series(reference_return, index=log_return.index))
+    features[f"corr_{CORRELATION_WINDOW}"] = correlation
+    return features
+
+
+def _read_bars(cur, symbol, currency, interval, start):
+    """Read the bars of a series from `start` (a timestamp, or None for all) as a DataFrame."""
+    cur.execute("""
+        SELECT (EXTRACT(EPOCH FROM open_time) * 1000)::BIGINT, high_price, low_price, close_price
+        FROM combined_table
+        WHERE symbol = %s AND currency = %s AND interval = %s AND open_time >= COALESCE(%s::TIMESTAMP, '-infinity')
+        ORDER BY open_time;
+    """, (symbol, currency, interval, start))
+    rows = cur.fetchall()
+    return pd.DataFrame(rows, columns=["open_time", "high_price", "low_price", "close_price"]).astype({
+        "open_time": np.int64, "high_price": np.float64, "low_price": np.float64, "close_price": np.float64,
+    })
+
+
+def _write_features(connection, symbol, currency, interval, features):
+    """Upsert computed features with one COPY into a staging table, committed once."""
+    buffer = io.StringIO()
+    features.to_csv(buffer, sep='\t', header=False, index=False, na_rep='\\N')
+    buffer.seek(0)
+
+    columns = ", ".join(FEATURE_COLUMNS)
+    try:
+        with connection.cursor() as cur:
+            cur.execute(f"""
+                CREATE TEMP TABLE feature_staging (
+                    open_time BIGINT,
+                    {", ".join(f"{name} DOUBLE PRECISION" for name in FEATURE_COLUMNS)}
+                ) ON COMMIT DROP;
+            """)
+            cur.copy_expert(f"COPY feature_staging (open_time, {columns}) FROM STDIN", buffer)
+            cur.execute(f"""
+                INSERT INTO features (symbol, currency, interval, open_time, {columns})
+                SELECT %s, %s, %s, to_timestamp(open_time / 1000) AT TIME ZONE 'UTC', {columns}
+                FROM feature_staging
+                ON CONFLICT (symbol, currency, interval, open_time) DO UPDATE
+                SET {", ".join(f"{name} = EXCLUDED.{name}" for name in FEATURE_COLUMNS)};
+            """, (symbol, currency, interval))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+
+def update_series_features(db_config, symbol, currency, interval):
+    """
+    Compute and store the features of one series for the bars after its last computed one.
+
+    Bars written into the history before it (e.g. by a gap repair) are queued in
+    feature_pending by the writer; the features of the series are then recomputed from the
+    first of them onwards, since every later bar depends on them. The queue entry is claimed
+    in the same transaction as the features are written. Only WARMUP_BARS bars before the
+    first bar to compute are read as warm-up, so a daily run costs a few hundred bars per
+    series no matter how long the history is. Runs in a worker process with its own connection.
+
+    Parameters:
+    - db_config (dict): psycopg2 connection parameters.
+    - symbol (str): Trading pair, e.g. 'BTCUSDT'.
+    - currency (str): Quote currency label, e.g. 'USD'.
+    - interval (str): Binance interval, e.g. '1d'.
+
+    Returns:
+    - int: Number of bars whose features were written.
+    """
+    connection = psycopg2.connect(**db_config)
+    try:
+        with connection.cursor() as cur:
+            cur.execute("""
+                DELETE FROM feature_pending WHERE symbol = %s AND currency = %s AND interval = %s
+                RETURNING first_open_time;
+            """, (symbol, currency, interval))
+            row = cur.fetchone()
+            rewritten_from = row[0] if row else None
+            cur.execute("""
+                SELECT MAX(open_time) FROM features WHERE symbol = %s AND currency = %s AND interval = %s;
+            """, (symbol, currency, interval))
+            last_computed = cur.fetchone()[0]
+
+            # First bar to compute: the one after the last computed bar, or the first rewritten bar before it
+            first_bar = None
+            if last_computed is not None:
+                first_bar = last_computed + timedelta(milliseconds=INTERVAL_MS[interval])
+                if rewritten_from is not None:
+                    first_bar = min(first_bar, rewritten_from)
+
+            # Start of the warm-up: WARMUP_BARS stored bars before the first bar to compute
+            warmup_start = None
+            if first_bar is not None:
+                cur.execute("""
+                    SELECT MIN(open_time) FROM (
+                        SELECT open_time FROM combined_table
+                        WHERE symbol = %s AND currency = %s AND interval = %s AND open_time < %s
+                        ORDER BY open_time DESC
+                        LIMIT %s
+                    ) AS warmup;
+                """, (symbol, currency, interval, first_bar, WARMUP_BARS))
+                warmup_start = cur.fetchone()[0] or first_bar
+
+            bars = _read_bars(cur, symbol, currency, interval, warmup_start)
+            reference = None
+            reference_symbol = CORRELATION_REFERENCE.get(currency)
+            if reference_symbol is not None:
+                reference = _read_bars(cur, reference_symbol, currency, interval, warmup_start)
+
+        features = compute_features(bars, reference)
+        if first_bar is not None:
+            first_ms = int(pd.Timestamp(first_bar).value // 10 ** 6)
+            features = features[features['open_time'] >= first_ms]
+        if features.empty:
+            connection.commit()
+            return 0
+
+        _write_features(connection, symbol, currency, interval, features)
+        return len(features)
+    finally:
+        connection.close()
+
+
+def update_features(db_config, intervals, max_workers=None):
+    """
+    Bring the features table up to date for every tracked series of the given intervals.
+
+    Series are processed in parallel by a process pool (see process_map), each worker
+    reading, computing and writing one series at a time.
+
+    Parameters:
+    - db_config (dict): psycopg2 connection parameters.
+    - intervals (list): Binance intervals to compute features for, e.g. ['1d'].
+    - max_workers (int): Size of the process pool. Defaults to the number of CPUs.
+
+    Returns:
+    - int: Number of bars whose features were written.
+    """
+    connection = psycopg2.connect(**db_config)
+    try:
+        series = tracked_series(connection, intervals)
+    finally:
+        connection.close()
+
+    counts = process_map(update_series_features, [(db_config,) + tuple(s) for s in series], max_workers)
+    updated = sum(counts)
+    logging.info(f"Computed features for {updated} bars across {len(series)} series.")
+    return updated
@@ -0,0 +1,239 @@
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from binance_etl.metrics import measure
+from binance_etl.parallel import bounded_map
+
+# Set the base API endpoint
+BASE_URL = 'https://api.binance.com'
+KLINES_ENDPOINT = '/api/v3/klines'
+PING_ENDPOINT = '/api/v3/ping'
+
+# Binance allows 6000 request weight per IP per minute; stay below it to leave room for other clients
+WEIGHT_LIMIT = 5000
+
+# One /api/v3/klines call for a single symbol and time window
+KlineRequest = namedtuple('KlineRequest', ['symbol', 'currency', 'interval', 'start_time', 'end_time', 'limit'])
+
+# Binance error code of a symbol the exchange does not list (e.g. a delisted pair)
+INVALID_SYMBOL = -1121
+
+
+class BinanceAPIError(Exception):
+    """Raised when the Binance API answers with a non-retryable error or retries are exhausted."""
+
+    def __init__(self, status_code, text):
+        super().__init__(f"{status_code} - {text}")
+        self.status_code = status_code
+        self.text = text
+        # Binance errors carry a JSON body like {"code": -1121, "msg": "Invalid symbol."}
+        try:
+            self.code = json.loads(text).get('code')
+        except (ValueError, AttributeError):
+            self.code = None
+
+    @property
+    def invalid_symbol(self):
+        """True if the exchange rejected the request's symbol."""
+        return self.status_code == 400 and (self.code == INVALID_SYMBOL or 'Invalid symbol' in self.text)
+
+
+# Request weight of one spot /api/v3/klines call, whatever its limit
+KLINES_WEIGHT = 2
+
+# The spot API returns at most 1000 klines per call (larger limits are clamped)
+MAX_KLINES_LIMIT = 1000
+
+
+class KlineFetcher:
+    """
+    Concurrent, rate-limit-aware Binance kline fetcher.
+
+    All requests share one keep-alive requests.Session whose connection pool is sized to the
+    number of worker threads. Before each call the fetcher reserves the call's weight against
+    a per-minute budget that is kept in sync with the X-MBX-USED-WEIGHT-1M response header,
+    and on 429/418 every worker pauses for the Retry-After period announced by Binance.
+
+    With an IngestMetrics instance as `metrics`, every call records its 'http' time, response
+    bytes, weight and retries and its 'json' parsing time, per symbol and interval.
+    """
+
+    def __init__(self, base_url=BASE_URL, max_workers=8, weight_limit=WEIGHT_LIMIT, max_retries=5, timeout=30, metrics=None):
+        self.base_url = base_url
+        self.max_workers = max_workers
+        self.weight_limit = weight_limit
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.metrics = metrics
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._lock = threading.Lock()
+        self._window_start = self._current_window()
+        self._used_weight = 0
+        self._paused_until = 0.0
+
+        self.request_count = 0
+        self.retry_count = 0
+
+    @staticmethod
+    def _current_window():
+        # Binance weight counters reset at the start of every wall-clock minute
+        return int(time.time() // 60)
+
+    def _reserve_weight(self, weight):
+        """Block until the call's weight fits into the current minute's budget."""
+        while True:
+            with self._lock:
+                now = time.time()
+                window = self._current_window()
+                if window != self._window_start:
+                    self._window_start = window
+                    self._used_weight = 0
+                if now >= self._paused_until and self._used_weight + weight <= self.weight_limit:
+                    self._used_weight += weight
+                    return
+                if now < self._paused_until:
+                    wake_at = self._paused_until
+                else:
+                    wake_at = (self._window_start + 1) * 60
+            time.sleep(max(wake_at - time.time(), 0.05))
+
+    def _record_used_weight(self, response):
+        used = response.headers.get('X-MBX-USED-WEIGHT-1M') or response.headers.get('X-MBX-USED-WEIGHT')
+        if used is None:
+            return
+        with self._lock:
+            if self._current_window() == self._window_start:
+                self._used_weight = max(self._used_weight, int(used))
+
+    def _count_retry(self, labels):
+        with self._lock:
+            self.retry_count += 1
+        if self.metrics is not None:
+            self.metrics.record('http', *labels, calls=0, retries=1)
+
+    def _record_http(self, labels, **counts):
+        if self.metrics is not None:
+            self.metrics.record('http', *labels, **counts)
+
+    def _pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.time() + seconds)
+
+    def get(self, endpoint, params=None, weight=1):
+        """
+        Perform a GET request against the Binance API within the rate budget.
+
+        Parameters:
+        - endpoint (str): API path, e.g. '/api/v3/klines'.
+        - params (dict): Query parameters.
+        - weight (int): Request weight charged by Binance for this call.
+
+        Returns:
+        - The decoded JSON body.
+
+        Raises:
+        - BinanceAPIError: On non-retryable errors or when retries are exhausted.
+        """
+        url = f'{self.base_url}{endpoint}'
+        labels = (params.get('symbol'), params.get('interval')) if params else (None, None)
+        for attempt in range(self.max_retries + 1):
+            self._reserve_weight(weight)
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                self._record_http(labels, seconds=time.perf_counter() - started, errors=1)
+                if attempt == self.max_retries:
+                    raise
+                self._count_retry(labels)
+                logging.warning(f"Request to {endpoint} failed ({e}), retrying.")
+                time.sleep(2 ** attempt)
+                continue
+            finally:
+                with self._lock:
+                    self.request_count += 1
+
+            self._record_used_weight(response)
+            self._record_http(labels, seconds=time.perf_counter() - started, bytes=len(response.content), weight=weight,
+                              errors=int(response.status_code != 200))
+            if response.status_code == 200:
+                with measure(self.metrics, 'json', *labels):
+                    return response.json()
+
+            if response.status_code in (429, 418):
+                # 429: rate limit hit, 418: IP auto-banned for ignoring 429s. Both announce Retry-After.
+                retry_after = int(response.headers.get('Retry-After', 60))
+                logging.warning(f"Binance returned {response.status_code}, backing off for {retry_after}s.")
+                self._pause(retry_after)
+            elif response.status_code >= 500:
+                time.sleep(2 ** attempt)
+            else:
+                raise BinanceAPIError(response.status_code, response.text)
+
+            if attempt == self.max_retries:
+                raise BinanceAPIError(response.status_code, response.text)
+            self._count_retry(labels)
+
+    def ping(self):
+        """
+        Test connectivity to the Binance API.
+
+        Returns:
+        - bool: True if /api/v3/ping answered successfully.
+        """
+        try:
+            self.get(PING_ENDPOINT)
+            return True
+        except (BinanceAPIError, requests.RequestException) as e:
+            logging.warning(f"Connectivity test failed: {e}")
+            return False
+
+    def fetch_klines(self, request):
+        """
+        Fetch the raw klines of a single KlineRequest.
+
+        Parameters:
+        - request (KlineRequest): The symbol and time window to fetch.
+
+        Returns:
+        - list: The raw kline arrays returned by Binance.
+        """
+        params = {
+            'symbol': request.symbol,
+            'interval': request.interval,
+            'limit': request.limit,
+            'startTime': request.start_time,
+        }
+        if request.end_time is not None:
+            params['endTime'] = request.end_time
+        return self.get(KLINES_ENDPOINT, params=params, weight=KLINES_WEIGHT)
+
+    def fetch_many(self, requests_to_fetch, max_in_flight=None):
+        """
+        Fetch many KlineRequests concurrently and yield the results as they complete.
+
+        Parameters:
+        - requests_to_fetch (iterable): KlineRequest objects, consumed lazily.
+        - max_in_flight (int): Bound on the requests being fetched or waiting to be consumed
+          (see bounded_map), which caps the memory held by responses.
+
+        Yields:
+        - tuple: (request, data, error). data is the list of raw klines, or None if the
+          request failed, in which case error holds the exception.
+        """
+        return bounded_map(self.fetch_klines, requests_to_fetch, self.max_workers, max_in_flight)
+
+    def close(self):
+        """Close the pooled HTTP session."""
+        self.session.close()
@@ -0,0 +1,238 @@
+import logging
+
+from binance_etl.backfill import BackfillError, BackfillWindow, backfill, now_ms
+from binance_etl.decoder import INTERVAL_MS
+from binance_etl.fetcher import MAX_KLINES_LIMIT, BinanceAPIError, KlineRequest
+from binance_etl.universe import tracked_series
+
+
+def _invalid_symbol(error):
+    return isinstance(error, BinanceAPIError) and error.invalid_symbol
+
+
+def probe_first_bars(connection, fetcher, history_start, interval=None):
+    """
+    Look up the first bar Binance has for every tracked series whose first bar is not known yet.
+
+    Each of these series is probed with a single limit=1 request from history_start (all
+    probes run in parallel) and its first bar is stored in ingest_watermarks as
+    first_available_time, so a series is only probed once. A failed probe is logged and
+    retried on the next call.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+    - fetcher (KlineFetcher): Fetcher used for the probes.
+    - history_start (int): Start of the probed range in epoch milliseconds.
+    - interval (str): Only probe series of this interval. All intervals by default.
+
+    Returns:
+    - set: (symbol, currency, interval) of the series whose symbol the exchange reports as
+      invalid (e.g. pairs delisted since the last universe refresh).
+    """
+    tracked = set(tracked_series(connection, [interval] if interval else None))
+    with connection.cursor() as cur:
+        cur.execute("SELECT symbol, currency, interval FROM ingest_watermarks WHERE first_available_time IS NULL;")
+        unknown = [tuple(row) for row in cur.fetchall() if tuple(row) in tracked]
+    connection.rollback()
+    if not unknown:
+        return set()
+
+    end_time = now_ms()
+    probes = {KlineRequest(*series, history_start, end_time, 1): series for series in unknown}
+    first_bars = []
+    invalid = set()
+    for request, data, error in fetcher.fetch_many(probes):
+        if _invalid_symbol(error):
+            logging.warning(f"Binance does not list {request.symbol} any more, skipping its {request.interval} gaps.")
+            invalid.add(probes[request])
+        elif error is not None:
+            logging.warning(f"Could not probe the first bar of {request.symbol} {request.interval}: {error}")
+        elif data:
+            first_bars.append((*probes[request], int(data[0][0])))
+
+    if first_bars:
+        columns = list(zip(*first_bars))
+        with connection.cursor() as cur:
+            cur.execute("""
+                UPDATE ingest_watermarks w
+                SET first_available_time = to_timestamp(f.first_ms / 1000.0) AT TIME ZONE 'UTC'
+                FROM unnest(%s::TEXT[], %s::TEXT[], %s::TEXT[], %s::BIGINT[]) AS f (symbol, currency, interval, first_ms)
+                WHERE w.symbol = f.symbol AND w.currency = f.currency AND w.interval = f.interval;
+            """, tuple(list(column) for column in columns))
+        connection.commit()
+    logging.info(f"Probed the first bar of {len(probes)} series ({len(first_bars)} found).")
+    return invalid
+
+
+def find_gaps(connection, interval=None, history_start=None):
+    """
+    Find the missing bars of every tracked series in one set-based pass over combined_table.
+
+    Each series is walked in primary-key order and every pair of consecutive bars that are
+    further apart than one interval yields the range of bars between them. Only stored
+    history is inspected; bars after the latest one are left to the incremental load, and
+    pairs that are no longer tracked (see tracked_series) are skipped.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+    - interval (str): Only inspect this interval, e.g. '1h'. All intervals by default.
+    - history_start (int): If given (epoch milliseconds), also report the range between the
+      first bar Binance has for each series (its first_available_time, see probe_first_bars),
+      but not before this time, and its first stored bar. Series whose first available bar
+      is not known yet get no head gap.
+
+    Returns:
+    - list: BackfillWindow objects, one per gap, sorted by series and time.
+    """
+    series = tracked_series(connection, [interval] if interval else None)
+    if not series:
+        return []
+    columns = list(zip(*series))
+    with connection.cursor() as cur:
+        cur.execute("""
+            WITH series AS (
+                -- Where the head of the series is checked from (NULL without history_start or a known first bar)
+                SELECT s.symbol, s.currency, s.interval,
+                       CASE WHEN %s::BIGINT IS NOT NULL AND w.first_available_time IS NOT NULL
+                            THEN GREATEST(%s::BIGINT, (EXTRACT(EPOCH FROM w.first_available_time) * 1000)::BIGINT)
+                       END AS head_ms
+                FROM unnest(%s::TEXT[], %s::TEXT[], %s::TEXT[]) AS s (symbol, currency, interval)
+                JOIN ingest_watermarks w ON w.symbol = s.symbol AND w.currency = s.currency AND w.interval = s.interval
+            ),
+            bars AS (
+                SELECT c.symbol, c.currency, c.interval, st.step_ms, s.head_ms,
+                       (EXTRACT(EPOCH FROM c.open_time) * 1000)::BIGINT AS open_ms,
+                       (EXTRACT(EPOCH FROM LAG(c.open_time) OVER (
+                           PARTITION BY c.symbol, c.currency, c.interval ORDER BY c.open_time
+                       )) * 1000)::BIGINT AS previous_ms
+                FROM combined_table c
+                JOIN series s ON s.symbol = c.symbol AND s.currency = c.currency AND s.interval = c.interval
+                JOIN unnest(%s::TEXT[], %s::BIGINT[]) AS st (interval, step_ms) ON st.interval = c.interval
+            )
+            SELECT symbol, currency, interval,
+                   COALESCE(previous_ms + step_ms, head_ms) AS gap_start,
+                   open_ms - step_ms AS gap_end
+            FROM bars
+            WHERE (previous_ms IS NOT NULL AND open_ms - previous_ms > step_ms)
+               OR (previous_ms IS NULL AND open_ms - step_ms >= head_ms)
+            ORDER BY symbol, currency, interval, gap_start;
+        """, (history_start, history_start, *[list(column) for column in columns], list(INTERVAL_MS), list(INTERVAL_MS.values())))
+        rows = cur.fetchall()
+    return [BackfillWindow(*row) for row in rows]
+
+
+def merge_gaps(gaps, limit=MAX_KLINES_LIMIT):
+    """
+    Merge nearby gaps of the same series into as few request windows as possible.
+
+    Consecutive gaps are combined as long as the merged window still fits into a single
+    page of `limit` bars; the bars already stored in between are simply fetched again and
+    skipped by the writer's upsert. Gaps longer than a page stay on their own and are paged
+    by the backfill engine.
+
+    Parameters:
+    - gaps (list): BackfillWindow objects sorted by series and time, e.g. from find_gaps.
+    - limit (int): Maximum number of bars per request.
+
+    Returns:
+    - list: Merged BackfillWindow objects.
+    """
+    merged = []
+    for gap in gaps:
+        if merged:
+            current = merged[-1]
+            same_series = current[:3] == gap[:3]
+            span = (gap.end_time - current.start_time) // INTERVAL_MS[gap.interval] + 1
+            if same_series and span <= limit:
+                merged[-1] = current._replace(end_time=max(current.end_time, gap.end_time))
+                continue
+        merged.append(gap)
+    return merged
+
+
+def repair_gaps(connection, fetcher, interval=None, history_start=None, limit=MAX_KLINES_LIMIT, cache=None, metrics=None):
+    """
+    Find the gaps of every tracked series and refetch only the windows that cover them.
+
+    Bars that Binance itself never produced (exchange outages) cannot be filled and will be
+    requested again on the next run; with merged windows this costs a handful of requests.
+    Series whose symbol the exchange reports as invalid (pairs delisted since the last
+    universe refresh) are logged and skipped instead of failing the repair.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+    - fetcher (KlineFetcher): Fetcher used for all requests.
+    - interval (str): Only repair this interval. All intervals by default.
+    - history_start (int): Also fill the range between the first bar Binance has for each
+      series, but not before this time (epoch milliseconds), and its first stored bar. The
+      first available bar of series that do not know it yet is probed first (see
+      probe_first_bars).
+    - limit (int): Maximum number of bars per request.
+    - cache (KlineCache): Optional local page cache.
+    - metrics (IngestMetrics): Optional stage timing collector, see backfill.
+
+    Returns:
+    - int: Number of rows inserted.
+
+    Raises:
+    - BackfillError: If some pages of valid symbols failed.
+    """
+    invalid = probe_first_bars(connection, fetcher, history_start, interval) if history_start is not None else set()
+    gaps = [gap for gap in find_gaps(connection, interval, history_start) if tuple(gap[:3]) not in invalid]
+    if not gaps:
+        logging.info("No gaps found.")
+        return 0
+
+    windows = merge_gaps(gaps, limit)
+    missing_bars = sum((g.end_time - g.start_time) // INTERVAL_MS[g.interval] + 1 for g in gaps)
+    logging.info(f"Found {len(gaps)} gaps ({missing_bars} bars), repairing them with {len(windows)} windows.")
+    try:
+        return backfill(connection, fetcher, windows, limit, cache=cache, metrics=metrics)
+    except BackfillError as e:
+        failures = [(request, error) for request, error in e.failures if not _invalid_symbol(error)]
+        skipped = sorted({f"{request.symbol} {request.interval}" for request, error in e.failures if _invalid_symbol(error)})
+        if skipped:
+            logging.warning(f"Binance does not list {len(skipped)} series any more, skipped their gaps: {', '.join(skipped)}.")
+        if failures:
+            raise BackfillError(failures, e.inserted) from e
+        return e.inserted
+
+
+def window_coverage(connection, windows, as_of):
+    """
+    Count the stored bars of every window against the bars it should hold, in one query.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+    - windows (list): BackfillWindow objects, e.g. the shards of a backfill.
+    - as_of (int): Time (epoch milliseconds) the windows were planned at; bars that had not
+      closed by then are not expected.
+
+    Returns:
+    - list: (window, expected bars, stored bars) tuples, in the order of the windows.
+    """
+    if not windows:
+        return []
+    columns = list(zip(*windows))
+    with connection.cursor() as cur:
+        cur.execute("""
+            SELECT COUNT(c.open_time)
+            FROM unnest(%s::TEXT[], %s::TEXT[], %s::TEXT[], %s::BIGINT[], %s::BIGINT[])
+                WITH ORDINALITY AS w (symbol, currency, interval, start_time, end_time, position)
+            LEFT JOIN combined_table c
+              ON c.symbol = w.symbol AND c.currency = w.currency AND c.interval = w.interval
+             AND c.open_time BETWEEN (to_timestamp(w.start_time / 1000) AT TIME ZONE 'UTC')
+                                 AND (to_timestamp(w.end_time / 1000) AT TIME ZONE 'UTC')
+            GROUP BY w.position
+            ORDER BY w.position;
+        """, tuple(list(column) for column in columns))
+        stored = [row[0] for row in cur.fetchall()]
+
+    coverage = []
+    for window, count in zip(windows, stored):
+        step = INTERVAL_MS[window.interval]
+        first = -(-window.start_time // step) * step
+        last = min(window.end_time, as_of - step)
+        expected = max(0, (last - first) // step + 1)
+        coverage.append((window, expected, count))
+    return coverage
@@ -0,0 +1,212 @@
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Counters kept for every (stage, symbol, interval)
+COUNTERS = ('seconds', 'calls', 'rows', 'bytes', 'weight', 'retries', 'errors')
+
+# What each counter means, for the Prometheus HELP lines
+COUNTER_HELP = {
+    'seconds': 'Time spent in the stage.',
+    'calls': 'Number of times the stage ran.',
+    'rows': 'Rows (klines) handled by the stage.',
+    'bytes': 'Response bytes received by the stage.',
+    'weight': 'Binance request weight used by the stage.',
+    'retries': 'Requests of the stage that were retried.',
+    'errors': 'Failures of the stage.',
+}
+
+
+class IngestMetrics:
+    """
+    Thread-safe collector of per-stage timings and counters of an ingest run.
+
+    Every measurement is keyed by (stage, symbol, interval); the stages used by the pipeline
+    are 'http' (request and download, with bytes, weight and retries), 'json' (parsing the
+    response), 'cache' (reading cached pages), 'decode' (building the typed DataFrame),
+    'validate' (missing-bar check) and 'write' (COPY and upsert); the streaming ingestor
+    adds 'stream' (WebSocket messages) and 'land' (close-to-commit delay of every bar).
+    Since a run covers one window per series, the per-symbol and interval figures are the
+    per-window figures. Times of stages that run in the fetcher's worker threads are summed
+    over the threads.
+
+    Pass an instance as `metrics` to KlineFetcher and backfill; without one nothing is
+    measured. The collected figures can be exported with summary (e.g. for XCom),
+    to_prometheus / write_textfile (node_exporter textfile collector) and to_statsd /
+    send_statsd.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        self.started = time.time()
+
+    def record(self, stage, symbol=None, interval=None, calls=1, **counts):
+        """
+        Add to the counters of a stage.
+
+        Parameters:
+        - stage (str): Stage name, e.g. 'write'.
+        - symbol (str): Trading pair, or None for measurements not tied to a series.
+        - interval (str): Binance interval, or None.
+        - calls (int): Number of stage runs to add.
+        - **counts: Amounts to add to the other COUNTERS, e.g. rows=1000, seconds=0.2.
+        """
+        with self._lock:
+            stats = self._stats[(stage, symbol, interval)]
+            stats['calls'] += calls
+            for name, value in counts.items():
+                stats[name] += value
+
+    @contextmanager
+    def timer(self, stage, symbol=None, interval=None, **counts):
+        """
+        Time the enclosed block as one run of a stage; an exception is counted as an error.
+
+        Yields a dict of counts that the block can still fill in, e.g. counts['rows'] = n.
+        """
+        counts = dict(counts)
+        started = time.perf_counter()
+        errors = 0
+        try:
+            yield counts
+        except Exception:
+            errors = 1
+            raise
+        finally:
+            self.record(stage, symbol, interval, seconds=time.perf_counter() - started, errors=errors, **counts)
+
+    def _sorted_items(self):
+        with self._lock:
+            items = [(key, dict(stats)) for key, stats in self._stats.items()]
+        return sorted(items, key=lambda item: tuple(part or '' for part in item[0]))
+
+    def merge_summary(self, summary):
+        """
+        Add the per-series figures of another run's summary(), e.g. of one shard of a backfill.
+
+        Parameters:
+        - summary (dict): A dict returned by summary().
+        """
+        for key, stages in summary['series'].items():
+            symbol, interval = key.rsplit(':', 1)
+            for stage, stats in stages.items():
+                self.record(stage, symbol, interval, **stats)
+
+    def summary(self):
+        """
+        JSON-serializable summary of the run.
+
+        Returns:
+        - dict: 'wall_time' of the run so far, 'stages' with the totals of every stage and
+          'series' with the counters of every stage per 'SYMBOL:interval'.
+        """
+        with self._lock:
+            items = [(key, dict(stats)) for key, stats in self._stats.items()]
+
+        stages = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        series = defaultdict(dict)
+        for (stage, symbol, interval), stats in items:
+            for name, value in stats.items():
+                stages[stage][name] += value
+            if symbol is not None:
+                series[f"{symbol}:{interval}"][stage] = stats
+        for stats in stages.values():
+            stats['rows_per_second'] = stats['rows'] / stats['seconds'] if stats['seconds'] else None
+        return {"wall_time": time.time() - self.started, "stages": dict(stages), "series": dict(series)}
+
+    def to_prometheus(self, prefix='binance_etl', labels=None):
+        """
+        Render the counters in the Prometheus text exposition format.
+
+        Parameters:
+        - prefix (str): Metric name prefix.
+        - labels (dict): Extra labels added to every sample, e.g. {'job': 'populate_database'}.
+
+        Returns:
+        - str: One counter family per entry of COUNTERS, labelled by stage, symbol and interval.
+        """
+        items = self._sorted_items()
+
+        lines = []
+        for name in COUNTERS:
+            metric = f"{prefix}_stage_{name}_total"
+            lines.append(f"# HELP {metric} {COUNTER_HELP[name]}")
+            lines.append(f"# TYPE {metric} counter")
+            for (stage, symbol, interval), stats in items:
+                sample_labels = dict(labels or {}, stage=stage, symbol=symbol or '', interval=interval or '')
+                rendered = ",".join(f'{key}="{value}"' for key, value in sample_labels.items())
+                lines.append(f"{metric}{{{rendered}}} {stats[name]}")
+        lines.append(f"# HELP {prefix}_last_run_timestamp_seconds End of the last run.")
+        lines.append(f"# TYPE {prefix}_last_run_timestamp_seconds gauge")
+        rendered = ",".join(f'{key}="{value}"' for key, value in (labels or {}).items())
+        lines.append(f"{prefix}_last_run_timestamp_seconds{{{rendered}}} {time.time()}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path, prefix='binance_etl', labels=None):
+        """Atomically write to_prometheus() to a file for the node_exporter textfile collector."""
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(self.to_prometheus(prefix, labels))
+        os.replace(temporary, path)
+
+    def to_statsd(self, prefix='binance_etl'):
+        """
+        Render the per-stage totals as StatsD lines (times as timers in milliseconds, the rest as counters).
+
+        Per-series figures are tagged with DogStatsD-style '#symbol:...,interval:...' tags.
+
+        Returns:
+        - list: StatsD lines.
+        """
+        items = self._sorted_items()
+
+        lines = []
+        for (stage, symbol, interval), stats in items:
+            tags = f"|#symbol:{symbol},interval:{interval}" if symbol is not None else ""
+            lines.append(f"{prefix}.{stage}.seconds:{stats['seconds'] * 1000:.3f}|ms{tags}")
+            for name in COUNTERS[1:]:
+                if stats[name]:
+                    lines.append(f"{prefix}.{stage}.{name}:{stats[name]}|c{tags}")
+        return lines
+
+    def send_statsd(self, host, port=8125, prefix='binance_etl'):
+        """Send to_statsd() to a StatsD server over UDP, one line per datagram."""
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for line in self.to_statsd(prefix):
+                sock.sendto(line.encode(), (host, port))
+
+
+@contextmanager
+def measure(metrics, stage, symbol=None, interval=None, **counts):
+    """metrics.timer(...) if metrics is given, else a no-op, so instrumented code can stay unconditional."""
+    if metrics is None:
+        yield dict(counts)
+    else:
+        with metrics.timer(stage, symbol, interval, **counts) as counts:
+            yield counts
+
+
+def publish(metrics, job, textfile_dir=None, statsd_address=None):
+    """
+    Export the metrics of a finished run to the configured sinks.
+
+    Parameters:
+    - metrics (IngestMetrics): The collected metrics.
+    - job (str): Name of the run, used as the 'job' label and textfile name.
+    - textfile_dir (str): node_exporter textfile directory; the metrics are written to
+      binance_etl_<job>.prom in it. Skipped if None.
+    - statsd_address (tuple): (host, port) of a StatsD server. Skipped if None.
+
+    Returns:
+    - dict: metrics.summary().
+    """
+    if textfile_dir:
+        os.makedirs(textfile_dir, exist_ok=True)
+        metrics.write_textfile(os.path.join(textfile_dir, f"binance_etl_{job}.prom"), labels={'job': job})
+    if statsd_address:
+        metrics.send_statsd(*statsd_address, prefix=f"binance_etl.{job}")
+    return metrics.summary()
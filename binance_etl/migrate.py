@@ -0,0 +1,82 @@
+"""
+Convert a legacy combined_table (heap table with a SERIAL id and NUMERIC columns) to the
+partitioned, compact-typed layout.
+
+Usage (from the repository root, with config.py pointing at the database):
+    python -m binance_etl.migrate
+"""
+import logging
+
+import psycopg2
+
+from binance_etl.schema import create_partitioned_table, ensure_schema, is_partitioned, partition_bounds, partition_ddl
+
+
+def migrate_combined_table(connection):
+    """
+    Rewrite a legacy combined_table into the partitioned layout in a single transaction.
+
+    The legacy table is renamed out of the way, the partitioned table and every partition
+    needed by the existing rows are created, the rows are copied over with their prices cast
+    to DOUBLE PRECISION, and the legacy table (with its id sequence and index) is dropped.
+    Nothing is changed if the table is already partitioned.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+
+    Returns:
+    - int: Number of rows migrated.
+    """
+    ensure_schema(connection)
+    if is_partitioned(connection):
+        logging.info("combined_table is already partitioned, nothing to migrate.")
+        return 0
+
+    try:
+        with connection.cursor() as cur:
+            cur.execute("ALTER TABLE combined_table RENAME TO combined_table_legacy;")
+            # Index names are schema-wide, free the one the new table will use
+            cur.execute("ALTER INDEX IF EXISTS combined_table_pkey RENAME TO combined_table_legacy_pkey;")
+            create_partitioned_table(cur)
+
+            cur.execute("""
+                SELECT interval,
+                       (EXTRACT(EPOCH FROM MIN(open_time)) * 1000)::BIGINT,
+                       (EXTRACT(EPOCH FROM MAX(open_time)) * 1000)::BIGINT
+                FROM combined_table_legacy
+                GROUP BY interval;
+            """)
+            for interval, start_time, end_time in cur.fetchall():
+                partitions = [(f"combined_table_{interval}", None, None)] + partition_bounds(interval, start_time, end_time)
+                for statement in partition_ddl(interval, partitions):
+                    cur.execute(statement)
+
+            cur.execute("""
+                INSERT INTO combined_table (symbol, currency, interval, open_time, open_price, high_price, low_price, close_price, volume, close_time, trade_count)
+                SELECT symbol, currency, interval, open_time, open_price, high_price, low_price, close_price, volume, close_time, trade_count
+                FROM combined_table_legacy
+                ON CONFLICT DO NOTHING;
+            """)
+            migrated = cur.rowcount
+            cur.execute("DROP TABLE combined_table_legacy;")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    # Refresh the cached layout and collect statistics for the planner
+    ensure_schema(connection)
+    with connection.cursor() as cur:
+        cur.execute("ANALYZE combined_table;")
+    connection.commit()
+    logging.info(f"Migrated {migrated} rows to the partitioned combined_table.")
+    return migrated
+
+
+if __name__ == '__main__':
+    from config import DB_CONFIG  # Import the configuration from the config.py file
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    connection = psycopg2.connect(**DB_CONFIG)
+    migrate_combined_table(connection)
+    connection.close()
@@ -0,0 +1,300 @@
+import io
+import logging
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from binance_etl.decoder import INTERVAL_MS
+from binance_etl.features import FEATURE_COLUMNS
+from binance_etl.parallel import process_map
+from binance_etl.universe import tracked_series
+
+# Number of walk-forward folds and the minimum number of usable bars to model a series
+N_FOLDS = 5
+MIN_BARS = 200
+
+# L2 penalty of the ridge regression (on standardized features)
+RIDGE_ALPHA = 1.0
+
+
+def create_model_tables(cur):
+    """
+    Create the model_runs table (latest fitted model and its walk-forward metrics per series)
+    and the forecasts table.
+
+    Parameters:
+    - cur: An open psycopg2 cursor.
+
+    Returns:
+    - None
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS model_runs (
+            symbol VARCHAR(20) NOT NULL,
+            currency VARCHAR(3) NOT NULL,
+            interval VARCHAR(8) NOT NULL,
+            trained_through TIMESTAMP NOT NULL,
+            coefficients DOUBLE PRECISION[] NOT NULL,
+            feature_mean DOUBLE PRECISION[] NOT NULL,
+            feature_std DOUBLE PRECISION[] NOT NULL,
+            folds INTEGER NOT NULL,
+            mae DOUBLE PRECISION,
+            rmse DOUBLE PRECISION,
+            directional_accuracy DOUBLE PRECISION,
+            baseline_mae DOUBLE PRECISION,
+            trained_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (symbol, currency, interval)
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS forecasts (
+            symbol VARCHAR(20) NOT NULL,
+            currency VARCHAR(3) NOT NULL,
+            interval VARCHAR(8) NOT NULL,
+            open_time TIMESTAMP NOT NULL,
+            predicted_log_return DOUBLE PRECISION NOT NULL,
+            predicted_close DOUBLE PRECISION NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (symbol, currency, interval, open_time)
+        );
+    """)
+
+
+def load_dataset(connection, interval, series):
+    """
+    Read the closes and features of several series in one bulk columnar query.
+
+    The rows are streamed with COPY ... TO STDOUT and parsed into typed columns by pandas,
+    instead of being fetched and converted row by row.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+    - interval (str): Binance interval, e.g. '1d'.
+    - series (list): (symbol, currency) tuples to read.
+
+    Returns:
+    - pd.DataFrame: symbol, currency, open_time (epoch ms), close_price and the
+      FEATURE_COLUMNS, sorted by series and time.
+    """
+    symbols = [symbol for symbol, _ in series]
+    currencies = [currency for _, currency in series]
+    with connection.cursor() as cur:
+        query = cur.mogrify(f"""
+            SELECT c.symbol, c.currency, (EXTRACT(EPOCH FROM c.open_time) * 1000)::BIGINT AS open_time,
+                   c.close_price, {", ".join(f"f.{name}" for name in FEATURE_COLUMNS)}
+            FROM combined_table c
+            JOIN unnest(%s::TEXT[], %s::TEXT[]) AS s (symbol, currency)
+              ON c.symbol = s.symbol AND c.currency = s.currency
+            JOIN features f
+              ON f.symbol = c.symbol AND f.currency = c.currency AND f.interval = c.interval AND f.open_time = c.open_time
+            WHERE c.interval = %s
+            ORDER BY c.symbol, c.currency, c.open_time
+        """, (symbols, currencies, interval)).decode()
+        buffer = io.StringIO()
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH CSV HEADER", buffer)
+    buffer.seek(0)
+    return pd.read_csv(buffer, dtype={"symbol": str, "currency": str, "open_time": np.int64})
+
+
+def walk_forward_folds(n_rows, n_folds=N_FOLDS):
+    """
+    Expanding-window walk-forward splits: every fold trains on all rows before its test block.
+
+    Parameters:
+    - n_rows (int): Number of usable rows of the series.
+    - n_folds (int): Number of test blocks, taken from the end of the series.
+
+    Returns:
+    - list: (train_end, test_end) row indexes; fold k trains on [0, train_end) and is tested
+      on [train_end, test_end).
+    """
+    test_size = n_rows // (n_folds + 1)
+    first_test = n_rows - n_folds * test_size
+    return [(first_test + k * test_size, first_test + (k + 1) * test_size) for k in range(n_folds)]
+
+
+def fit_ridge(X, y, alpha=RIDGE_ALPHA):
+    """
+    Fit a ridge regression on standardized features with NumPy only.
+
+    Parameters:
+    - X (np.ndarray): Feature matrix, one row per bar.
+    - y (np.ndarray): Targets.
+    - alpha (float): L2 penalty (the intercept is not penalized).
+
+    Returns:
+    - tuple: (coefficients with the intercept first, feature means, feature standard deviations).
+    """
+    mean = X.mean(axis=0)
+    std = X.std(axis=0)
+    std[std == 0] = 1.0
+    Z = np.column_stack([np.ones(len(X)), (X - mean) / std])
+    penalty = alpha * np.eye(Z.shape[1])
+    penalty[0, 0] = 0.0
+    coefficients = np.linalg.solve(Z.T @ Z + penalty, Z.T @ y)
+    return coefficients, mean, std
+
+
+def predict_ridge(model, X):
+    """Predict with a model returned by fit_ridge."""
+    coefficients, mean, std = model
+    return coefficients[0] + ((X - mean) / std) @ coefficients[1:]
+
+
+def _prepare(frame):
+    """Feature matrix and next-bar log return target of one series (rows with gaps dropped)."""
+    X = frame[FEATURE_COLUMNS].to_numpy(np.float64)
+    y = frame['log_return'].shift(-1).to_numpy(np.float64)
+    usable = np.isfinite(X).all(axis=1) & np.isfinite(y)
+    return X[usable], y[usable]
+
+
+def evaluate_fold(X, y, train_end, test_end):
+    """
+    Train on the rows before a test block and score the forecasts of the block.
+
+    Parameters:
+    - X (np.ndarray): Feature matrix of the series.
+    - y (np.ndarray): Next-bar log returns.
+    - train_end (int): First row of the test block.
+    - test_end (int): Row after the test block.
+
+    Returns:
+    - dict: Absolute errors, squared errors, direction hits and the absolute errors of the
+      zero-return baseline, summed over the block, plus the number of test rows.
+    """
+    model = fit_ridge(X[:train_end], y[:train_end])
+    predicted = predict_ridge(model, X[train_end:test_end])
+    actual = y[train_end:test_end]
+    return {
+        "n": len(actual),
+        "abs_error": float(np.abs(predicted - actual).sum()),
+        "squared_error": float(((predicted - actual) ** 2).sum()),
+        "hits": int((np.sign(predicted) == np.sign(actual)).sum()),
+        "baseline_abs_error": float(np.abs(actual).sum()),
+    }
+
+
+def train_models(db_config, interval='1d', n_folds=N_FOLDS, max_workers=None):
+    """
+    Walk-forward evaluate, refit and forecast the next bar of every tracked series that got new bars.
+
+    A series is retrained only when its ingest watermark has moved past the trained_through
+    time of its stored model, so a daily run skips unchanged series. The stale series are read
+    with one bulk query, every symbol x fold evaluation is run as a separate job on a process
+    pool, and a final model fitted on the full history forecasts the next bar's log return.
+    The fitted coefficients, the pooled walk-forward metrics and the forecasts are stored in
+    model_runs and forecasts.
+
+    Parameters:
+    - db_config (dict): psycopg2 connection parameters.
+    - interval (str): Binance interval to model, e.g. '1d'.
+    - n_folds (int): Number of walk-forward folds.
+    - max_workers (int): Size of the process pool. Defaults to the number of CPUs.
+
+    Returns:
+    - pd.DataFrame: The walk-forward metrics of the retrained series.
+    """
+    connection = psycopg2.connect(**db_config)
+    try:
+        with connection.cursor() as cur:
+            cur.execute("""
+                SELECT w.symbol, w.currency
+                FROM ingest_watermarks w
+                LEFT JOIN model_runs m ON m.symbol = w.symbol AND m.currency = w.currency AND m.interval = w.interval
+                WHERE w.interval = %s AND (m.trained_through IS NULL OR m.trained_through < w.last_open_time);
+            """, (interval,))
+            # Pairs that are no longer tracked keep their last model and forecast
+            tracked = set(tracked_series(connection, [interval]))
+            stale = [(symbol, currency) for symbol, currency in cur.fetchall() if (symbol, currency, interval) in tracked]
+        if not stale:
+            logging.info("All models are up to date.")
+            return pd.DataFrame()
+
+        dataset = load_dataset(connection, interval, stale)
+        prepared = {}
+        for (symbol, currency), frame in dataset.groupby(['symbol', 'currency'], sort=False):
+            X, y = _prepare(frame)
+            if len(y) < MIN_BARS:
+                logging.info(f"Skipping {symbol} {interval}: only {len(y)} usable bars.")
+                continue
+            # The forecast needs every feature of the latest bar (e.g. corr_30 is NaN while the reference bar is missing);
+            # the model run stays stale, so the series is retried on the next run
+            if not np.isfinite(frame.iloc[-1][FEATURE_COLUMNS].to_numpy(np.float64)).all():
+                logging.info(f"Skipping {symbol} {interval}: the latest bar has missing features.")
+                continue
+            prepared[(symbol, currency)] = (X, y, frame)
+
+        # One job per symbol x fold
+        jobs = [
+            (key, X, y, train_end, test_end)
+            for key, (X, y, _) in prepared.items()
+            for train_end, test_end in walk_forward_folds(len(y), n_folds)
+        ]
+        scores = process_map(evaluate_fold, [job[1:] for job in jobs], max_workers)
+
+        metrics = pd.DataFrame([dict(score, symbol=job[0][0], currency=job[0][1]) for job, score in zip(jobs, scores)])
+        if metrics.empty:
+            return metrics
+        metrics = metrics.groupby(['symbol', 'currency']).sum()
+        metrics = pd.DataFrame({
+            "mae": metrics['abs_error'] / metrics['n'],
+            "rmse": np.sqrt(metrics['squared_error'] / metrics['n']),
+            "directional_accuracy": metrics['hits'] / metrics['n'],
+            "baseline_mae": metrics['baseline_abs_error'] / metrics['n'],
+        })
+
+        with connection.cursor() as cur:
+            for (symbol, currency), (X, y, frame) in prepared.items():
+                # Refit on the full history and forecast the bar after the latest one
+                model = fit_ridge(X, y)
+                latest = frame.iloc[-1]
+                predicted = float(predict_ridge(model, latest[FEATURE_COLUMNS].to_numpy(np.float64)))
+                forecast_time = int(latest['open_time']) + INTERVAL_MS[interval]
+                row = metrics.loc[(symbol, currency)]
+                cur.execute("""
+                    INSERT INTO model_runs (symbol, currency, interval, trained_through, coefficients, feature_mean,
+                                            feature_std, folds, mae, rmse, directional_accuracy, baseline_mae, trained_at)
+                    VALUES (%s, %s, %s, to_timestamp(%s / 1000) AT TIME ZONE 'UTC', %s, %s, %s, %s, %s, %s, %s, %s,
+                            now() AT TIME ZONE 'UTC')
+                    ON CONFLICT (symbol, currency, interval) DO UPDATE
+                    SET trained_through = EXCLUDED.trained_through,
+                        coefficients = EXCLUDED.coefficients,
+                        feature_mean = EXCLUDED.feature_mean,
+                        feature_std = EXCLUDED.feature_std,
+                        folds = EXCLUDED.folds,
+                        mae = EXCLUDED.mae,
+                        rmse = EXCLUDED.rmse,
+                        directional_accuracy = EXCLUDED.directional_accuracy,
+                        baseline_mae = EXCLUDED.baseline_mae,
+                        trained_at = EXCLUDED.trained_at;
+                """, (symbol, currency, interval, int(latest['open_time']), model[0].tolist(), model[1].tolist(),
+                      model[2].tolist(), n_folds, float(row['mae']), float(row['rmse']),
+                      float(row['directional_accuracy']), float(row['baseline_mae'])))
+                cur.execute("""
+                    INSERT INTO forecasts (symbol, currency, interval, open_time, predicted_log_return, predicted_close, created_at)
+                    VALUES (%s, %s, %s, to_timestamp(%s / 1000) AT TIME ZONE 'UTC', %s, %s, now() AT TIME ZONE 'UTC')
+                    ON CONFLICT (symbol, currency, interval, open_time) DO UPDATE
+                    SET predicted_log_return = EXCLUDED.predicted_log_return,
+                        predicted_close = EXCLUDED.predicted_close,
+                        created_at = EXCLUDED.created_at;
+                """, (symbol, currency, interval, forecast_time, predicted,
+                      float(latest['close_price'] * np.exp(predicted))))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    logging.info(f"Trained {len(metrics)} {interval} models with {len(jobs)} walk-forward jobs.")
+    return metrics
+
+
+if __name__ == '__main__':
+    from config import DB_CONFIG, INTERVALS  # Import the configuration from the config.py file
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    for interval in INTERVALS:
+        print(train_models(DB_CONFIG, interval).to_string())
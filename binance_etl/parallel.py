@@ -0,0 +1,66 @@
+import itertools
+import logging
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+
+def process_map(function, jobs, max_workers=None):
+    """
+    Run a function over argument tuples in a process pool and collect the results in order.
+
+    Inside a daemonic process (e.g. a Celery worker), which is not allowed to start children,
+    the jobs are run one after the other in the current process instead.
+
+    Parameters:
+    - function (callable): Picklable (module-level) function to run.
+    - jobs (list): Argument tuples, one per call.
+    - max_workers (int): Size of the process pool. Defaults to the number of CPUs.
+
+    Returns:
+    - list: The return values, in the order of the jobs.
+    """
+    if multiprocessing.current_process().daemon:
+        logging.info("Running in a daemonic process, skipping the process pool.")
+        return [function(*job) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(function, *job) for job in jobs]
+        return [future.result() for future in futures]
+
+
+def bounded_map(function, items, max_workers, max_in_flight=None):
+    """
+    Run a function over items in a thread pool, yielding the results as they complete.
+
+    Items are pulled from the iterable lazily and at most max_in_flight of them are running or
+    finished but not yet consumed at any time. A consumer that falls behind therefore holds
+    back the workers instead of letting results pile up in memory.
+
+    Parameters:
+    - function (callable): Function of one item.
+    - items (iterable): The items, e.g. a generator.
+    - max_workers (int): Number of worker threads.
+    - max_in_flight (int): Bound on the items being processed or waiting to be consumed.
+      Defaults to twice max_workers.
+
+    Yields:
+    - tuple: (item, result, error). result is None if the call raised, in which case error
+      holds the exception.
+    """
+    items = iter(items)
+    max_in_flight = max(max_in_flight or 2 * max_workers, 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(function, item): item for item in itertools.islice(items, max_in_flight)}
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = futures.pop(future)
+                # Refill the freed slot before handing the result over
+                for next_item in itertools.islice(items, 1):
+                    futures[executor.submit(function, next_item)] = next_item
+                try:
+                    result = future.result()
+                except Exception as e:
+                    yield item, None, e
+                else:
+                    yield item, result, None
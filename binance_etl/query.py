@@ -0,0 +1,413 @@
+"""
+Read-side OHLCV queries served from an in-memory columnar cache.
+
+OhlcvCache answers (symbol, currency, interval, time range) queries with pyarrow Tables and
+keeps the loaded bars of every series in memory, so repeated queries do not touch the
+database. Run `python -m binance_etl.query` to serve it over HTTP (Arrow IPC or Parquet).
+"""
+import calendar
+import io
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.parquet as pq
+
+from binance_etl.decoder import INTERVAL_MS
+
+# Memory the cached series may use before the least recently queried ones are evicted
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+# Seconds between two reads of ingest_watermarks; queries within this window never reach the database
+DEFAULT_POLL_INTERVAL = 1.0
+
+# Columns of a query result, in combined_table's units (times in UTC)
+OHLCV_SCHEMA = pa.schema([
+    ('open_time', pa.timestamp('ms')),
+    ('open_price', pa.float64()),
+    ('high_price', pa.float64()),
+    ('low_price', pa.float64()),
+    ('close_price', pa.float64()),
+    ('volume', pa.float64()),
+    ('close_time', pa.timestamp('ms')),
+    ('trade_count', pa.int64()),
+])
+
+# Media types of the two output formats
+CONTENT_TYPES = {
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# Record batches an entry may grow to through appended tails before it is compacted
+MAX_CHUNKS = 64
+
+# Bars of one series held in memory: the covered open_time range (inclusive, epoch
+# milliseconds), the history_updated_at watermark it was loaded at, the bars and their open times
+_Entry = namedtuple('_Entry', ['start_time', 'end_time', 'version', 'table', 'open_times'])
+
+
+def _open_times(table):
+    return table.column('open_time').cast(pa.int64()).to_numpy()
+
+
+def _to_epoch_ms(timestamp):
+    # combined_table and ingest_watermarks store naive UTC timestamps
+    return calendar.timegm(timestamp.utctimetuple()) * 1000
+
+
+def load_bars(connection, symbol, currency, interval, start_time, end_time):
+    """
+    Load the stored bars of one series between two open times straight into Arrow columns.
+
+    The rows are streamed out of Postgres with COPY and parsed by pyarrow's CSV reader, so no
+    Python object is created per row or value.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+    - symbol (str): Trading pair, e.g. 'BTCUSDT'.
+    - currency (str): Quote currency label, e.g. 'USD'.
+    - interval (str): Binance interval, e.g. '1h'.
+    - start_time (int): First open time in epoch milliseconds.
+    - end_time (int): Last open time in epoch milliseconds (inclusive).
+
+    Returns:
+    - pa.Table: The bars in OHLCV_SCHEMA, ordered by open_time.
+    """
+    with connection.cursor() as cur:
+        select = cur.mogrify("""
+            SELECT (extract(epoch FROM open_time) * 1000)::bigint, open_price::float8, high_price::float8,
+                   low_price::float8, close_price::float8, volume::float8,
+                   (extract(epoch FROM close_time) * 1000)::bigint, trade_count
+            FROM combined_table
+            WHERE symbol = %s AND currency = %s AND interval = %s
+              AND open_time BETWEEN (to_timestamp(%s / 1000.0) AT TIME ZONE 'UTC') AND (to_timestamp(%s / 1000.0) AT TIME ZONE 'UTC')
+            ORDER BY open_time
+        """, (symbol, currency, interval, start_time, end_time)).decode()
+        buffer = io.BytesIO()
+        cur.copy_expert(f"COPY ({select}) TO STDOUT WITH (FORMAT csv)", buffer)
+    connection.rollback()
+
+    if not buffer.getbuffer().nbytes:
+        return OHLCV_SCHEMA.empty_table()
+    buffer.seek(0)
+    table = pa.csv.read_csv(
+        buffer,
+        read_options=pa.csv.ReadOptions(column_names=OHLCV_SCHEMA.names),
+        convert_options=pa.csv.ConvertOptions(column_types={
+            name: pa.int64() if pa.types.is_timestamp(field_type) else field_type
+            for name, field_type in zip(OHLCV_SCHEMA.names, OHLCV_SCHEMA.types)
+        }),
+    )
+    return table.cast(OHLCV_SCHEMA)
+
+
+class OhlcvCache:
+    """
+    LRU cache of the bars of every queried series as Arrow columns, invalidated by the ingest watermarks.
+
+    Every entry covers one contiguous open_time range of one series; a query outside of it
+    loads only the missing head or tail. The watermarks (latest open time and last history
+    rewrite of every series) are read at most once per poll_interval, and no entry covers
+    bars past the watermark it was loaded at. Bars appended after the watermark are therefore
+    loaded as a tail on the next query that reaches them, while a series whose history was
+    rewritten since its entry was loaded (bars written at or before the watermark, e.g. by a
+    repair) is loaded again. When the cached bars exceed max_bytes, the least recently
+    queried series are evicted. The cache is safe to share between threads.
+    """
+
+    def __init__(self, connection, max_bytes=DEFAULT_MAX_BYTES, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.connection = connection
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+
+        self.hits = 0
+        self.misses = 0
+        self.loaded_rows = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._watermarks = {}
+        self._polled_at = None
+        self._lock = threading.Lock()
+
+    def _poll_watermarks(self):
+        """Refresh the watermark snapshot once it is older than poll_interval."""
+        if self._polled_at is not None and time.monotonic() - self._polled_at < self.poll_interval:
+            return
+        with self.connection.cursor() as cur:
+            cur.execute("SELECT symbol, currency, interval, last_open_time, history_updated_at FROM ingest_watermarks;")
+            rows = cur.fetchall()
+        self.connection.rollback()
+        self._watermarks = {(symbol, currency, interval): (_to_epoch_ms(last_open_time), history_updated_at)
+                            for symbol, currency, interval, last_open_time, history_updated_at in rows}
+        self._polled_at = time.monotonic()
+
+    def _load(self, series, start_time, end_time):
+        table = load_bars(self.connection, *series, start_time, end_time)
+        self.loaded_rows += table.num_rows
+        return table
+
+    def _store(self, series, entry):
+        old = self._entries.pop(series, None)
+        if old is not None:
+            self._size -= old.table.nbytes
+        self._entries[series] = entry
+        self._size += entry.table.nbytes
+        # Evict the least recently queried series, but never the one just stored
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.table.nbytes
+            self.evictions += 1
+
+    def query(self, symbol, currency, interval, start_time=None, end_time=None):
+        """
+        Return the stored bars of one series between two open times.
+
+        Parameters:
+        - symbol (str): Trading pair, e.g. 'BTCUSDT'.
+        - currency (str): Quote currency label, e.g. 'USD'.
+        - interval (str): Binance interval, e.g. '1h'.
+        - start_time (int): First open time in epoch milliseconds; defaults to the first stored bar.
+        - end_time (int): Last open time in epoch milliseconds (inclusive); defaults to the latest stored bar.
+
+        Returns:
+        - pa.Table: The bars in OHLCV_SCHEMA, ordered by open_time (empty for unknown series).
+
+        Raises:
+        - ValueError: For an unknown interval.
+        """
+        if interval not in INTERVAL_MS:
+            raise ValueError(f"Unknown interval {interval!r}.")
+        series = (symbol, currency, interval)
+        start_time = 0 if start_time is None else max(int(start_time), 0)
+
+        with self._lock:
+            self._poll_watermarks()
+            watermark = self._watermarks.get(series)
+            if watermark is None:
+                return OHLCV_SCHEMA.empty_table()
+            last_open_time, history_updated_at = watermark
+            # Nothing past the watermark is stored, so the range is capped there and stays cacheable
+            end_time = last_open_time if end_time is None else min(int(end_time), last_open_time)
+            if end_time < start_time:
+                return OHLCV_SCHEMA.empty_table()
+
+            entry = self._entries.get(series)
+            if entry is not None and entry.version != history_updated_at:
+                # Bars were written into the cached range (e.g. by a repair), so it is loaded again
+                entry = None
+            if entry is not None and entry.start_time <= start_time and end_time <= entry.end_time:
+                self.hits += 1
+                self._entries.move_to_end(series)
+            else:
+                self.misses += 1
+                if entry is None:
+                    table = self._load(series, start_time, end_time)
+                    entry = _Entry(start_time, end_time, history_updated_at, table, _open_times(table))
+                else:
+                    # Only load the part of the range that is not cached yet, e.g. the bars appended since
+                    parts = [(entry.table, entry.open_times)]
+                    if start_time < entry.start_time:
+                        head = self._load(series, start_time, entry.start_time - 1)
+                        parts.insert(0, (head, _open_times(head)))
+                    if end_time > entry.end_time:
+                        tail = self._load(series, entry.end_time + 1, end_time)
+                        parts.append((tail, _open_times(tail)))
+                    table = pa.concat_tables([part for part, _ in parts])
+                    if table.column('open_time').num_chunks > MAX_CHUNKS:
+                        table = table.combine_chunks()
+                    entry = _Entry(min(start_time, entry.start_time), max(end_time, entry.end_time), history_updated_at,
+                                   table, np.concatenate([open_times for _, open_times in parts]))
+                self._store(series, entry)
+
+        first = np.searchsorted(entry.open_times, start_time, side='left')
+        last = np.searchsorted(entry.open_times, end_time, side='right')
+        return entry.table.slice(first, last - first)
+
+    def invalidate(self, series=None):
+        """
+        Drop one series, given as a (symbol, currency, interval) tuple, or all of them.
+        """
+        with self._lock:
+            for key in ([series] if series is not None else list(self._entries)):
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._size -= entry.table.nbytes
+
+    def stats(self):
+        """
+        Summarize the cache state.
+
+        Returns:
+        - dict: Cached series, bytes and rows, query hits and misses, loaded rows and evictions.
+        """
+        with self._lock:
+            return {
+                "series": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "rows": sum(entry.table.num_rows for entry in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "loaded_rows": self.loaded_rows,
+                "evictions": self.evictions,
+            }
+
+
+def to_arrow_ipc(table):
+    """Serialize a table in the Arrow IPC streaming format."""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def to_parquet(table):
+    """Serialize a table as a Parquet file."""
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink)
+    return sink.getvalue().to_pybytes()
+
+
+def parse_time(value):
+    """
+    Parse a query time given in epoch milliseconds or as an ISO date or datetime in UTC.
+
+    Returns:
+    - int or None: Epoch milliseconds, None for an empty value.
+    """
+    if value in (None, ''):
+        return None
+    if value.lstrip('-').isdigit():
+        return int(value)
+    return _to_epoch_ms(datetime.fromisoformat(value))
+
+
+def make_server(cache, host='127.0.0.1', port=8765):
+    """
+    Create an HTTP server answering OHLCV queries from an OhlcvCache.
+
+    GET /ohlcv?symbol=BTCUSDT&currency=USD&interval=1h&start=2024-01-01&end=2024-02-01&format=arrow
+    returns the bars as an Arrow IPC stream (format=arrow, the default) or a Parquet file
+    (format=parquet); start and end are optional open times, in epoch milliseconds or as ISO
+    dates in UTC. GET /stats returns the cache statistics as JSON.
+
+    Parameters:
+    - cache (OhlcvCache): The cache to serve.
+    - host (str): Address to bind to.
+    - port (int): Port to bind to; 0 picks a free one.
+
+    Returns:
+    - ThreadingHTTPServer: The server; call serve_forever() to run it.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+        def _send(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, status, body):
+            self._send(status, json.dumps(body).encode(), 'application/json')
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            if url.path == '/stats':
+                self._send_json(200, cache.stats())
+                return
+            if url.path != '/ohlcv':
+                self._send_json(404, {"error": "Not found."})
+                return
+
+            output = query.get('format', 'arrow')
+            missing = [name for name in ('symbol', 'currency', 'interval') if name not in query]
+            if missing:
+                self._send_json(400, {"error": f"Missing parameters: {', '.join(missing)}."})
+                return
+            if output not in CONTENT_TYPES:
+                self._send_json(400, {"error": f"Unknown format {output!r}, use one of {', '.join(CONTENT_TYPES)}."})
+                return
+            try:
+                table = cache.query(query['symbol'], query['currency'], query['interval'],
+                                    parse_time(query.get('start')), parse_time(query.get('end')))
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            except Exception as e:
+                logging.exception(f"Query {self.path} failed")
+                self._send_json(500, {"error": str(e)})
+                return
+            body = to_parquet(table) if output == 'parquet' else to_arrow_ipc(table)
+            self._send(200, body, CONTENT_TYPES[output])
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def fetch_ohlcv(base_url, symbol, currency, interval, start_time=None, end_time=None, timeout=60):
+    """
+    Query a running OHLCV service, e.g. from a notebook.
+
+    Parameters:
+    - base_url (str): URL of the service, e.g. 'http://127.0.0.1:8765'.
+    - symbol, currency, interval: The series, as for OhlcvCache.query.
+    - start_time, end_time: Open times in epoch milliseconds or ISO dates (both optional).
+    - timeout (float): Request timeout in seconds.
+
+    Returns:
+    - pa.Table: The bars in OHLCV_SCHEMA; call .to_pandas() for a DataFrame.
+    """
+    import requests
+
+    params = {'symbol': symbol, 'currency': currency, 'interval': interval, 'format': 'arrow'}
+    if start_time is not None:
+        params['start'] = start_time
+    if end_time is not None:
+        params['end'] = end_time
+    response = requests.get(f'{base_url}/ohlcv', params=params, timeout=timeout)
+    response.raise_for_status()
+    return pa.ipc.open_stream(response.content).read_all()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    import psycopg2
+
+    from config import DB_CONFIG, QUERY_CACHE_MAX_BYTES, QUERY_SERVICE_PORT  # Import the configuration from the config.py file
+
+    parser = argparse.ArgumentParser(description='Serve OHLCV queries from an in-memory cache as Arrow IPC or Parquet.')
+    parser.add_argument('--dsn', help='libpq connection string to use instead of DB_CONFIG from config.py.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to bind to.')
+    parser.add_argument('--port', type=int, default=QUERY_SERVICE_PORT, help='Port to bind to.')
+    parser.add_argument('--max-bytes', type=int, default=QUERY_CACHE_MAX_BYTES, help='Memory the cached bars may use.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    connection = psycopg2.connect(**({'dsn': args.dsn} if args.dsn else DB_CONFIG))
+    server = make_server(OhlcvCache(connection, args.max_bytes), args.host, args.port)
+    logging.info(f"Serving OHLCV queries on http://{args.host}:{server.server_address[1]}/ohlcv")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        connection.close()
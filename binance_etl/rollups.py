@@ -0,0 +1,117 @@
+import logging
+
+from binance_etl.schema import ROLLUP_PERIODS
+
+# Bars the rollups are aggregated from
+ROLLUP_SOURCE_INTERVAL = '1d'
+
+# Number of buckets in the rolling volatility window (12 weeks / 12 months)
+VOLATILITY_WINDOW = 12
+
+
+def _refresh_buckets(cur, table, period, series):
+    """Re-aggregate the touched buckets of one rollup table and recompute its derived columns."""
+    # OHLCV of every bucket that overlaps a touched range, straight from the source bars
+    cur.execute(f"""
+        WITH touched AS (
+            SELECT * FROM unnest(%s::TEXT[], %s::TEXT[], %s::TIMESTAMP[], %s::TIMESTAMP[])
+                AS t (symbol, currency, first_open_time, last_open_time)
+        )
+        INSERT INTO {table} (symbol, currency, bucket_start, open_price, high_price, low_price,
+                             close_price, volume, trade_count, bar_count)
+        SELECT c.symbol, c.currency, date_trunc('{period}', c.open_time) AS bucket_start,
+               (array_agg(c.open_price ORDER BY c.open_time))[1],
+               MAX(c.high_price), MIN(c.low_price),
+               (array_agg(c.close_price ORDER BY c.open_time DESC))[1],
+               SUM(c.volume), SUM(c.trade_count), COUNT(*)
+        FROM combined_table c
+        JOIN touched t ON c.symbol = t.symbol AND c.currency = t.currency
+        WHERE c.interval = %s
+          AND c.open_time >= date_trunc('{period}', t.first_open_time)
+          AND c.open_time < date_trunc('{period}', t.last_open_time) + INTERVAL '1 {period}'
+        GROUP BY c.symbol, c.currency, bucket_start
+        ON CONFLICT (symbol, currency, bucket_start) DO UPDATE
+        SET open_price = EXCLUDED.open_price,
+            high_price = EXCLUDED.high_price,
+            low_price = EXCLUDED.low_price,
+            close_price = EXCLUDED.close_price,
+            volume = EXCLUDED.volume,
+            trade_count = EXCLUDED.trade_count,
+            bar_count = EXCLUDED.bar_count;
+    """, series + (ROLLUP_SOURCE_INTERVAL,))
+
+    # Returns and volatility depend on earlier buckets, so they are recomputed from the first
+    # touched bucket onwards, reading just enough history to fill the rolling window
+    cur.execute(f"""
+        WITH touched AS (
+            SELECT symbol, currency, date_trunc('{period}', first_open_time) AS first_bucket
+            FROM unnest(%s::TEXT[], %s::TEXT[], %s::TIMESTAMP[], %s::TIMESTAMP[])
+                AS t (symbol, currency, first_open_time, last_open_time)
+        ),
+        returns AS (
+            SELECT r.symbol, r.currency, r.bucket_start, t.first_bucket,
+                   r.close_price / LAG(r.close_price) OVER w - 1 AS bucket_return,
+                   ln(r.close_price / LAG(r.close_price) OVER w) AS log_return
+            FROM {table} r
+            JOIN touched t ON r.symbol = t.symbol AND r.currency = t.currency
+            WHERE r.bucket_start >= t.first_bucket - %s * INTERVAL '1 {period}'
+            WINDOW w AS (PARTITION BY r.symbol, r.currency ORDER BY r.bucket_start)
+        ),
+        stats AS (
+            SELECT *, stddev_samp(log_return) OVER (
+                PARTITION BY symbol, currency ORDER BY bucket_start
+                ROWS BETWEEN %s PRECEDING AND CURRENT ROW
+            ) AS volatility
+            FROM returns
+        )
+        UPDATE {table} r
+        SET bucket_return = s.bucket_return,
+            log_return = s.log_return,
+            volatility = s.volatility
+        FROM stats s
+        WHERE r.symbol = s.symbol AND r.currency = s.currency AND r.bucket_start = s.bucket_start
+          AND s.bucket_start >= s.first_bucket;
+    """, series + (VOLATILITY_WINDOW, VOLATILITY_WINDOW - 1))
+
+
+def refresh_rollups(connection):
+    """
+    Bring the weekly and monthly rollup tables up to date with the bars written since the last refresh.
+
+    For every symbol and currency, ohlcv_weekly and ohlcv_monthly hold the OHLCV, trade count
+    and number of daily bars per bucket, the simple and log return against the previous
+    bucket, and the volatility (standard deviation of the bucket log returns over the last
+    VOLATILITY_WINDOW buckets). Buckets follow date_trunc, so weeks start on Monday like
+    Binance's weekly klines.
+
+    write_klines queues the time range of every insert in rollup_pending. Only the buckets
+    overlapping those ranges are re-aggregated, and returns and volatility only from the
+    first touched bucket onwards, so the cost of a refresh depends on the new data rather
+    than on the length of the history. The queue is claimed and the rollups are updated in
+    one transaction; bars committed concurrently are picked up by the next refresh.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+
+    Returns:
+    - int: Number of series whose rollups were refreshed.
+    """
+    try:
+        with connection.cursor() as cur:
+            cur.execute("""
+                DELETE FROM rollup_pending
+                WHERE interval = %s
+                RETURNING symbol, currency, first_open_time, last_open_time;
+            """, (ROLLUP_SOURCE_INTERVAL,))
+            rows = cur.fetchall()
+            if rows:
+                series = tuple(list(column) for column in zip(*rows))
+                for table, period in ROLLUP_PERIODS.items():
+                    _refresh_buckets(cur, table, period, series)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    logging.info(f"Refreshed the rollups of {len(rows)} series.")
+    return len(rows)
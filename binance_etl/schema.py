@@ -0,0 +1,299 @@
+import logging
+from datetime import datetime
+
+import psycopg2
+import psycopg2.errors
+
+from binance_etl.decoder import DAY_MS, INTERVAL_MS
+from binance_etl.features import create_features_table
+from binance_etl.modeling import create_model_tables
+from binance_etl.universe import create_universe_table
+
+# Rollup tables maintained by binance_etl.rollups and the date_trunc period of their buckets
+ROLLUP_PERIODS = {
+    'ohlcv_weekly': 'week',
+    'ohlcv_monthly': 'month',
+}
+
+# Partitions (qualified by database) that are known to exist, so the writer only touches the catalog for new ones
+_known_partitions = set()
+
+# Databases whose combined_table is partitioned, keyed by DSN
+_partitioned_tables = {}
+
+
+def create_partitioned_table(cur):
+    """
+    Create the partitioned combined_table layout.
+
+    combined_table is list-partitioned by interval, and every interval partition is range-
+    partitioned by open_time (yearly for daily and longer intervals, monthly for intraday
+    ones, see ensure_partitions). Prices and volume are stored as fixed-width DOUBLE
+    PRECISION and the natural key (symbol, currency, interval, open_time) is the primary key,
+    so there is no surrogate id. Time-range scans are served by a BRIN index on open_time
+    that is inherited by every partition.
+
+    Parameters:
+    - cur: An open psycopg2 cursor.
+
+    Returns:
+    - None
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS combined_table (
+            symbol VARCHAR(20) NOT NULL,
+            currency VARCHAR(3) NOT NULL,
+            interval VARCHAR(8) NOT NULL,
+            open_time TIMESTAMP NOT NULL,
+            open_price DOUBLE PRECISION NOT NULL,
+            high_price DOUBLE PRECISION NOT NULL,
+            low_price DOUBLE PRECISION NOT NULL,
+            close_price DOUBLE PRECISION NOT NULL,
+            volume DOUBLE PRECISION NOT NULL,
+            close_time TIMESTAMP NOT NULL,
+            trade_count INTEGER NOT NULL,
+            CONSTRAINT combined_table_pkey PRIMARY KEY (symbol, currency, interval, open_time)
+        ) PARTITION BY LIST (interval);
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_combined_table_open_time_brin ON combined_table USING BRIN (open_time);")
+
+
+def is_partitioned(connection):
+    """
+    Tell whether combined_table uses the partitioned layout (cached per database).
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+
+    Returns:
+    - bool: True for the partitioned layout, False for the legacy heap table.
+    """
+    if connection.dsn not in _partitioned_tables:
+        with connection.cursor() as cur:
+            cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('combined_table');")
+            row = cur.fetchone()
+        _partitioned_tables[connection.dsn] = bool(row) and row[0] == 'p'
+    return _partitioned_tables[connection.dsn]
+
+
+def partition_bounds(interval, start_time, end_time):
+    """
+    Range partitions of an interval needed to hold bars opened between two times.
+
+    Parameters:
+    - interval (str): Binance interval, e.g. '1h'.
+    - start_time (int): First open time in epoch milliseconds.
+    - end_time (int): Last open time in epoch milliseconds.
+
+    Returns:
+    - list: (partition name, lower bound, upper bound) tuples, bounds as datetimes.
+    """
+    monthly = INTERVAL_MS[interval] < DAY_MS
+    current = datetime.utcfromtimestamp(start_time / 1000.0)
+    last = datetime.utcfromtimestamp(end_time / 1000.0)
+    current = datetime(current.year, current.month if monthly else 1, 1)
+
+    bounds = []
+    while current <= last:
+        if monthly:
+            upper = datetime(current.year + current.month // 12, current.month % 12 + 1, 1)
+            name = f"combined_table_{interval}_{current.year}_{current.month:02d}"
+        else:
+            upper = datetime(current.year + 1, 1, 1)
+            name = f"combined_table_{interval}_{current.year}"
+        bounds.append((name, current, upper))
+        current = upper
+    return bounds
+
+
+def partition_ddl(interval, partitions):
+    """
+    CREATE TABLE statements for an interval partition and some of its time-range partitions.
+
+    Parameters:
+    - interval (str): Binance interval, e.g. '1h'.
+    - partitions (list): (partition name, lower bound, upper bound) tuples as returned by
+      partition_bounds; a (name, None, None) entry stands for the interval partition itself.
+
+    Returns:
+    - list: SQL statements, safe to run repeatedly.
+    """
+    parent = f"combined_table_{interval}"
+    statements = []
+    for name, lower, upper in partitions:
+        if lower is None:
+            statements.append(f"""
+                CREATE TABLE IF NOT EXISTS {parent} PARTITION OF combined_table
+                FOR VALUES IN ('{interval}') PARTITION BY RANGE (open_time);
+            """)
+        else:
+            statements.append(f"""
+                CREATE TABLE IF NOT EXISTS {name} PARTITION OF {parent}
+                FOR VALUES FROM ('{lower:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}');
+            """)
+    return statements
+
+
+def ensure_partitions(connection, interval, start_time, end_time):
+    """
+    Create the interval and time-range partitions a batch of bars will land in.
+
+    Does nothing for the legacy (unpartitioned) layout. Partitions already seen by this
+    process are skipped without a round-trip. New partitions are created and committed in a
+    short transaction of their own, before the batch is written.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+    - interval (str): Binance interval, e.g. '1h'.
+    - start_time (int): First open time of the batch in epoch milliseconds.
+    - end_time (int): Last open time of the batch in epoch milliseconds.
+
+    Returns:
+    - None
+    """
+    if not is_partitioned(connection):
+        return
+
+    wanted = [(f"combined_table_{interval}", None, None)] + partition_bounds(interval, start_time, end_time)
+    missing = [p for p in wanted if (connection.dsn, p[0]) not in _known_partitions]
+    if not missing:
+        return
+
+    for attempt in range(2):
+        try:
+            with connection.cursor() as cur:
+                for statement in partition_ddl(interval, missing):
+                    cur.execute(statement)
+            connection.commit()
+            break
+        except (psycopg2.errors.DuplicateTable, psycopg2.errors.UniqueViolation):
+            # Another worker created the same partition concurrently; IF NOT EXISTS will see it on retry
+            connection.rollback()
+            if attempt:
+                raise
+    _known_partitions.update((connection.dsn, p[0]) for p in missing)
+
+
+def ensure_schema(connection):
+    """
+    Create the combined_table, its indexes and the bookkeeping and rollup tables if they do not exist yet.
+
+    New databases get the partitioned layout (see create_partitioned_table). Databases that
+    still hold the legacy heap table keep working: the interval column is added in place with
+    a '1d' default (their rows are daily bars), the unique constraint is widened to include it
+    and the redundant idx_symbol_open_time_currency index is dropped. Run
+    `python -m binance_etl.migrate` to convert them to the partitioned layout.
+
+    When the watermark table is empty but combined_table already holds data (a database that
+    predates the watermarks), the watermarks are seeded from combined_table once.
+
+    The weekly and monthly rollup tables (see binance_etl.rollups) with their rollup_pending
+    queue, the features table (see binance_etl.features) and the model_runs and forecasts
+    tables (see binance_etl.modeling) and the symbol_universe table (see binance_etl.universe)
+    are created as well. When the queue is first created,
+    every stored series is queued so the rollups of existing data are built on the next refresh.
+
+    Run this once per ingest run rather than once per batch.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+
+    Returns:
+    - None
+    """
+    with connection.cursor() as cur:
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('combined_table');")
+        row = cur.fetchone()
+        if row is None or row[0] == 'p':
+            create_partitioned_table(cur)
+        else:
+            logging.warning("combined_table uses the legacy unpartitioned layout; run `python -m binance_etl.migrate` to convert it.")
+            # Migrate tables created before the interval column existed
+            cur.execute("ALTER TABLE combined_table ADD COLUMN IF NOT EXISTS interval VARCHAR(8) NOT NULL DEFAULT '1d';")
+            cur.execute("ALTER TABLE combined_table DROP CONSTRAINT IF EXISTS symbol_open_time_currency_unique_constraint;")
+            cur.execute("""
+                SELECT EXISTS (
+                    SELECT 1 FROM pg_constraint
+                    WHERE conname = 'symbol_currency_interval_open_time_unique_constraint'
+                );
+            """)
+            if not cur.fetchone()[0]:
+                cur.execute("""
+                    ALTER TABLE combined_table
+                    ADD CONSTRAINT symbol_currency_interval_open_time_unique_constraint UNIQUE (symbol, currency, interval, open_time);
+                """)
+            # The unique constraint's own index already covers lookups by symbol and time
+            cur.execute("DROP INDEX IF EXISTS idx_symbol_open_time_currency;")
+
+        # Latest stored bar per series, maintained by the writer in the same transaction as the data
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_watermarks (
+                symbol VARCHAR(20) NOT NULL,
+                currency VARCHAR(3) NOT NULL,
+                interval VARCHAR(8) NOT NULL,
+                last_open_time TIMESTAMP NOT NULL,
+                updated_at TIMESTAMP NOT NULL,
+                history_updated_at TIMESTAMP,
+                first_available_time TIMESTAMP,
+                PRIMARY KEY (symbol, currency, interval)
+            );
+        """)
+        # Last write of bars at or before the watermark (e.g. a repair) and the first bar Binance has for the
+        # series (see binance_etl.gaps.probe_first_bars), added after the table itself
+        cur.execute("ALTER TABLE ingest_watermarks ADD COLUMN IF NOT EXISTS history_updated_at TIMESTAMP;")
+        cur.execute("ALTER TABLE ingest_watermarks ADD COLUMN IF NOT EXISTS first_available_time TIMESTAMP;")
+        cur.execute("SELECT EXISTS (SELECT 1 FROM ingest_watermarks);")
+        if not cur.fetchone()[0]:
+            cur.execute("""
+                INSERT INTO ingest_watermarks (symbol, currency, interval, last_open_time, updated_at)
+                SELECT symbol, currency, interval, MAX(open_time), now() AT TIME ZONE 'UTC'
+                FROM combined_table
+                GROUP BY symbol, currency, interval;
+            """)
+
+        # Time ranges written since the last rollup refresh, maintained by the writer
+        cur.execute("SELECT to_regclass('rollup_pending') IS NULL;")
+        seed_rollups = cur.fetchone()[0]
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS rollup_pending (
+                symbol VARCHAR(20) NOT NULL,
+                currency VARCHAR(3) NOT NULL,
+                interval VARCHAR(8) NOT NULL,
+                first_open_time TIMESTAMP NOT NULL,
+                last_open_time TIMESTAMP NOT NULL,
+                PRIMARY KEY (symbol, currency, interval)
+            );
+        """)
+        for table in ROLLUP_PERIODS:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    symbol VARCHAR(20) NOT NULL,
+                    currency VARCHAR(3) NOT NULL,
+                    bucket_start TIMESTAMP NOT NULL,
+                    open_price DOUBLE PRECISION NOT NULL,
+                    high_price DOUBLE PRECISION NOT NULL,
+                    low_price DOUBLE PRECISION NOT NULL,
+                    close_price DOUBLE PRECISION NOT NULL,
+                    volume DOUBLE PRECISION NOT NULL,
+                    trade_count BIGINT NOT NULL,
+                    bar_count INTEGER NOT NULL,
+                    bucket_return DOUBLE PRECISION,
+                    log_return DOUBLE PRECISION,
+                    volatility DOUBLE PRECISION,
+                    PRIMARY KEY (symbol, currency, bucket_start)
+                );
+            """)
+        create_features_table(cur)
+        create_model_tables(cur)
+        create_universe_table(cur)
+        if seed_rollups:
+            # Build the rollups of data that predates them on the next refresh
+            cur.execute("""
+                INSERT INTO rollup_pending (symbol, currency, interval, first_open_time, last_open_time)
+                SELECT symbol, currency, interval, MIN(open_time), MAX(open_time)
+                FROM combined_table
+                GROUP BY symbol, currency, interval;
+            """)
+    connection.commit()
+    _partitioned_tables.pop(connection.dsn, None)
+    logging.info("combined_table schema is in place.")
@@ -0,0 +1,281 @@
+import json
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+import pandas as pd
+import websocket
+
+from binance_etl.backfill import BackfillError, BackfillWindow, backfill, now_ms
+from binance_etl.decoder import INTERVAL_MS, decode_klines
+from binance_etl.metrics import measure
+from binance_etl.watermarks import read_watermarks
+from binance_etl.writer import write_klines
+
+STREAM_URL = 'wss://stream.binance.com:9443'
+
+# Binance accepts at most 1024 streams per connection
+MAX_STREAMS_PER_CONNECTION = 1024
+
+# Seconds between micro-batch writes; all bars that closed in the meantime go into one transaction
+FLUSH_INTERVAL = 1.0
+
+# Bars buffered before a write is forced regardless of FLUSH_INTERVAL
+MAX_BATCH_BARS = 10000
+
+# Seconds between keep-alive pings and how long to wait for the pong, so a silently dead
+# connection is noticed and reopened
+PING_INTERVAL = 20
+PING_TIMEOUT = 10
+
+# Reconnect delays in seconds, doubled after every failed attempt
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 60.0
+
+
+def stream_name(symbol, interval):
+    """Name of the kline stream of a series, e.g. 'btcusdt@kline_1m'."""
+    return f"{symbol.lower()}@kline_{interval}"
+
+
+def _kline_row(kline):
+    """A stream kline ('k' of a kline event) in the raw /api/v3/klines array layout, for decode_klines."""
+    return [kline['t'], kline['o'], kline['h'], kline['l'], kline['c'], kline['v'], kline['T'],
+            kline['q'], kline['n'], kline['V'], kline['Q'], kline['B']]
+
+
+class KlineStreamIngestor:
+    """
+    Long-running ingestor of closed bars from Binance's combined kline WebSocket streams.
+
+    Every tracked series is subscribed as a <symbol>@kline_<interval> stream, spread over as
+    few connections as possible, each listened to by its own thread. Only final (closed) bar
+    events are kept; they are buffered and written every FLUSH_INTERVAL seconds with one
+    write_klines call, so bars land within about a second of closing and a whole batch (e.g.
+    every 1m bar of all pairs) costs a single transaction. All database work happens in the
+    thread that calls run(), on the given connection.
+
+    The stream carries no history, so whenever a connection is (re)established the series on
+    it are caught up over REST from their ingest_watermarks, which after a short disconnect
+    costs one request per series. When a closed bar does not follow the last one of its
+    series (a lost message), only the skipped bars are fetched; otherwise REST is not used
+    at all. Dropped connections are reopened with exponential backoff.
+
+    With an IngestMetrics collector, the 'stream' stage counts messages, bytes and closed
+    bars per series and 'land' has one call per written bar with the seconds from its close
+    to the commit, besides the usual write (and catch-up) stages.
+    """
+
+    def __init__(self, connection, fetcher, series, stream_url=STREAM_URL, history_start=None,
+                 flush_interval=FLUSH_INTERVAL, cache=None, metrics=None):
+        """
+        Parameters:
+        - connection: An open psycopg2 connection.
+        - fetcher (KlineFetcher): Fetcher used for the REST catch-ups.
+        - series (list): (symbol, currency, interval) tuples to follow.
+        - stream_url (str): Base URL of the WebSocket API.
+        - history_start (int): Where series without a watermark are caught up from (epoch
+          milliseconds). If None, they are only followed from the first streamed bar on.
+        - flush_interval (float): Seconds between writes.
+        - cache (KlineCache): Optional local page cache for the catch-ups.
+        - metrics (IngestMetrics): Optional stage timing collector.
+        """
+        self.connection = connection
+        self.fetcher = fetcher
+        self.stream_url = stream_url
+        self.history_start = history_start
+        self.flush_interval = flush_interval
+        self.cache = cache
+        self.metrics = metrics
+
+        self.series = {stream_name(symbol, interval): (symbol, currency, interval) for symbol, currency, interval in series}
+        self.reconnect_count = 0
+
+        self._events = queue.Queue()
+        self._stopped = threading.Event()
+        self._apps = []
+
+        # Closed bars waiting for the next write, per series, and their number
+        self._buffer = defaultdict(list)
+        self._buffered = 0
+        # Decoded bars the local clock does not consider closed yet (write_klines would drop them)
+        self._held = None
+        # Open time of the last bar of each series that was stored or is buffered
+        self._last_open = {}
+
+    def _url(self, streams):
+        return f"{self.stream_url}/stream?streams={'/'.join(streams)}"
+
+    def _listen(self, streams):
+        """Keep one connection open until stop(), reconnecting with exponential backoff."""
+        delay = RECONNECT_DELAY
+
+        def on_open(app):
+            nonlocal delay
+            delay = RECONNECT_DELAY
+            self._events.put(('connected', streams))
+
+        def on_message(app, message):
+            self._events.put(('message', message))
+
+        def on_error(app, error):
+            logging.warning(f"Kline stream error: {error}")
+
+        while not self._stopped.is_set():
+            app = websocket.WebSocketApp(self._url(streams), on_open=on_open, on_message=on_message, on_error=on_error)
+            self._apps.append(app)
+            app.run_forever(ping_interval=PING_INTERVAL, ping_timeout=PING_TIMEOUT)
+            self._apps.remove(app)
+            if self._stopped.wait(delay):
+                break
+            logging.warning(f"Kline stream of {len(streams)} series disconnected, reconnecting.")
+            self.reconnect_count += 1
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def _handle_message(self, message):
+        """Buffer the bar of a final kline event; returns the window of bars its stream skipped, if any."""
+        event = json.loads(message)
+        kline = event['data']['k']
+        series = self.series.get(event['stream'])
+        if series is None:
+            return None
+        symbol, currency, interval = series
+        closed = kline['x']
+        if self.metrics is not None:
+            self.metrics.record('stream', symbol, interval, bytes=len(message), rows=int(closed))
+        if not closed:
+            return None
+
+        open_time = kline['t']
+        last = self._last_open.get(series)
+        if last is not None and open_time <= last:
+            return None
+        self._buffer[series].append(_kline_row(kline))
+        self._buffered += 1
+        self._last_open[series] = open_time
+
+        step = INTERVAL_MS[interval]
+        if last is not None and open_time > last + step:
+            return BackfillWindow(symbol, currency, interval, last + step, open_time - step)
+        return None
+
+    def _backfill(self, windows):
+        """Fetch windows over REST; a failure is logged and left to the next catch-up."""
+        try:
+            return backfill(self.connection, self.fetcher, windows, cache=self.cache, metrics=self.metrics)
+        except BackfillError as e:
+            logging.error(f"Catch-up of {len(windows)} series incomplete: {e}")
+            return 0
+
+    def catch_up(self, series):
+        """
+        Fetch the bars of some series between their watermark and now over REST.
+
+        Parameters:
+        - series (list): (symbol, currency, interval) tuples.
+
+        Returns:
+        - int: Number of rows inserted.
+        """
+        # Write what is buffered first, so the watermarks are as recent as possible
+        inserted = self.flush()
+        watermarks = read_watermarks(self.connection)
+        end_time = now_ms()
+        windows = []
+        for symbol, currency, interval in series:
+            watermark = watermarks.get((symbol, currency, interval))
+            start_time = watermark + INTERVAL_MS[interval] if watermark is not None else self.history_start
+            if start_time is not None and start_time <= end_time - INTERVAL_MS[interval]:
+                windows.append(BackfillWindow(symbol, currency, interval, start_time, end_time))
+        if windows:
+            inserted += self._backfill(windows)
+            logging.info(f"Caught up {len(windows)} series over REST.")
+
+        # Streamed bars continue from the latest stored one
+        watermarks = read_watermarks(self.connection)
+        for key in series:
+            if key in watermarks:
+                self._last_open[key] = max(self._last_open.get(key, watermarks[key]), watermarks[key])
+        return inserted
+
+    def flush(self):
+        """
+        Write the buffered bars that have closed with a single write_klines call.
+
+        Returns:
+        - int: Number of rows inserted.
+        """
+        frames = [decode_klines(rows, *series) for series, rows in self._buffer.items()]
+        if self._held is not None:
+            frames.append(self._held)
+        if not frames:
+            return 0
+        df = pd.concat(frames, ignore_index=True)
+        self._buffer = defaultdict(list)
+
+        now = now_ms()
+        held = df['close_time'] >= now
+        self._held = df[held] if held.any() else None
+        self._buffered = int(held.sum())
+        df = df[~held]
+        if df.empty:
+            return 0
+
+        with measure(self.metrics, 'write') as counts:
+            counts['rows'] = write_klines(self.connection, df)
+        if self.metrics is not None:
+            committed = now_ms()
+            for row in df[['symbol', 'interval', 'close_time']].itertuples(index=False):
+                self.metrics.record('land', row.symbol, row.interval, seconds=(committed - row.close_time) / 1000)
+        return counts['rows']
+
+    def run(self, duration=None):
+        """
+        Connect and ingest until stop() is called (or for `duration` seconds).
+
+        Parameters:
+        - duration (float): Stop after this many seconds. Runs until stop() by default.
+
+        Returns:
+        - int: Number of rows inserted, streamed and caught up.
+        """
+        streams = list(self.series)
+        chunks = [streams[first:first + MAX_STREAMS_PER_CONNECTION] for first in range(0, len(streams), MAX_STREAMS_PER_CONNECTION)]
+        for chunk in chunks:
+            threading.Thread(target=self._listen, args=(chunk,), daemon=True).start()
+        logging.info(f"Streaming {len(streams)} kline streams over {len(chunks)} connections.")
+
+        deadline = None if duration is None else time.monotonic() + duration
+        next_flush = time.monotonic() + self.flush_interval
+        inserted = 0
+        try:
+            while not self._stopped.is_set() and (deadline is None or time.monotonic() < deadline):
+                try:
+                    kind, payload = self._events.get(timeout=max(0.0, next_flush - time.monotonic()))
+                except queue.Empty:
+                    kind = None
+
+                if kind == 'connected':
+                    inserted += self.catch_up([self.series[stream] for stream in payload])
+                elif kind == 'message':
+                    skipped = self._handle_message(payload)
+                    if skipped is not None:
+                        logging.warning(f"Kline stream of {skipped.symbol} {skipped.interval} skipped bars, fetching them over REST.")
+                        inserted += self._backfill([skipped])
+
+                if time.monotonic() >= next_flush or self._buffered >= MAX_BATCH_BARS:
+                    inserted += self.flush()
+                    next_flush = time.monotonic() + self.flush_interval
+        finally:
+            self.stop()
+            inserted += self.flush()
+        return inserted
+
+    def stop(self):
+        """Close the connections and let run() return after its last write."""
+        self._stopped.set()
+        # The listener threads are daemons and end on their own once their connection is closed
+        for app in list(self._apps):
+            app.close()
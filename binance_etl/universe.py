@@ -0,0 +1,271 @@
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+EXCHANGE_INFO_ENDPOINT = '/api/v3/exchangeInfo'
+TICKER_24HR_ENDPOINT = '/api/v3/ticker/24hr'
+
+# Request weights of the two metadata calls (exchangeInfo of all symbols, 24h tickers of all symbols)
+EXCHANGE_INFO_WEIGHT = 20
+TICKER_24HR_WEIGHT = 80
+
+# Quote assets tracked by default and the currency label stored for their pairs
+DEFAULT_QUOTES = {'USDT': 'USD', 'EUR': 'EUR'}
+
+# Base assets that are pegged to a fiat currency; their pairs carry volume but no price signal
+STABLECOINS = frozenset({
+    'AEUR', 'BUSD', 'DAI', 'EUR', 'EURI', 'FDUSD', 'PAX', 'PYUSD', 'TUSD', 'USD1', 'USDC', 'USDP', 'USDS', 'USDT', 'UST',
+})
+
+# One pair of the universe as stored in symbol_universe
+UniversePair = namedtuple('UniversePair', ['symbol', 'currency', 'base_asset', 'quote_asset', 'status', 'quote_volume', 'volume_rank'])
+
+
+def create_universe_table(cur):
+    """
+    Create the symbol_universe table: every candidate pair of the tracked quote assets with
+    its latest status, 24h quote volume and rank, and whether it is currently tracked.
+
+    Parameters:
+    - cur: An open psycopg2 cursor.
+
+    Returns:
+    - None
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS symbol_universe (
+            symbol VARCHAR(20) PRIMARY KEY,
+            currency VARCHAR(3) NOT NULL,
+            base_asset VARCHAR(20) NOT NULL,
+            quote_asset VARCHAR(20) NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            quote_volume DOUBLE PRECISION,
+            volume_rank INTEGER,
+            tracked BOOLEAN NOT NULL DEFAULT FALSE,
+            first_tracked_at TIMESTAMP,
+            delisted_at TIMESTAMP,
+            refreshed_at TIMESTAMP NOT NULL
+        );
+    """)
+
+
+def fetch_exchange_metadata(fetcher):
+    """
+    Fetch the symbols of the exchange and their 24h tickers, one batched request each.
+
+    Parameters:
+    - fetcher (KlineFetcher): Fetcher used for both requests (they count against its rate budget).
+
+    Returns:
+    - tuple: (exchangeInfo symbol entries, {symbol: 24h quote volume}).
+    """
+    symbols = fetcher.get(EXCHANGE_INFO_ENDPOINT, weight=EXCHANGE_INFO_WEIGHT)['symbols']
+    # The MINI tickers leave out the price change fields, roughly halving the response
+    tickers = fetcher.get(TICKER_24HR_ENDPOINT, {'type': 'MINI'}, weight=TICKER_24HR_WEIGHT)
+    return symbols, {ticker['symbol']: float(ticker['quoteVolume']) for ticker in tickers}
+
+
+def rank_pairs(symbols, quote_volumes, quotes=DEFAULT_QUOTES, excluded_bases=STABLECOINS):
+    """
+    Rank the spot pairs of each quote asset by their 24h quote volume.
+
+    Volumes in different quote assets are not comparable, so every quote asset is ranked on
+    its own. Pairs that are not trading (halted or delisted) are kept, without a rank.
+
+    Parameters:
+    - symbols (list): exchangeInfo symbol entries.
+    - quote_volumes (dict): {symbol: 24h quote volume}.
+    - quotes (dict): {quote asset: currency label}, e.g. {'USDT': 'USD'}.
+    - excluded_bases (set): Base assets to leave out, e.g. stablecoins.
+
+    Returns:
+    - dict: {symbol: UniversePair}.
+    """
+    candidates = [
+        s for s in symbols
+        if s['quoteAsset'] in quotes and s['baseAsset'] not in excluded_bases and s.get('isSpotTradingAllowed', True)
+    ]
+    pairs = {}
+    for quote_asset, currency in quotes.items():
+        trading = sorted(
+            (s for s in candidates if s['quoteAsset'] == quote_asset and s['status'] == 'TRADING'),
+            key=lambda s: (-quote_volumes.get(s['symbol'], 0.0), s['symbol']),
+        )
+        ranks = {s['symbol']: rank for rank, s in enumerate(trading, start=1)}
+        for s in candidates:
+            if s['quoteAsset'] == quote_asset:
+                pairs[s['symbol']] = UniversePair(s['symbol'], currency, s['baseAsset'], quote_asset, s['status'],
+                                                  quote_volumes.get(s['symbol']), ranks.get(s['symbol']))
+    return pairs
+
+
+def select_pairs(pairs, previously_tracked, size, retain_rank=None):
+    """
+    Choose the pairs to track: the top `size` of each quote asset, plus previously tracked
+    pairs that still rank within `retain_rank`.
+
+    The retention band keeps pairs near the cut-off from being dropped and picked up again
+    from one refresh to the next, which would leave gaps in their series.
+
+    Parameters:
+    - pairs (dict): {symbol: UniversePair} from rank_pairs.
+    - previously_tracked (set): Symbols tracked so far.
+    - size (int): Pairs per quote asset.
+    - retain_rank (int): Rank up to which tracked pairs are kept. Defaults to twice `size`.
+
+    Returns:
+    - set: The symbols to track.
+    """
+    retain_rank = max(retain_rank or 2 * size, size)
+    return {
+        pair.symbol for pair in pairs.values()
+        if pair.volume_rank is not None
+        and (pair.volume_rank <= size or (pair.symbol in previously_tracked and pair.volume_rank <= retain_rank))
+    }
+
+
+def tracked_pairs(connection):
+    """
+    Read the currently tracked pairs.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+
+    Returns:
+    - list: (symbol, currency) tuples, by currency and volume rank.
+    """
+    with connection.cursor() as cur:
+        cur.execute("SELECT symbol, currency FROM symbol_universe WHERE tracked ORDER BY currency, volume_rank, symbol;")
+        return [tuple(row) for row in cur.fetchall()]
+
+
+def tracked_series(connection, intervals=None):
+    """
+    Read the stored series of the tracked pairs.
+
+    Pairs that fell out of the selection or were delisted keep their bars and watermarks, but
+    are left out here, so gap repair, features and models only spend work (and requests) on
+    the pairs that are still ingested. Until the universe is refreshed for the first time,
+    every stored series counts as tracked.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+    - intervals (list): Only return series of these intervals. All intervals by default.
+
+    Returns:
+    - list: (symbol, currency, interval) tuples, sorted by series.
+    """
+    intervals = None if intervals is None else list(intervals)
+    with connection.cursor() as cur:
+        cur.execute("""
+            SELECT w.symbol, w.currency, w.interval
+            FROM ingest_watermarks w
+            WHERE (%s::TEXT[] IS NULL OR w.interval = ANY(%s::TEXT[]))
+              AND (EXISTS (SELECT 1 FROM symbol_universe u WHERE u.symbol = w.symbol AND u.currency = w.currency AND u.tracked)
+                   OR NOT EXISTS (SELECT 1 FROM symbol_universe))
+            ORDER BY w.symbol, w.currency, w.interval;
+        """, (intervals, intervals))
+        return [tuple(row) for row in cur.fetchall()]
+
+
+def refresh_universe(connection, fetcher, quotes=DEFAULT_QUOTES, size=10, ttl=3600, retain_rank=None,
+                     excluded_bases=STABLECOINS):
+    """
+    Bring symbol_universe up to date and return the pairs to ingest.
+
+    The exchange metadata is fetched at most once per `ttl` seconds: while the last refresh
+    is younger, the stored selection is returned without any request, so every task and
+    script of a run can call this. Newly selected pairs (listings, or pairs that moved into
+    the top) are logged and have no watermark yet, so the ingest backfills them from their
+    first bar. Tracked pairs that stop trading or disappear from exchangeInfo are delisted:
+    they are no longer ingested, while their stored history is kept.
+
+    Parameters:
+    - connection: An open psycopg2 connection (symbol_universe must exist, see ensure_schema).
+    - fetcher (KlineFetcher): Fetcher used for the metadata requests.
+    - quotes (dict): {quote asset: currency label}.
+    - size (int): Pairs per quote asset, ranked by 24h quote volume.
+    - ttl (int): Seconds the stored selection is reused for.
+    - retain_rank (int): See select_pairs.
+    - excluded_bases (set): Base assets to leave out.
+
+    Returns:
+    - list: (symbol, currency) tuples, by currency and volume rank.
+    """
+    now = datetime.utcnow()
+    with connection.cursor() as cur:
+        cur.execute("SELECT MAX(refreshed_at) FROM symbol_universe;")
+        last_refresh = cur.fetchone()[0]
+        if last_refresh is not None and now - last_refresh < timedelta(seconds=ttl):
+            connection.rollback()
+            return tracked_pairs(connection)
+
+        cur.execute("SELECT symbol, tracked, first_tracked_at, delisted_at FROM symbol_universe;")
+        stored = {symbol: (tracked, first_tracked_at, delisted_at) for symbol, tracked, first_tracked_at, delisted_at in cur.fetchall()}
+        if stored:
+            previously_tracked = {symbol for symbol, (tracked, _, _) in stored.items() if tracked}
+        else:
+            # First refresh: the pairs that already have data count as tracked
+            cur.execute("SELECT DISTINCT symbol FROM ingest_watermarks;")
+            previously_tracked = {row[0] for row in cur.fetchall()}
+    connection.rollback()
+
+    symbols, quote_volumes = fetch_exchange_metadata(fetcher)
+    pairs = rank_pairs(symbols, quote_volumes, quotes, excluded_bases)
+    selected = select_pairs(pairs, previously_tracked, size, retain_rank)
+
+    rows = []
+    for symbol, pair in pairs.items():
+        _, first_tracked_at, delisted_at = stored.get(symbol, (False, None, None))
+        if symbol in selected:
+            first_tracked_at = first_tracked_at or now
+        if pair.status == 'TRADING':
+            delisted_at = None
+        elif delisted_at is None and symbol in previously_tracked:
+            delisted_at = now
+        rows.append((*pair, symbol in selected, first_tracked_at, delisted_at))
+
+    # Stored pairs that vanished from exchangeInfo altogether are delisted as well
+    vanished = [symbol for symbol in stored if symbol not in pairs]
+
+    listed = sorted(selected - previously_tracked)
+    delisted = sorted(s for s in previously_tracked if s not in pairs or pairs[s].status != 'TRADING')
+    dropped = sorted(s for s in previously_tracked - selected if s not in delisted)
+    if listed:
+        logging.info(f"Tracking {len(listed)} new pairs: {', '.join(listed)}.")
+    if delisted:
+        logging.warning(f"{len(delisted)} tracked pairs are no longer trading: {', '.join(delisted)}.")
+    if dropped:
+        logging.info(f"{len(dropped)} pairs fell out of the top {size} by quote volume: {', '.join(dropped)}.")
+
+    with connection.cursor() as cur:
+        if rows:
+            columns = list(zip(*rows))
+            cur.execute("""
+                INSERT INTO symbol_universe (symbol, currency, base_asset, quote_asset, status, quote_volume, volume_rank,
+                                             tracked, first_tracked_at, delisted_at, refreshed_at)
+                SELECT *, %s FROM unnest(%s::varchar[], %s::varchar[], %s::varchar[], %s::varchar[], %s::varchar[],
+                                         %s::double precision[], %s::integer[], %s::boolean[], %s::timestamp[], %s::timestamp[])
+                ON CONFLICT (symbol) DO UPDATE SET
+                    currency = EXCLUDED.currency,
+                    base_asset = EXCLUDED.base_asset,
+                    quote_asset = EXCLUDED.quote_asset,
+                    status = EXCLUDED.status,
+                    quote_volume = EXCLUDED.quote_volume,
+                    volume_rank = EXCLUDED.volume_rank,
+                    tracked = EXCLUDED.tracked,
+                    first_tracked_at = EXCLUDED.first_tracked_at,
+                    delisted_at = EXCLUDED.delisted_at,
+                    refreshed_at = EXCLUDED.refreshed_at;
+            """, (now, *[list(column) for column in columns]))
+        if vanished:
+            cur.execute("""
+                UPDATE symbol_universe
+                SET status = 'REMOVED', quote_volume = NULL, volume_rank = NULL, tracked = FALSE,
+                    delisted_at = COALESCE(delisted_at, %s), refreshed_at = %s
+                WHERE symbol = ANY(%s);
+            """, (now, now, vanished))
+    connection.commit()
+
+    logging.info(f"Selected {len(selected)} of {len(pairs)} candidate pairs.")
+    return tracked_pairs(connection)
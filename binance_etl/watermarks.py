@@ -0,0 +1,45 @@
+import calendar
+
+
+def _to_epoch_ms(timestamp):
+    # Watermarks are stored as naive UTC timestamps
+    return calendar.timegm(timestamp.utctimetuple()) * 1000
+
+
+def read_watermark(connection, symbol, currency, interval):
+    """
+    Look up the latest stored bar of a single series.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+    - symbol (str): Trading pair, e.g. 'BTCUSDT'.
+    - currency (str): Quote currency label, e.g. 'USD'.
+    - interval (str): Binance interval, e.g. '1d'.
+
+    Returns:
+    - int or None: Open time of the latest stored bar in epoch milliseconds, or None if the
+      series has no data yet.
+    """
+    with connection.cursor() as cur:
+        cur.execute(
+            "SELECT last_open_time FROM ingest_watermarks WHERE symbol = %s AND currency = %s AND interval = %s;",
+            (symbol, currency, interval),
+        )
+        row = cur.fetchone()
+    return _to_epoch_ms(row[0]) if row else None
+
+
+def read_watermarks(connection):
+    """
+    Read the watermarks of every stored series.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+
+    Returns:
+    - dict: {(symbol, currency, interval): latest open time in epoch milliseconds}.
+    """
+    with connection.cursor() as cur:
+        cur.execute("SELECT symbol, currency, interval, last_open_time FROM ingest_watermarks;")
+        rows = cur.fetchall()
+    return {(symbol, currency, interval): _to_epoch_ms(last_open_time) for symbol, currency, interval, last_open_time in rows}
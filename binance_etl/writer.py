@@ -0,0 +1,179 @@
+import io
+import logging
+import queue
+import threading
+import time
+
+from binance_etl.decoder import KLINE_COLUMNS
+from binance_etl.metrics import measure
+from binance_etl.schema import ensure_partitions
+
+
+def write_klines(connection, df):
+    """
+    Write a batch of decoded klines into combined_table with a single COPY and a set-based upsert.
+
+    The batch is streamed into a temporary staging table with COPY FROM STDIN and then merged
+    into combined_table with one INSERT ... SELECT ... ON CONFLICT DO NOTHING. Epoch-millisecond
+    times are converted to UTC timestamps by Postgres during the merge. The time range of the
+    newly inserted bars is recorded in rollup_pending for refresh_rollups, and the
+    ingest_watermarks of the series that got new bars are advanced in the same statement
+    (series whose bars were all stored already are left untouched). When new bars land at or
+    before a series' previous watermark, its history_updated_at is set as well, so readers
+    can tell appended bars from rewritten history, and the first of them is queued in
+    feature_pending for update_features. The transaction is committed once; on any
+    failure (creating a partition included) it is rolled back, so the connection stays
+    usable for the next batch, and the error is re-raised.
+
+    Bars that have not closed yet are dropped, so a watermark never points at a bar whose
+    values can still change.
+
+    Parameters:
+    - connection: An open psycopg2 connection.
+    - df (pd.DataFrame): Klines as returned by decode_klines.
+
+    Returns:
+    - int: Number of rows actually inserted (duplicates are skipped).
+    """
+    df = df[df['close_time'] < int(time.time() * 1000)]
+    if df.empty:
+        return 0
+
+    buffer = io.StringIO()
+    df[KLINE_COLUMNS].to_csv(buffer, sep='\t', header=False, index=False)
+    buffer.seek(0)
+
+    columns = ", ".join(KLINE_COLUMNS)
+    try:
+        # Make sure the time partitions of the batch exist before writing into them
+        for interval, bars in df.groupby('interval'):
+            ensure_partitions(connection, interval, int(bars['open_time'].min()), int(bars['open_time'].max()))
+
+        with connection.cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE kline_staging (
+                    symbol VARCHAR(20),
+                    currency VARCHAR(3),
+                    interval VARCHAR(8),
+                    open_time BIGINT,
+                    open_price DOUBLE PRECISION,
+                    high_price DOUBLE PRECISION,
+                    low_price DOUBLE PRECISION,
+                    close_price DOUBLE PRECISION,
+                    volume DOUBLE PRECISION,
+                    close_time BIGINT,
+                    trade_count INTEGER
+                ) ON COMMIT DROP;
+            """)
+            cur.copy_expert(f"COPY kline_staging ({columns}) FROM STDIN", buffer)
+            cur.execute(f"""
+                WITH inserted AS (
+                    INSERT INTO combined_table ({columns})
+                    SELECT symbol, currency, interval,
+                           to_timestamp(open_time / 1000.0) AT TIME ZONE 'UTC',
+                           open_price, high_price, low_price, close_price, volume,
+                           to_timestamp(close_time / 1000.0) AT TIME ZONE 'UTC',
+                           trade_count
+                    FROM kline_staging
+                    ON CONFLICT (symbol, currency, interval, open_time) DO NOTHING
+                    RETURNING symbol, currency, interval, open_time
+                ),
+                pending AS (
+                    INSERT INTO rollup_pending (symbol, currency, interval, first_open_time, last_open_time)
+                    SELECT symbol, currency, interval, MIN(open_time), MAX(open_time)
+                    FROM inserted
+                    GROUP BY symbol, currency, interval
+                    ON CONFLICT (symbol, currency, interval) DO UPDATE
+                    SET first_open_time = LEAST(rollup_pending.first_open_time, EXCLUDED.first_open_time),
+                        last_open_time = GREATEST(rollup_pending.last_open_time, EXCLUDED.last_open_time)
+                ),
+                rewrites AS (
+                    -- Bars at or before the previous watermark: their features and those after them are recomputed
+                    INSERT INTO feature_pending (symbol, currency, interval, first_open_time)
+                    SELECT i.symbol, i.currency, i.interval, MIN(i.open_time)
+                    FROM inserted i
+                    JOIN ingest_watermarks w USING (symbol, currency, interval)
+                    WHERE i.open_time <= w.last_open_time
+                    GROUP BY i.symbol, i.currency, i.interval
+                    ON CONFLICT (symbol, currency, interval) DO UPDATE
+                    SET first_open_time = LEAST(feature_pending.first_open_time, EXCLUDED.first_open_time)
+                ),
+                watermarks AS (
+                    -- Only series that got new bars; bars at or before the previous watermark rewrite its history
+                    INSERT INTO ingest_watermarks (symbol, currency, interval, last_open_time, updated_at, history_updated_at)
+                    SELECT i.symbol, i.currency, i.interval, MAX(i.open_time), now() AT TIME ZONE 'UTC',
+                           CASE WHEN MIN(i.open_time) <= MAX(w.last_open_time) THEN now() AT TIME ZONE 'UTC' END
+                    FROM inserted i
+                    LEFT JOIN ingest_watermarks w USING (symbol, currency, interval)
+                    GROUP BY i.symbol, i.currency, i.interval
+                    ON CONFLICT (symbol, currency, interval) DO UPDATE
+                    SET last_open_time = GREATEST(ingest_watermarks.last_open_time, EXCLUDED.last_open_time),
+                        updated_at = EXCLUDED.updated_at,
+                        history_updated_at = COALESCE(EXCLUDED.history_updated_at, ingest_watermarks.history_updated_at)
+                )
+                SELECT COUNT(*) FROM inserted;
+            """)
+            inserted = cur.fetchone()[0]
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    logging.info(f"Wrote {inserted} of {len(df)} klines to combined_table.")
+    return inserted
+
+
+class QueuedWriter:
+    """
+    Write decoded pages with write_klines from a background thread, fed through a bounded queue.
+
+    put() blocks while max_queued pages are waiting, so a database that cannot keep up holds
+    back the stages feeding it instead of letting decoded pages pile up in memory. Each page
+    is still written (and committed) on its own; a page that fails to write is recorded in
+    `failures` and does not stop the others. The connection must not be used elsewhere until
+    close() has returned.
+    """
+
+    def __init__(self, connection, max_queued, metrics=None):
+        """
+        Parameters:
+        - connection: An open psycopg2 connection.
+        - max_queued (int): Number of pages that may wait for the writer.
+        - metrics (IngestMetrics): Optional collector of the 'write' stage timings.
+        """
+        self.connection = connection
+        self.metrics = metrics
+        self.inserted = 0
+        self.failures = []
+        self._queue = queue.Queue(maxsize=max(max_queued, 1))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, df = item
+            try:
+                with measure(self.metrics, 'write', request.symbol, request.interval) as counts:
+                    counts['rows'] = write_klines(self.connection, df)
+                self.inserted += counts['rows']
+            except Exception as e:
+                logging.error(f"Error inserting data for {request.symbol} {request.interval} from {request.start_time}: {e}")
+                self.failures.append((request, e))
+
+    def put(self, request, df):
+        """Queue a page (its KlineRequest and decoded DataFrame) for writing, waiting while the queue is full."""
+        self._queue.put((request, df))
+
+    def close(self):
+        """
+        Write the remaining queued pages and stop the writer thread.
+
+        Returns:
+        - int: Number of rows inserted over all pages.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        return self.inserted